@@ -3,12 +3,24 @@
 Route module for the API
 """
 from os import getenv
-from api.v1.views import app_views
+from api.v1.config import configure_models
+from models.base import Base
+from models.storage import ReadOnlyError
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
+from api.v1.json_provider import use_compact_json
+from api.v1.views import app_views
+from models.user import User
 import os
 
+STORAGE_TYPE = getenv('STORAGE_TYPE')
+
+# The storage must be selected before the users are loaded
+configure_models()
+User.load_from_file()
+
 app = Flask(__name__)
+use_compact_json(app)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 auth = None
@@ -23,9 +35,27 @@ elif AUTH_TYPE == 'basic_auth':
     auth = BasicAuth()
 elif AUTH_TYPE == 'session_auth':
     from api.v1.auth.session_auth import SessionAuth
+    if getenv('SESSION_ID_GENERATOR'):
+        from models.ids import id_generator
+        SessionAuth.session_ids = id_generator(getenv('SESSION_ID_GENERATOR'))
     auth = SessionAuth()
 
 
+@app.before_request
+def sync_storage():
+    """apply the changes made to the storage by the other workers"""
+    Base.storage.sync()
+
+
+@app.before_request
+def reject_writes():
+    """refuse the requests changing the users on a replica"""
+    if STORAGE_TYPE == 'replica' and \
+            request.method not in ('GET', 'HEAD', 'OPTIONS') and \
+            not request.path.startswith('/api/v1/auth_session/'):
+        raise ReadOnlyError()
+
+
 @app.before_request
 def before_request():
     """method to handle before_request for authentication of user"""
@@ -55,6 +85,12 @@ def not_found(error) -> str:
     return jsonify({"error": "Not found"}), 404
 
 
+@app.errorhandler(ReadOnlyError)
+def read_only(error) -> str:
+    """return 405 for a write sent to a read-only replica"""
+    return jsonify({"error": str(error)}), 405
+
+
 @app.errorhandler(401)
 def unauthorized(error) -> str:
     """return 401 for unauthorized request"""
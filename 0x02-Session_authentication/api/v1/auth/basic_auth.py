@@ -99,12 +99,9 @@ class BasicAuth(Auth):
         if user_pwd is None or not isinstance(user_pwd, str):
             return None
 
-        # Search for the user by email using the User class method `search`
+        # Look for the user by email, stopping at the first valid password
         try:
-            user_list = User.search({'email': user_email})
-            if not user_list or user_list == []:
-                return None
-            for user_eml in user_list:
+            for user_eml in User.iter_search({'email': user_email}):
                 if user_eml.is_valid_password(user_pwd):
                     return user_eml
             return None
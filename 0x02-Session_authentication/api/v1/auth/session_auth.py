@@ -3,13 +3,15 @@
 module for authenticsting the session
 """
 from .auth import Auth
+from models.ids import RandomIds
 from models.user import User
-import uuid
 
 
 class SessionAuth(Auth):
     """SessionAuth that inherits from Auth"""
     user_id_by_session_id = {}
+    # Generator of the session IDs (see models.ids)
+    session_ids = RandomIds()
 
     def create_session(self, user_id: str = None) -> str:
         """
@@ -22,7 +24,7 @@ class SessionAuth(Auth):
         """
         if not isinstance(user_id, str) or user_id is None:
             return None
-        session_id = str(uuid.uuid4())
+        session_id = self.session_ids()
         self.user_id_by_session_id[session_id] = user_id
         return session_id
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+""" Configuration of the models from the environment, shared by the
+API and the command-line tools
+"""
+from os import getenv
+from models.base import Base
+
+
+def configure_models():
+    """ Select the storage of the models and their options from the
+    environment (STORAGE_TYPE, ID_GENERATOR, CACHE_JSON, COLUMNAR,
+    SORTED_INDEXES, QUERY_CACHE_SIZE, CHANGE_LOG, TOMBSTONES...). Must
+    be called before loading them
+    """
+    storage_type = getenv('STORAGE_TYPE')
+    if storage_type == 'sqlite':
+        from models.sqlite_storage import SQLiteStorage
+        Base.storage = SQLiteStorage(getenv('SQLITE_DB', '.db.sqlite3'))
+    elif storage_type == 'shared_table':
+        from models.shared_table import SharedTableStorage
+        Base.storage = SharedTableStorage()
+    elif storage_type == 'replica':
+        # Read-only copy of a primary, following its change log
+        from models.replica import ReplicaStorage
+        Base.storage = ReplicaStorage(
+            getenv('CHANGE_LOG', '.db_changes.ndjson'),
+            sync_interval=float(getenv('STORAGE_SYNC_INTERVAL', 0)),
+            shards=int(getenv('STORAGE_SHARDS', 0)),
+            binary=getenv('STORAGE_FORMAT') == 'binary')
+    elif storage_type == 'spill':
+        # Only the indexes and the most recently used users stay in memory
+        from models.spill_storage import SpillStorage
+        Base.storage = SpillStorage(int(getenv('STORAGE_MAX_OBJECTS', 10000)))
+    elif getenv('STORAGE_SHARED') or getenv('STORAGE_SHARDS') or \
+            getenv('STORAGE_FORMAT') == 'binary':
+        # Several workers on the same files: pick up each other's changes.
+        # Sharded: one file per hash of the IDs, rewritten alone on a change
+        from models.file_storage import FileStorage
+        Base.storage = FileStorage(
+            shared=bool(getenv('STORAGE_SHARED')),
+            sync_interval=float(getenv('STORAGE_SYNC_INTERVAL', 0)),
+            shards=int(getenv('STORAGE_SHARDS', 0)),
+            binary=getenv('STORAGE_FORMAT') == 'binary')
+
+    if getenv('ID_GENERATOR'):
+        # uuid7: time-ordered IDs, appended at the end of the ordered indexes
+        from models.ids import id_generator
+        Base.id_generator = id_generator(getenv('ID_GENERATOR'))
+
+    if getenv('CACHE_JSON'):
+        # Keep the JSON of every user served: faster GET /api/v1/users,
+        # for about 460 more bytes per user
+        Base.cache_json = True
+
+    if getenv('COLUMNAR'):
+        # Column store of the users, kept by the file storages: counts
+        # and filters on any field, e.g. users created in a date range
+        from models.user import User
+        User.columnar = True
+
+    if getenv('SORTED_INDEXES'):
+        # e.g. email,created_at,updated_at: prefix queries on the emails,
+        # ordered listings of the users, and GET /api/v1/users?
+        # updated_since= without sorting them all. About 100 bytes per
+        # user and index
+        from models.user import User
+        User.sorted_indexes += tuple(
+            name for name in getenv('SORTED_INDEXES').split(',')
+            if name and name not in User.sorted_indexes)
+
+    if getenv('QUERY_CACHE_SIZE'):
+        from models.cache import QueryCache
+        Base.query_cache = QueryCache(int(getenv('QUERY_CACHE_SIZE')))
+
+    if getenv('CHANGE_LOG') and storage_type != 'replica':
+        # Publish every change of the models to a tail-able NDJSON file
+        from models.events import ChangeLog
+        Base.events.log = ChangeLog(getenv('CHANGE_LOG'))
+
+    if getenv('TOMBSTONES'):
+        # File of the tombstones of the removed users, growing with each
+        # removal, for the mirrors of GET /api/v1/users?updated_since=:
+        # refused without it, listed from a sorted index on updated_at
+        from models.tombstones import Tombstones
+        from models.user import User
+        Base.tombstones = Tombstones(getenv('TOMBSTONES'))
+        if 'updated_at' not in User.sorted_indexes:
+            User.sorted_indexes += ('updated_at',)
+        if storage_type != 'replica':
+            Base.events.subscribe(Base.tombstones)
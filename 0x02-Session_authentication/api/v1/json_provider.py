@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+""" Compact JSON responses: keys in insertion order, no indentation
+"""
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2: configured by JSON_SORT_KEYS only
+    DefaultJSONProvider = None
+
+
+if DefaultJSONProvider is not None:
+    class CompactJSONProvider(DefaultJSONProvider):
+        """ JSON provider neither sorting keys nor indenting
+        """
+        sort_keys = False
+        compact = True
+
+
+def use_compact_json(app):
+    """ Make `jsonify` of an app produce compact JSON
+    """
+    app.config['JSON_SORT_KEYS'] = False
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    if DefaultJSONProvider is not None:
+        app.json = CompactJSONProvider(app)
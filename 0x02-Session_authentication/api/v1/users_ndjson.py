@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+""" Import and export of the users as NDJSON
+
+Export writes one user per line in its stored form (see Base.to_json),
+streamed from the storage. Import reads users in that form, or with a
+clear "password" instead of "_password": every line is validated, the
+clear passwords are hashed by a process pool and all the users are
+saved at once, as new users. Nothing is saved if a line is invalid, a
+user breaks a unique constraint or has the ID of a stored user:
+existing users are never overwritten.
+
+The storage is the one of the API, selected by the same environment
+variables (see api.v1.config).
+
+Usage: python3 -m api.v1.users_ndjson export|import [file]
+The standard output or input is used without file, or with "-".
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, TextIO, Tuple
+import json
+import os
+import sys
+from api.v1.config import configure_models
+from models.base import TIMESTAMP_FORMAT, VersionConflictError
+from models.user import User
+
+
+NAMES = ('first_name', 'last_name')
+MAX_ERRORS = 20
+
+
+def validate(record) -> str:
+    """ Error of an imported record, None if valid
+    """
+    if type(record) is not dict:
+        return "not a JSON object"
+    unknown = set(record) - set(User.fields()) - {'password'}
+    if len(unknown) > 0:
+        return "unknown fields: {}".format(", ".join(sorted(unknown)))
+    if type(record.get('email')) is not str or record['email'] == "":
+        return "email missing"
+    if ('password' in record) == ('_password' in record):
+        return "one of password and _password expected"
+    password = record.get('password', record.get('_password'))
+    if type(password) is not str or password == "":
+        return "password missing"
+    if type(record.get('id', "")) is not str:
+        return "id must be a string"
+    for name in NAMES:
+        if record.get(name) is not None and type(record[name]) is not str:
+            return "{} must be a string".format(name)
+    for name in ('created_at', 'updated_at'):
+        if record.get(name) is not None:
+            try:
+                datetime.strptime(record[name], TIMESTAMP_FORMAT)
+            except (TypeError, ValueError):
+                return "{} must be formatted as {}".format(
+                    name, TIMESTAMP_FORMAT)
+    if type(record.get('version', 0)) is not int:
+        return "version must be an integer"
+    return None
+
+
+def read_records(lines: Iterable[str]) -> Tuple[List[dict], List[str]]:
+    """ (valid records, errors) of NDJSON lines. Emails and IDs
+    repeated within the lines are errors
+    """
+    records = []
+    errors = []
+    emails = set()
+    ids = set()
+    for n, line in enumerate(lines, 1):
+        if line.strip() == "":
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            error = "invalid JSON"
+        else:
+            error = validate(record)
+        if error is None and record['email'] in emails:
+            error = "email {} repeated".format(record['email'])
+        if error is None and record.get('id') in ids:
+            error = "id {} repeated".format(record['id'])
+        if error is not None:
+            errors.append("line {}: {}".format(n, error))
+            continue
+        emails.add(record['email'])
+        if 'id' in record:
+            ids.add(record['id'])
+        records.append(record)
+    return records, errors
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    """ Hashes of clear passwords, computed in parallel by a process
+    per CPU
+    """
+    workers = min(os.cpu_count() or 1, len(passwords))
+    if workers <= 1:
+        return [User.hash_password(pwd) for pwd in passwords]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(User.hash_password, passwords,
+                             chunksize=len(passwords) // (workers * 4) + 1))
+
+
+def import_users(f: TextIO) -> int:
+    """ Save the users of an NDJSON file at once. Raises ValueError,
+    saving nothing, if a line isn't valid or a user is already stored.
+    Returns the number saved
+    """
+    records, errors = read_records(f)
+    if len(errors) > 0:
+        raise ValueError("\n".join(errors))
+    clear = [i for i, record in enumerate(records) if 'password' in record]
+    hashes = hash_passwords([records[i].pop('password') for i in clear])
+    for i, hashed in zip(clear, hashes):
+        records[i]['_password'] = hashed
+    users = [User(**record) for record in records]
+    try:
+        with User.transaction():
+            for user in users:
+                # Version 0: not stored, checked as the users are saved
+                user.save(expected_version=0)
+    except VersionConflictError as e:
+        raise ValueError("id {} already stored".format(e.obj_id)) from e
+    return len(users)
+
+
+def export_users(f: TextIO) -> int:
+    """ Write the users to an NDJSON file one at a time. Returns the
+    number written
+    """
+    n = 0
+    for user in User.all():
+        f.write(json.dumps(user.to_json(True)) + "\n")
+        n += 1
+    return n
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('import', 'export'):
+        print("Usage: python3 -m api.v1.users_ndjson export|import [file]")
+        sys.exit(1)
+    file_path = sys.argv[2] if len(sys.argv) == 3 else "-"
+    configure_models()
+    User.load_from_file()
+    if sys.argv[1] == 'export':
+        if file_path == "-":
+            n = export_users(sys.stdout)
+        else:
+            with open(file_path, 'w') as f:
+                n = export_users(f)
+        print("{} users exported".format(n), file=sys.stderr)
+        sys.exit(0)
+    try:
+        if file_path == "-":
+            n = import_users(sys.stdin)
+        else:
+            with open(file_path, 'r') as f:
+                n = import_users(f)
+    except ValueError as e:
+        # Invalid lines, or a user already stored with the same email
+        # or ID
+        lines = str(e).split("\n")
+        for line in lines[:MAX_ERRORS]:
+            print(line, file=sys.stderr)
+        if len(lines) > MAX_ERRORS:
+            print("... {} more errors".format(len(lines) - MAX_ERRORS),
+                  file=sys.stderr)
+        print("Nothing imported", file=sys.stderr)
+        sys.exit(1)
+    print("{} users imported".format(n), file=sys.stderr)
@@ -23,6 +23,10 @@ def stats() -> str:
     from models.user import User
     stats = {}
     stats['users'] = User.count()
+    if User.query_cache is not None:
+        stats['query_cache'] = User.query_cache.stats()
+    if hasattr(User.storage, 'stats'):
+        stats['storage'] = User.storage.stats()
     return jsonify(stats)
 
 
@@ -2,18 +2,125 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from datetime import datetime
+from flask import Response, abort, jsonify, request
+from models.base import (UniqueConstraintError, VersionConflictError,
+                         TIMESTAMP_FORMAT)
 from models.user import User
+import base64
+import copy
+import heapq
+import re
+from itertools import islice
+
+SYNC_LIMIT = 100
+SYNC_MAX_LIMIT = 1000
+# An entity-tag of a list (RFC 7232), weak if prefixed with W/
+ENTITY_TAG = re.compile(r'\s*(W/)?"([^"]*)"\s*(?:,|$)')
+
+
+def with_etag(response, user: User):
+    """ Response carrying the version of a user as ETag
+    """
+    response.headers['ETag'] = '"{}"'.format(user.version)
+    return response
+
+
+def if_match() -> set:
+    """ Strong entity-tags of the If-Match header, None if absent or *:
+    a weak one never matches (RFC 7232 strong comparison). Raises
+    ValueError if it isn't a list of entity-tags
+    """
+    value = request.headers.get('If-Match')
+    if value is None or value.strip() == '*':
+        return None
+    value = value.strip()
+    if value == "":
+        raise ValueError(value)
+    tags = set()
+    position = 0
+    while position < len(value):
+        match = ENTITY_TAG.match(value, position)
+        if match is None:
+            raise ValueError(value)
+        if match.group(1) is None:
+            tags.add(match.group(2))
+        position = match.end()
+    return tags
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional, for mirrors of the users):
+      - updated_since: only the users changed since this date
+        (%Y-%m-%dT%H:%M:%S)
+      - cursor: continue from the cursor of the previous response
+      - limit: maximum number of changes (default 100, at most 1000)
     Return:
       - list of all User objects JSON represented
+      - with updated_since or cursor: the users updated and the
+        tombstones of the users removed, in (date, ID) order, and the
+        cursor of the next request. Once caught up, the cursor points
+        at the start of the last second: it may send some changes again
+      - 400 if a parameter isn't valid
+      - 501 with updated_since or cursor if the tombstones aren't kept
+        (TOMBSTONES names their file, see api.v1.config)
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    since = request.args.get('updated_since')
+    cursor = request.args.get('cursor')
+    if since is None and cursor is None:
+        # The JSON of each user is cached until it changes
+        return Response(b"[" + b",".join(user.to_json_bytes()
+                                         for user in User.all()) + b"]",
+                        mimetype='application/json')
+    if User.tombstones is None:
+        # The users removed would be missed
+        return jsonify({"error": "updated_since and cursor need "
+                                 "TOMBSTONES"}), 501
+    try:
+        limit = int(request.args.get('limit', SYNC_LIMIT))
+        if limit < 1 or limit > SYNC_MAX_LIMIT:
+            raise ValueError()
+    except ValueError:
+        return jsonify({"error": "limit must be between 1 and {}".format(
+            SYNC_MAX_LIMIT)}), 400
+    try:
+        if cursor is not None:
+            since, after_id = base64.urlsafe_b64decode(
+                cursor.encode()).decode().split("|", 1)
+        else:
+            after_id = ""
+        since = datetime.strptime(since, TIMESTAMP_FORMAT)
+    except ValueError:
+        return jsonify({"error": "invalid updated_since or cursor"}), 400
+
+    updated = ((user.updated_at, user.id, user)
+               for user in User.updated_since(since, after_id))
+    removed = ((removed_at, user_id, None)
+               for removed_at, user_id in User.removed_since(since, after_id))
+    changes = list(islice(heapq.merge(updated, removed,
+                                      key=lambda change: change[:2]),
+                          limit + 1))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    users = []
+    tombstones = []
+    for date, user_id, user in changes:
+        if user is not None:
+            users.append(user.to_json())
+        else:
+            tombstones.append({'id': user_id,
+                               'removed_at': date.strftime(TIMESTAMP_FORMAT)})
+    if len(changes) > 0:
+        since, after_id = changes[-1][:2]
+        if not has_more:
+            # Later changes may share the last second
+            after_id = ""
+    next_cursor = base64.urlsafe_b64encode("{}|{}".format(
+        since.strftime(TIMESTAMP_FORMAT), after_id).encode()).decode()
+    return jsonify({'users': users, 'removed': tombstones,
+                    'cursor': next_cursor, 'has_more': has_more})
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -22,7 +129,7 @@ def view_one_user(user_id: str = None) -> str:
         Path parameter:
         - User ID
         Return:
-        - User object JSON represented
+        - User object JSON represented, with its version as ETag
         - 404 if the User ID doesn't exist
     """
     if user_id is None:
@@ -34,14 +141,14 @@ def view_one_user(user_id: str = None) -> str:
             abort(404)
         else:
             auth_user = request.current_user
-            return jsonify(auth_user.to_json())
+            return with_etag(jsonify(auth_user.to_json()), auth_user)
 
     # Get user by user_id
     user = User.get(user_id)
     if user is None:
         abort(404)
 
-    return jsonify(user.to_json())
+    return with_etag(jsonify(user.to_json()), user)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -71,7 +178,7 @@ def create_user() -> str:
       - last_name (optional)
       - first_name (optional)
     Return:
-      - User object JSON represented
+      - User object JSON represented, with its version as ETag
       - 400 if can't create the new User
     """
     rj = None
@@ -94,7 +201,9 @@ def create_user() -> str:
             user.first_name = rj.get("first_name")
             user.last_name = rj.get("last_name")
             user.save()
-            return jsonify(user.to_json()), 201
+            return with_etag(jsonify(user.to_json()), user), 201
+        except UniqueConstraintError as e:
+            error_msg = "{}".format(e)
         except Exception as e:
             error_msg = "Can't create User: {}".format(e)
     return jsonify({'error': error_msg}), 400
@@ -105,19 +214,34 @@ def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
     Path parameter:
       - User ID
+    Header (optional):
+      - If-Match: ETag of the User as last read, or a list of them:
+        the update is only made if the User is still at one of them
     JSON body:
       - last_name (optional)
       - first_name (optional)
     Return:
-      - User object JSON represented
+      - User object JSON represented, with its new version as ETag
       - 404 if the User ID doesn't exist
       - 400 if can't update the User
+      - 412 if the User isn't at a version of If-Match anymore, or
+        If-Match only has weak ETags
     """
     if user_id is None:
         abort(404)
     user = User.get(user_id)
     if user is None:
         abort(404)
+    try:
+        tags = if_match()
+    except ValueError:
+        return jsonify({'error': "Wrong If-Match"}), 400
+    expected = None
+    if tags is not None:
+        if str(user.version) not in tags:
+            return with_etag(jsonify({'error': "Precondition failed"}),
+                             user), 412
+        expected = user.version
     rj = None
     try:
         rj = request.get_json()
@@ -125,9 +249,18 @@ def update_user(user_id: str = None) -> str:
         rj = None
     if rj is None:
         return jsonify({'error': "Wrong format"}), 400
+    # Changed in a copy: the stored user is replaced only if saved
+    user = copy.copy(user)
     if rj.get('first_name') is not None:
         user.first_name = rj.get('first_name')
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
-    user.save()
-    return jsonify(user.to_json()), 200
+    try:
+        user.save(expected_version=expected)
+    except VersionConflictError:
+        user = User.get(user_id)
+        if user is None:
+            abort(404)
+        return with_etag(jsonify({'error': "Precondition failed"}), user), \
+            412
+    return with_etag(jsonify(user.to_json()), user), 200
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+""" Benchmarks of the models storage
+
+Run from the project directory, e.g.: python3 -m benchmarks.memory
+"""
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+""" Mixed read/write load on the User store from several threads
+
+Readers get users by ID, search them by email and iterate over all of
+them while one writer creates, updates and removes users. Reports the
+read throughput for each number of reader threads and every error
+raised (e.g. "dictionary changed size during iteration").
+
+Usage: python3 -m benchmarks.concurrency [users] [seconds]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.synthetic import email, user_records, write_users
+from models.user import User
+
+
+def reader(ids: list, stop: threading.Event, results: list, errors: list):
+    """ Read until stopped, counting the operations
+    """
+    rnd = random.Random()
+    done = 0
+    try:
+        while not stop.is_set():
+            i = rnd.randrange(len(ids))
+            User.get(ids[i])
+            User.search({'email': email(i)})
+            if done % 50 == 0:
+                for user in User.all():
+                    pass
+            done += 1
+    except Exception as e:
+        errors.append(repr(e))
+    results.append(done)
+
+
+def writer(stop: threading.Event, errors: list):
+    """ Create, update and remove users until stopped
+    """
+    try:
+        while not stop.is_set():
+            user = User(email="writer@hbtn.io")
+            user.save()
+            user.first_name = "W"
+            user.save()
+            user.remove()
+    except Exception as e:
+        errors.append(repr(e))
+
+
+def run(ids: list, n_readers: int, seconds: float) -> tuple:
+    """ Reads per second and errors with n reader threads
+    """
+    stop = threading.Event()
+    results = []
+    errors = []
+    threads = [threading.Thread(target=writer, args=(stop, errors))]
+    for _ in range(n_readers):
+        threads.append(threading.Thread(target=reader,
+                                        args=(ids, stop, results, errors)))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sum(results) / seconds, errors
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    os.chdir(tempfile.mkdtemp())
+    write_users(n)
+    User.load_from_file()
+    ids = [record['id'] for record in user_records(n)]
+    for n_readers in (1, 2, 4, 8):
+        throughput, errors = run(ids, n_readers, seconds)
+        print("readers: {} reads/s: {:.0f} errors: {}".format(
+            n_readers, throughput, len(errors)))
+        for error in sorted(set(errors)):
+            print("  {}".format(error))
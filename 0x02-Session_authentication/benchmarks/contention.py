@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+""" Contention of SessionAuth and the User store between workers
+
+Every worker repeats, for a number of seconds: create a session for a
+random user, look it up, get a user by ID, search one by email, save
+one of the users it owns (every SAVE_EVERY rounds) and destroy the
+session it created, keeping one session in KEEP_EVERY alive. The
+workers are threads of one process, sharing the class-level
+SessionAuth.user_id_by_session_id and the objects of the storage, or
+processes, each with its own sessions and storage object on the same
+files. Thread workers also race to destroy a pool of shared sessions.
+
+For each number of workers, reports the throughput (operations per
+second, and its ratio to one worker), the p50 and p99 latencies of
+each operation, every error raised (e.g. "dictionary changed size
+during iteration") and every invariant violated:
+- a session created isn't found, or found for another user
+- a session destroyed is still found, or destroying a live session
+  fails
+- a shared session is destroyed more than once
+- the sessions kept alive aren't all found at the end, or the number
+  of sessions isn't the expected one
+- a user saved doesn't have its last saved value once reloaded from
+  the storage (lost update), or the number of users changed
+
+Exits with status 1 if an error was raised or an invariant violated.
+
+Usage: python3 -m benchmarks.contention [--workers 1,2,4,8]
+           [--modes threads,processes] [--seconds 2] [--users 1000]
+           [--storage file|shared|sqlite] [--seed 0]
+           [--output results.json]
+"""
+from multiprocessing import Pool
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from api.v1.auth.session_auth import SessionAuth
+from benchmarks.synthetic import email, user_records, write_users
+from models.base import Base
+from models.file_storage import FileStorage
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+
+
+STORAGES = {
+    'file': FileStorage,
+    'shared': lambda: FileStorage(shared=True),
+    'sqlite': SQLiteStorage,
+}
+OPERATIONS = ('create_session', 'user_id_for_session_id', 'destroy_session',
+              'get', 'search', 'save')
+SAVE_EVERY = 10
+KEEP_EVERY = 10
+SHARED_SESSIONS = 1000
+SESSION_NAME = "_my_session_id"
+
+
+class Request():
+    """ Request carrying a session cookie, as read by
+    SessionAuth.destroy_session
+    """
+
+    def __init__(self, session_id: str):
+        """ Initialize with the session ID of the cookie
+        """
+        self.cookies = {SESSION_NAME: session_id}
+
+
+def percentile(values: list, p: float) -> float:
+    """ p-th percentile of sorted values
+    """
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def work(worker: int, user_ids: list, owned: list, shared: list,
+         start: float, seconds: float, seed: int) -> dict:
+    """ Run the operations from `start` for a number of seconds.
+    Returns the latencies of each operation, the errors, the
+    violations, the sessions kept alive, the last value saved of each
+    owned user and the shared sessions destroyed
+    """
+    rng = random.Random(seed * 1000 + worker)
+    auth = SessionAuth()
+    latencies = {name: [] for name in OPERATIONS}
+    result = {'latencies': latencies, 'errors': [], 'violations': [],
+              'kept': {}, 'saved': {}, 'destroyed': []}
+    shared = list(shared)
+    rng.shuffle(shared)
+
+    def timed(name: str, function, *args):
+        """ Call a function, recording its latency
+        """
+        begin = time.perf_counter()
+        value = function(*args)
+        latencies[name].append(time.perf_counter() - begin)
+        return value
+
+    while time.perf_counter() < start:
+        time.sleep(0.001)
+    n = 0
+    end = start + seconds
+    while time.perf_counter() < end:
+        try:
+            user_id = rng.choice(user_ids)
+            session_id = timed('create_session', auth.create_session,
+                               user_id)
+            found = timed('user_id_for_session_id',
+                          auth.user_id_for_session_id, session_id)
+            if found != user_id:
+                result['violations'].append(
+                    "session created for {} found for {}".format(
+                        user_id, found))
+            timed('get', User.get, rng.choice(user_ids))
+            timed('search', User.search,
+                  {'email': email(rng.randrange(len(user_ids)))})
+            if n % SAVE_EVERY == 0 and len(owned) > 0:
+                obj_id = owned[(n // SAVE_EVERY) % len(owned)]
+                # Saved from a copy, as PUT /users/<id> does
+                user = copy.copy(User.get(obj_id))
+                user.first_name = "{}-{}".format(worker, n)
+                timed('save', user.save)
+                result['saved'][obj_id] = user.first_name
+            if n % KEEP_EVERY == 0:
+                result['kept'][session_id] = user_id
+            else:
+                if not timed('destroy_session', auth.destroy_session,
+                             Request(session_id)):
+                    result['violations'].append(
+                        "live session not destroyed")
+                if auth.user_id_for_session_id(session_id) is not None:
+                    result['violations'].append(
+                        "destroyed session still found")
+            if n < len(shared):
+                if timed('destroy_session', auth.destroy_session,
+                         Request(shared[n])):
+                    result['destroyed'].append(shared[n])
+        except Exception as e:
+            result['errors'].append(repr(e))
+        n += 1
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def load(storage: str):
+    """ Give the models a new storage object and load the users
+    """
+    Base.storage = STORAGES[storage]()
+    User.load_from_file()
+
+
+def work_in_process(storage: str, *args) -> dict:
+    """ Run the operations in a worker process, on its own storage
+    object
+    """
+    load(storage)
+    return work(*args)
+
+
+def run_threads(n_workers: int, user_ids: list, seconds: float,
+                seed: int) -> tuple:
+    """ Results of workers running in threads, and the violations
+    found on the sessions they share
+    """
+    auth = SessionAuth()
+    shared = [auth.create_session(user_ids[i % len(user_ids)])
+              for i in range(SHARED_SESSIONS)]
+    results = [None] * n_workers
+    start = time.perf_counter() + 0.1
+
+    def target(worker: int):
+        """ Keep the result of a worker
+        """
+        results[worker] = work(worker, user_ids, user_ids[worker::n_workers],
+                               shared, start, seconds, seed)
+
+    threads = [threading.Thread(target=target, args=(worker,))
+               for worker in range(n_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    destroyed = {}
+    for result in results:
+        for session_id in result['destroyed']:
+            destroyed[session_id] = destroyed.get(session_id, 0) + 1
+    violations = []
+    for session_id, times in destroyed.items():
+        if times > 1:
+            violations.append("shared session destroyed {} times".format(
+                times))
+        if auth.user_id_for_session_id(session_id) is not None:
+            violations.append("destroyed shared session still found")
+    kept = sum(len(result['kept']) for result in results)
+    expected = SHARED_SESSIONS - len(destroyed) + kept
+    if len(SessionAuth.user_id_by_session_id) != expected:
+        violations.append("{} sessions, {} expected".format(
+            len(SessionAuth.user_id_by_session_id), expected))
+    return results, violations
+
+
+def run_processes(n_workers: int, user_ids: list, seconds: float,
+                  seed: int, storage: str) -> tuple:
+    """ Results of workers running in processes, without shared
+    sessions: no violations
+    """
+    # Starts once every process had the time to load the users
+    start = time.perf_counter() + 1 + len(user_ids) / 20000
+    with Pool(n_workers) as pool:
+        results = pool.starmap(work_in_process, [
+            (storage, worker, user_ids, user_ids[worker::n_workers], [],
+             start, seconds, seed) for worker in range(n_workers)])
+    return results, []
+
+
+def run(mode: str, n_workers: int, n_users: int, seconds: float,
+        seed: int, storage: str) -> dict:
+    """ Throughput, latencies, errors and violations of a number of
+    workers, on the users written in the current directory
+    """
+    user_ids = [record['id'] for record in user_records(n_users, seed)]
+    write_users(n_users, seed)
+    load(storage)
+    SessionAuth.user_id_by_session_id.clear()
+    if mode == 'threads':
+        results, violations = run_threads(n_workers, user_ids, seconds,
+                                          seed)
+    else:
+        results, violations = run_processes(n_workers, user_ids, seconds,
+                                            seed, storage)
+    errors = []
+    latencies = {name: [] for name in OPERATIONS}
+    for result in results:
+        errors.extend(result['errors'])
+        violations.extend(result['violations'])
+        for name, values in result['latencies'].items():
+            latencies[name].extend(values)
+        # Sessions of the processes aren't in this one
+        if mode == 'threads':
+            for session_id, user_id in result['kept'].items():
+                found = SessionAuth().user_id_for_session_id(session_id)
+                if found != user_id:
+                    violations.append(
+                        "session kept for {} found for {}".format(
+                            user_id, found))
+    # Reloaded from the files: the saves of every worker are expected.
+    # Processes not sharing their changes (STORAGES['file']) overwrite
+    # each other's saves
+    try:
+        load(storage)
+        reloaded = True
+    except ValueError as e:
+        violations.append("users not reloaded: {!r}".format(e))
+        reloaded = False
+    if reloaded and User.count() != n_users:
+        violations.append("{} users, {} expected".format(User.count(),
+                                                         n_users))
+    for result in results if reloaded else []:
+        for obj_id, first_name in result['saved'].items():
+            user = User.get(obj_id)
+            if user is None or user.first_name != first_name:
+                violations.append("lost update")
+    report = {
+        'workers': n_workers,
+        # Each worker measured its own run
+        'ops_per_second': sum(
+            sum(len(values) for values in result['latencies'].values()) /
+            result['seconds'] for result in results),
+        'ops': sum(len(values) for values in latencies.values()),
+        'latencies_us': {},
+        'errors': errors,
+        'violations': violations,
+    }
+    for name, values in latencies.items():
+        values = sorted(value * 1e6 for value in values)
+        report['latencies_us'][name] = {'ops': len(values),
+                                        'p50': percentile(values, 50),
+                                        'p99': percentile(values, 99)}
+    return report
+
+
+def print_report(mode: str, reports: list):
+    """ Print the scaling curve and latencies of a mode
+    """
+    print("{}:".format(mode))
+    base = reports[0]['ops_per_second'] / reports[0]['workers']
+    for report in reports:
+        print("  workers: {:>3} ops/s: {:>10.0f} scaling: {:>5.2f} "
+              "errors: {} violations: {}".format(
+                  report['workers'], report['ops_per_second'],
+                  report['ops_per_second'] / base, len(report['errors']),
+                  len(report['violations'])))
+        for name, latency in report['latencies_us'].items():
+            if latency['ops'] > 0:
+                print("    {:<24} p50: {:>9.1f}us p99: {:>9.1f}us".format(
+                    name, latency['p50'], latency['p99']))
+        for problem in sorted(set(report['errors'] +
+                                  report['violations'])):
+            n = (report['errors'] + report['violations']).count(problem)
+            print("    {} x {}".format(n, problem))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="SessionAuth and User store contention")
+    parser.add_argument('--workers', default="1,2,4,8")
+    parser.add_argument('--modes', default="threads,processes")
+    parser.add_argument('--seconds', type=float, default=2)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--storage', choices=sorted(STORAGES),
+                        default='file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    os.environ['SESSION_NAME'] = SESSION_NAME
+    results = {'cpus': os.cpu_count(), 'storage': args.storage,
+               'users': args.users, 'seconds': args.seconds}
+    failed = False
+    cwd = os.getcwd()
+    for mode in args.modes.split(","):
+        reports = []
+        for n_workers in [int(n) for n in args.workers.split(",")]:
+            directory = tempfile.mkdtemp()
+            os.chdir(directory)
+            try:
+                reports.append(run(mode, n_workers, args.users,
+                                   args.seconds, args.seed, args.storage))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(directory)
+            failed = failed or len(reports[-1]['errors']) > 0 or \
+                len(reports[-1]['violations']) > 0
+        print_report(mode, reports)
+        results[mode] = reports
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+""" Per-user memory of the compact User representation
+
+Usage: python3 -m benchmarks.memory [number_of_users]
+"""
+from datetime import datetime
+import json
+import sys
+import tracemalloc
+from benchmarks.synthetic import user_records
+from models.base import TIMESTAMP_FORMAT
+from models.user import User
+
+
+class LegacyUser():
+    """ Dict-backed layout of a User before the compact representation
+    """
+
+    def __init__(self, **kwargs):
+        """ Same attributes as User, stored in __dict__
+        """
+        self.id = kwargs.get('id')
+        self.created_at = datetime.strptime(kwargs.get('created_at'),
+                                            TIMESTAMP_FORMAT)
+        self.updated_at = datetime.strptime(kwargs.get('updated_at'),
+                                            TIMESTAMP_FORMAT)
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def records(n: int) -> list:
+    """ n serialized synthetic users, as found in .db_User.json
+    """
+    return [json.dumps(record) for record in user_records(n)]
+
+
+def measure(cls, serialized: list) -> float:
+    """ Bytes allocated per object loaded from serialized records
+    """
+    tracemalloc.start()
+    objs = [cls(**json.loads(r)) for r in serialized]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    return current / len(serialized)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    serialized = records(n)
+    legacy = measure(LegacyUser, serialized)
+    compact = measure(User, serialized)
+    print("users: {}".format(n))
+    print("legacy: {:.1f} bytes/user".format(legacy))
+    print("compact: {:.1f} bytes/user".format(compact))
+    print("ratio: {:.2f}".format(compact / legacy))
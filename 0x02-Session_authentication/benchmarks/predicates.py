@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+""" Unindexed scans: per-attribute getattr loop vs compiled predicate
+
+Searches n in-memory users on 1, 2 and 3 attributes, none of them
+indexed, with the closure Base.search used before (one getattr and
+comparison per attribute) and with models.base.predicate.
+
+Usage: python3 -m benchmarks.predicates [number_of_users]
+"""
+import sys
+import time
+from benchmarks.synthetic import email, user_records
+from models.base import predicate
+from models.user import User
+
+
+# The synthetic user 90 is a Carol Smith: the last query matches it
+QUERIES = [
+    {'first_name': "Carol"},
+    {'first_name': "Carol", 'last_name': "Smith"},
+    {'first_name': "Carol", 'last_name': "Smith", 'email': email(90)},
+]
+
+
+def legacy_predicate(attributes: dict):
+    """ Closure of the search before compiled predicates
+    """
+    def _search(obj):
+        if len(attributes) == 0:
+            return True
+        for k, v in attributes.items():
+            if (getattr(obj, k) != v):
+                return False
+        return True
+    return _search
+
+
+def users(n: int) -> list:
+    """ n synthetic users
+    """
+    return [User(**record) for record in user_records(n)]
+
+
+def timed(make, objs: list, attributes: dict) -> tuple:
+    """ (seconds, matches) of the best of 3 scans
+    """
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        found = sum(1 for _ in filter(make(attributes), objs))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, found
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    objs = users(n)
+    print("users: {}".format(n))
+    for attributes in QUERIES:
+        legacy, found = timed(legacy_predicate, objs, attributes)
+        compiled, found2 = timed(predicate, objs, attributes)
+        assert found == found2
+        print("attributes: {} matches: {} getattr loop: {:.3f}s "
+              "compiled: {:.3f}s speedup: {:.2f}x".format(
+                  len(attributes), found, legacy, compiled,
+                  legacy / compiled))
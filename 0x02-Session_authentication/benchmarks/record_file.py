@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+""" JSON vs binary record files: file size, load and save times
+
+Saves n users in each format, as FileStorage does, then loads them
+back into objects.
+
+Usage: python3 -m benchmarks.record_file [number_of_users]
+"""
+import os
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import user_records
+from models.file_storage import FileStorage, read_file
+from models.user import User
+
+
+def users(n: int) -> dict:
+    """ n synthetic users by ID
+    """
+    return {record['id']: User(**record) for record in user_records(n)}
+
+
+def measure(binary: bool, objs: dict) -> tuple:
+    """ (bytes, load seconds, save seconds) of a format
+    """
+    storage = FileStorage(binary=binary)
+    file_path = storage.data_path(User)
+    start = time.perf_counter()
+    storage.write_file(User, file_path, objs)
+    save = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded = read_file(User, file_path)
+    load = time.perf_counter() - start
+    assert len(loaded) == len(objs)
+    return os.path.getsize(file_path), load, save
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    os.chdir(tempfile.mkdtemp())
+    objs = users(n)
+    print("users: {}".format(n))
+    results = {}
+    for name, binary in (("json", False), ("binary", True)):
+        results[name] = measure(binary, objs)
+        size, load, save = results[name]
+        print("{}: {:.1f} MB load {:.2f}s save {:.2f}s".format(
+            name, size / 1e6, load, save))
+    print("binary/json: size {:.2f} load {:.2f} save {:.2f}".format(
+        *(b / j for b, j in zip(results["binary"], results["json"]))))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+""" Generic vs compiled to_json of n users, with the JSON encoding of
+a response
+
+The generic encoding is the one of Flask's jsonify by default (sorted
+keys, compact separators), the compiled one the compact JSON provider
+of the app (keys in order). The JSON cache of User is disabled.
+
+Usage: python3 -m benchmarks.serializers [number_of_users]
+"""
+import json
+import sys
+import time
+from benchmarks.record_file import users
+from models.user import User
+
+
+def best(function, repeat: int = 5) -> float:
+    """ Best time of a function, in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e3
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    User.cache_json = False
+    objs = list(users(n).values())
+    assert [obj._attributes_json(False) for obj in objs] == \
+        [obj.to_json() for obj in objs]
+    results = [
+        ("generic to_json", best(lambda: [obj._attributes_json(False)
+                                          for obj in objs])),
+        ("compiled to_json", best(lambda: [obj.to_json() for obj in objs])),
+        ("generic + jsonify", best(lambda: json.dumps(
+            [obj._attributes_json(False) for obj in objs],
+            sort_keys=True, separators=(",", ":")))),
+        ("compiled + compact", best(lambda: json.dumps(
+            [obj.to_json() for obj in objs], separators=(",", ":")))),
+    ]
+    print("users: {}".format(n))
+    for name, ms in results:
+        print("{}: {:.1f}ms".format(name, ms))
+    print("speedup: to_json {:.2f} response {:.2f}".format(
+        results[0][1] / results[1][1], results[2][1] / results[3][1]))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+""" Single file vs hash-sharded FileStorage: load and save times
+
+Usage: python3 -m benchmarks.shards [number_of_users] [shards]
+"""
+import os
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import write_users
+from models.base import Base
+from models.file_storage import FileStorage
+from models.user import User
+
+
+def measure(storage: FileStorage, saves: int = 20) -> tuple:
+    """ (load seconds, seconds per save) with a storage
+    """
+    Base.storage = storage
+    User.load_from_file()
+    start = time.perf_counter()
+    User.load_from_file()
+    load = time.perf_counter() - start
+    users = list(User.all())[:saves]
+    start = time.perf_counter()
+    for user in users:
+        user.first_name = "Alice"
+        user.save()
+    return load, (time.perf_counter() - start) / saves
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    os.chdir(tempfile.mkdtemp())
+    write_users(n)
+    print("users: {} cpus: {}".format(n, os.cpu_count()))
+    load, save = measure(FileStorage())
+    print("single file: load {:.2f}s save {:.1f}ms".format(load, save * 1e3))
+    load, save = measure(FileStorage(shards=shards))
+    print("{} shards: load {:.2f}s save {:.1f}ms".format(
+        shards, load, save * 1e3))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+""" Memory held by FileStorage vs SpillStorage, and get times
+
+Loads n users with each storage and measures the memory still
+allocated once loaded, then the time of random gets.
+
+Usage: python3 -m benchmarks.spill [number_of_users] [max_objects]
+"""
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.synthetic import write_users
+from models.base import Base
+from models.file_storage import FileStorage, SNAPSHOTS, DATA
+from models.spill_storage import SpillStorage
+from models.user import User
+
+
+def measure(storage, gets: int = 10000) -> tuple:
+    """ (MB allocated once loaded, µs per random get) with a storage
+    """
+    SNAPSHOTS.clear()
+    DATA.clear()
+    gc.collect()
+    Base.storage = storage
+    tracemalloc.start()
+    User.load_from_file()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    ids = [obj.id for obj in storage.scan(User)]
+    sample = [random.choice(ids) for _ in range(gets)]
+    start = time.perf_counter()
+    for obj_id in sample:
+        User.get(obj_id)
+    return current / 1e6, (time.perf_counter() - start) / gets * 1e6
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    max_objects = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    os.chdir(tempfile.mkdtemp())
+    write_users(n)
+    print("users: {} max_objects: {}".format(n, max_objects))
+    memory, get = measure(FileStorage())
+    print("file: {:.1f} MB get {:.1f}µs".format(memory, get))
+    storage = SpillStorage(max_objects)
+    memory, get = measure(storage)
+    print("spill: {:.1f} MB get {:.1f}µs hits {hits} misses {misses}".format(
+        memory, get, **storage.stats()))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+""" Benchmark suite of the User store
+
+Times load_from_file, save, remove, get, search by email, all, count
+and to_json on deterministic synthetic users (see
+benchmarks.synthetic), for each number of users, in a new directory.
+Results are written as JSON; given a baseline (results of a previous
+run), each scenario is compared by its time per operation and the
+suite exits with status 1 if one got slower than the threshold.
+
+Usage: python3 -m benchmarks.suite [--sizes 10000,100000,1000000]
+           [--storage file|binary|shards|sqlite|spill] [--seed 0]
+           [--output results.json] [--baseline baseline.json]
+           [--threshold 0.25]
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import email, user_records, write_users
+from models.base import Base
+from models.file_storage import FileStorage
+from models.spill_storage import SpillStorage
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+
+
+STORAGES = {
+    'file': FileStorage,
+    'binary': lambda: FileStorage(binary=True),
+    'shards': lambda: FileStorage(shards=16),
+    'sqlite': SQLiteStorage,
+    'spill': SpillStorage,
+}
+GETS = 10000
+SEARCHES = 1000
+COUNTS = 100
+WRITES = 100
+
+
+def timed(function, ops: int, repeat: int = 1) -> dict:
+    """ Best time of `repeat` calls of a function doing `ops`
+    operations
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    return {'ops': ops, 'seconds': seconds,
+            'per_op_us': seconds / ops * 1e6}
+
+
+def save_all(users: list):
+    """ Change and save users one at a time
+    """
+    for user in users:
+        user.first_name = "Saved"
+        user.save()
+
+
+def remove_all(users: list):
+    """ Remove users one at a time
+    """
+    for user in users:
+        user.remove()
+
+
+def run(size: int, storage: str, seed: int) -> dict:
+    """ Results of the scenarios for a number of users
+    """
+    rng = random.Random(seed)
+    ids = [record['id'] for record in user_records(size, seed)]
+    write_users(size, seed)
+    Base.storage = STORAGES[storage]()
+    # Converts the JSON file to the format of the storage
+    User.load_from_file()
+    repeat = 5 if size <= 100000 else 1
+    # Changes rewrite files: fewer of them on many users
+    writes = max(1, min(WRITES, 1000000 // size))
+    sample = [rng.choice(ids) for _ in range(GETS)]
+    emails = [email(rng.randrange(size)) for _ in range(SEARCHES)]
+    results = {}
+    results['load_from_file'] = timed(User.load_from_file, 1, repeat)
+    results['get'] = timed(lambda: [User.get(obj_id) for obj_id in sample],
+                           GETS, repeat)
+    results['search_email'] = timed(
+        lambda: [User.search({'email': e}) for e in emails],
+        SEARCHES, repeat)
+    results['all'] = timed(lambda: sum(1 for _ in User.all()), size, repeat)
+    results['count'] = timed(lambda: [User.count() for _ in range(COUNTS)],
+                             COUNTS, repeat)
+    cache_json = User.cache_json
+    User.cache_json = False
+    results['to_json'] = timed(lambda: [user.to_json()
+                                        for user in User.all()],
+                               size, repeat)
+    User.cache_json = cache_json
+    changed = rng.sample(ids, 2 * writes)
+    results['save'] = timed(lambda: save_all(
+        [User.get(obj_id) for obj_id in changed[:writes]]), writes)
+    results['remove'] = timed(lambda: remove_all(
+        [User.get(obj_id) for obj_id in changed[writes:]]), writes)
+    assert User.count() == size - writes
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """ Print the ratio of the time per operation of each scenario to
+    the baseline. Returns the (size, scenario) slower than the
+    threshold
+    """
+    regressions = []
+    for size, scenarios in results['results'].items():
+        for name, result in scenarios.items():
+            base = baseline['results'].get(size, {}).get(name)
+            if base is None:
+                continue
+            ratio = result['per_op_us'] / base['per_op_us']
+            slower = ratio > 1 + threshold
+            if slower:
+                regressions.append((size, name))
+            print("{:>8} {:<15} {:>12.2f}us {:>12.2f}us {:>6.2f}{}".format(
+                size, name, base['per_op_us'], result['per_op_us'], ratio,
+                " REGRESSION" if slower else ""), file=sys.stderr)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="User store benchmarks")
+    parser.add_argument('--sizes', default="10000,100000,1000000")
+    parser.add_argument('--storage', choices=sorted(STORAGES),
+                        default='file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    args = parser.parse_args()
+    results = {
+        'meta': {'date': datetime.utcnow().isoformat(),
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'cpus': os.cpu_count(), 'storage': args.storage,
+                 'seed': args.seed},
+        'results': {},
+    }
+    cwd = os.getcwd()
+    for size in [int(size) for size in args.sizes.split(",")]:
+        directory = tempfile.mkdtemp()
+        os.chdir(directory)
+        try:
+            results['results'][str(size)] = run(size, args.storage,
+                                                args.seed)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+        print("{} users done".format(size), file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+""" Deterministic synthetic users
+
+The same seed and number of users always give the same records: IDs,
+emails, names, timestamps and password hashes.
+
+Usage: python3 -m benchmarks.synthetic [number_of_users] [seed]
+writes them to .db_User.json
+"""
+import hashlib
+import json
+import random
+import sys
+import time
+import uuid
+from typing import Iterator
+from models.base import TIMESTAMP_FORMAT
+
+
+FIRST_NAMES = ["Bob", "Alice", "Carol", "Dave", "Eve", "Frank", None]
+LAST_NAMES = ["Smith", "Jones", "Brown", "Taylor", None]
+START = 1704067200  # 2024-01-01
+YEAR = 365 * 24 * 3600
+
+
+def email(i: int) -> str:
+    """ Email of the i-th synthetic user
+    """
+    return "user{}@example.com".format(i)
+
+
+def password(i: int) -> str:
+    """ Clear password of the i-th synthetic user
+    """
+    return "password{}".format(i)
+
+
+def user_records(n: int, seed: int = 0) -> Iterator[dict]:
+    """ Stored form (see Base.to_json) of n synthetic users
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        created_at = START + rng.randrange(YEAR)
+        updated_at = created_at + rng.randrange(YEAR)
+        yield {
+            'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'created_at': time.strftime(TIMESTAMP_FORMAT,
+                                        time.gmtime(created_at)),
+            'updated_at': time.strftime(TIMESTAMP_FORMAT,
+                                        time.gmtime(updated_at)),
+            'version': 1,
+            'email': email(i),
+            '_password': hashlib.sha256(password(i).encode()).hexdigest(),
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+        }
+
+
+def write_users(n: int, seed: int = 0, file_path: str = ".db_User.json"):
+    """ Write n synthetic users to the JSON file of FileStorage
+    """
+    with open(file_path, 'w') as f:
+        json.dump({record['id']: record
+                   for record in user_records(n, seed)}, f)
+
+
+if __name__ == "__main__":
+    write_users(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+                int(sys.argv[2]) if len(sys.argv) > 2 else 0)
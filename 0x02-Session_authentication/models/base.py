@@ -1,39 +1,395 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import attrgetter
+from typing import Callable, TypeVar, List, Iterable, Iterator, Tuple
+import calendar
 import json
-import uuid
+import sys
+import threading
+import time
+from models.events import EventBus
+from models.file_storage import FileStorage, DATA
+from models.ids import RandomIds
+from models.index import SortedIndex
+from models.storage import UniqueConstraintError, VersionConflictError
+from models.query import Query
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+EPOCH = datetime(1970, 1, 1)
+FIELDS = {}
+PREDICATES = {}
+SERIALIZERS = {}
+TIMESTAMPS = ('created_at', 'updated_at')
+# Stored but left out of the public JSON: the version is sent as ETag
+STORED_ONLY = ('version',)
+TRANSACTION = threading.local()
+CHANGE_BITS = {}
+CHANGE_LOCK = threading.Lock()
+
+
+def intern_value(value):
+    """ Share one copy of a repeated string value between objects
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def predicate(attributes: dict):
+    """ Function telling if an object has all the attributes of a
+    search. The attributes are fetched by one attrgetter, compiled once
+    per set of names, and compared to the searched values as a tuple
+    """
+    names = tuple(attributes)
+    getter = PREDICATES.get(names)
+    if getter is None:
+        getter = PREDICATES[names] = attrgetter(*names)
+    if len(names) == 1:
+        target = attributes[names[0]]
+    else:
+        target = tuple(attributes.values())
+    return lambda obj: getter(obj) == target
+
+
+def format_timestamp(value) -> str:
+    """ TIMESTAMP_FORMAT string of an internal timestamp: datetime or
+    epoch seconds
+    """
+    if type(value) is int:
+        return time.strftime(TIMESTAMP_FORMAT, time.gmtime(value))
+    if value is None:
+        return None
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def compile_serializer(cls, for_serialization: bool):
+    """ to_json function of a class, generated from its fields: the
+    private ones and the version are left out unless
+    `for_serialization`, the timestamps are formatted and the other
+    fields copied as they are.
+    Objects with a field not set go through the generic conversion
+    """
+    items = []
+    for name in cls.fields():
+        if not for_serialization and \
+                (name[0] == '_' or name in STORED_ONLY):
+            continue
+        if name in TIMESTAMPS:
+            items.append("{!r}: format_timestamp(self._{})".format(name, name))
+        else:
+            items.append("{!r}: self.{}".format(name, name))
+    lines = ["def to_json(self):",
+             "    try:",
+             "        result = {{{}}}".format(", ".join(items)),
+             "    except AttributeError:",
+             "        return self._attributes_json({})".format(
+                 for_serialization)]
+    if cls.__dictoffset__ != 0:
+        # Instances with a __dict__: attributes set outside the fields
+        lines.append("    for key, value in self.__dict__.items():")
+        if not for_serialization:
+            lines += ["        if key[0] == '_':",
+                      "            continue"]
+        lines += ["        if type(value) is datetime:",
+                  "            value = value.strftime(TIMESTAMP_FORMAT)",
+                  "        result[key] = value"]
+    lines.append("    return result")
+    namespace = {'format_timestamp': format_timestamp, 'datetime': datetime,
+                 'TIMESTAMP_FORMAT': TIMESTAMP_FORMAT}
+    exec("\n".join(lines), namespace)
+    return namespace['to_json']
+
+
+def touch(objs: Iterable[TypeVar('Base')]) -> list:
+    """ Set the updated_at of objects about to be saved. Returns their
+    previous state, given back by `untouch` if they aren't
+    """
+    now = datetime.utcnow()
+    previous = []
+    for obj in objs:
+        previous.append((obj, obj.version, obj._updated_at))
+        obj.updated_at = now
+    return previous
+
+
+def untouch(previous: list):
+    """ Give objects whose save failed their version and updated_at
+    back (see `touch`)
+    """
+    for obj, version, updated_at in previous:
+        object.__setattr__(obj, 'version', version)
+        object.__setattr__(obj, '_updated_at', updated_at)
+        object.__setattr__(obj, '_json', None)
+
+
+def notifier(saved: list, removed: list, errors: list) -> Callable:
+    """ Callback of Storage.apply publishing the events of the saved
+    objects, then of those of `removed` whose ID it is called with.
+    What the subscribers raise is added to `errors`, to be raised once
+    the change is applied
+    """
+    def notify(removed_ids: list):
+        removed_ids = set(removed_ids)
+        events = [obj._saved for obj in saved] + \
+            [obj._removed for obj in removed if obj.id in removed_ids]
+        for event in events:
+            try:
+                event()
+            except Exception as e:
+                errors.append(e)
+    return notify
+
+
+def commit(changes: dict, previous: list = ()) -> int:
+    """ Apply ('put', object[, expected version]) and ('delete', ID)
+    changes keyed by (class, ID), one storage change per class. The
+    objects of a class whose change fails get their `previous` state
+    back (see `touch`), then those stored get their stored state back.
+    Returns the number of objects removed
+    """
+    by_class = {}
+    for (cls, obj_id), (op, value, *version) in changes.items():
+        saved, removed, expected = by_class.setdefault(cls, ([], [], {}))
+        if op == 'put':
+            saved.append(value)
+            if len(version) > 0 and version[0] is not None:
+                expected[obj_id] = version[0]
+        else:
+            removed.append(obj_id)
+    n_removed = 0
+    errors = []
+    for cls, (saved, removed, expected) in by_class.items():
+        removed_objs = []
+        if cls.events.active:
+            removed_objs = [obj for obj in (cls.storage.get(cls, obj_id)
+                                            for obj_id in removed)
+                            if obj is not None]
+        try:
+            n_removed += cls.storage.apply(
+                cls, saved, removed, expected,
+                notifier(saved, removed_objs, errors))
+        except BaseException:
+            untouch([p for p in previous if p[0].__class__ is cls])
+            cls.storage.rollback(cls, saved)
+            raise
+        finally:
+            if cls.query_cache is not None:
+                cls.query_cache.clear(cls)
+    if len(errors) > 0:
+        raise errors[0]
+    return n_removed
 
 
 class Base():
-    """ Base class
+    """ Base class of the models, persisted through `Base.storage`
     """
+    __slots__ = ('id', '_created_at', '_updated_at', 'version', '_changed',
+                 '_json')
+    # Keep created_at/updated_at as epoch seconds internally
+    compact_timestamps = False
+    # Keep the result of to_json() until an attribute is set
+    cache_json = False
+    # Mirror the saved objects in a column store (see models.columnar),
+    # keeping the timestamps as numbers
+    columnar = False
+    timestamps = TIMESTAMPS
+    # Attributes indexed by hash, in memory and by the backends
+    indexes = ()
+    # Attributes indexed in order, for range, prefix and ordered queries
+    sorted_indexes = ()
+    # Attributes whose values can't be duplicated, and those of them
+    # compared ignoring case
+    unique = ()
+    case_insensitive = ()
+    # QueryCache of the search results (see models.cache)
+    query_cache = None
+    # Record of the removed objects (see models.tombstones)
+    tombstones = None
+    # Generator of the IDs of new objects (see models.ids)
+    id_generator = RandomIds()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        # Not tracking changes until loaded or saved
+        object.__setattr__(self, '_changed', None)
+        object.__setattr__(self, '_json', None)
+        self.id = kwargs['id'] if 'id' in kwargs else self.id_generator()
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = self._parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = self._parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
+        if self._updated_at == self._created_at:
+            self._updated_at = self._created_at
+        # 0 until saved, and for objects stored without versions
+        self.version = kwargs.get('version') or 0
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, recording its field as changed and
+        dropping the cached JSON
+        """
+        object.__setattr__(self, name, value)
+        if self._json is not None:
+            object.__setattr__(self, '_json', None)
+        changed = self._changed
+        if changed is not None:
+            object.__setattr__(self, '_changed',
+                               changed | self.change_bit(name))
+
+    @classmethod
+    def change_bit(cls, name: str) -> int:
+        """ Bit of the field of an attribute in the changes of an object
+        of the class. The fields get the first bits, the other
+        attributes the next ones as they are set. Properties have none:
+        the attributes they set are recorded
+        """
+        tracked = CHANGE_BITS.get(cls)
+        if tracked is None:
+            tracked = ({}, [])
+            for field in cls.fields():
+                tracked[0][field] = tracked[0]['_' + field] = \
+                    1 << len(tracked[1])
+                tracked[1].append(field)
+            tracked = CHANGE_BITS.setdefault(cls, tracked)
+        bit = tracked[0].get(name)
+        if bit is None:
+            with CHANGE_LOCK:
+                bit = tracked[0].get(name)
+                if isinstance(getattr(cls, name, None), property):
+                    bit = tracked[0][name] = 0
+                elif bit is None:
+                    bit = tracked[0][name] = 1 << len(tracked[1])
+                    tracked[1].append(name)
+        return bit
+
+    def changed_fields(self) -> List[str]:
+        """ Fields set since the object was loaded or saved, None if
+        it wasn't
+        """
+        changed = self._changed
+        if changed is None:
+            return None
+        names = CHANGE_BITS.get(self.__class__, ({}, []))[1]
+        return [name for i, name in enumerate(names) if changed >> i & 1]
+
+    def __setstate__(self, state):
+        """ Restore an unpickled object, e.g. loaded by another process,
+        keeping its change tracking state
+        """
+        if type(state) is tuple:
+            state = dict(state[0] or {}, **state[1])
+        object.__setattr__(self, '_json', None)
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def _restore(self, stored: TypeVar('Base')):
+        """ Take the state of the stored object of the same ID
+        """
+        if hasattr(self, '__dict__'):
+            self.__dict__.clear()
+        self.__setstate__(stored.__reduce_ex__(2)[2])
+
+    @classmethod
+    def from_json(cls, obj_json: dict) -> TypeVar('Base'):
+        """ Object from its stored dictionary (see to_json), tracking
+        its changes
+        """
+        obj = cls(**obj_json)
+        object.__setattr__(obj, '_changed', 0)
+        return obj
+
+    @property
+    def created_at(self) -> datetime:
+        """ Getter of the creation date
+        """
+        return self._from_timestamp(self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation date
+        """
+        self._created_at = self._to_timestamp(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Getter of the last update date
+        """
+        return self._from_timestamp(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update date
+        """
+        self._updated_at = self._to_timestamp(value)
+
+    @staticmethod
+    def _parse_timestamp(value):
+        """ Datetime of a TIMESTAMP_FORMAT string. Datetimes and epoch
+        seconds (int) are returned unchanged
+        """
+        if type(value) is str:
+            return datetime.strptime(value, TIMESTAMP_FORMAT)
+        return value
+
+    def _to_timestamp(self, value: datetime):
+        """ Internal representation of a datetime, or of epoch seconds
+        """
+        if self.compact_timestamps:
+            if type(value) is datetime:
+                return calendar.timegm(value.utctimetuple())
+        elif type(value) is int:
+            return EPOCH + timedelta(seconds=value)
+        return value
+
+    def _from_timestamp(self, value) -> datetime:
+        """ Datetime from its internal representation
+        """
+        if type(value) is int:
+            return EPOCH + timedelta(seconds=value)
+        return value
+
+    @classmethod
+    def fields(cls) -> Tuple[str]:
+        """ Names of the slot-declared fields, in declaration order
+        """
+        names = FIELDS.get(cls)
+        if names is None:
+            names = ['id', 'created_at', 'updated_at', 'version']
+            for klass in reversed(cls.__mro__[:-1]):
+                if klass is Base:
+                    continue
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in ('__dict__', '__weakref__'):
+                        names.append(name)
+            names = FIELDS[cls] = tuple(names)
+        return names
+
+    @classmethod
+    def hash_indexes(cls) -> Tuple[str]:
+        """ Attributes indexed for equality: `indexes` and `unique`
+        """
+        return cls.indexes + tuple(n for n in cls.unique
+                                   if n not in cls.indexes)
+
+    def attributes(self) -> Iterable[Tuple[str, object]]:
+        """ All (name, value) pairs set on the object
+        """
+        for key in self.fields():
+            try:
+                yield key, getattr(self, key)
+            except AttributeError:
+                continue
+        if hasattr(self, '__dict__'):
+            yield from self.__dict__.items()
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -45,11 +401,51 @@ class Base():
         return (self.id == other.id)
 
     def to_json(self, for_serialization: bool = False) -> dict:
-        """ Convert the object a JSON dictionary
+        """ Convert the object a JSON dictionary. With `cache_json`,
+        the dictionary without the private attributes is shared
+        between calls: it must not be modified, and values changed in
+        place (e.g. a list) aren't seen
+        """
+        if not for_serialization and self.cache_json:
+            cached = self._json
+            if cached is None:
+                cached = (self._to_json(False), None)
+                object.__setattr__(self, '_json', cached)
+            return cached[0]
+        return self._to_json(for_serialization)
+
+    def to_json_bytes(self) -> bytes:
+        """ `to_json()` encoded in compact JSON, cached with `cache_json`
+        """
+        if not self.cache_json:
+            return json.dumps(self._to_json(False),
+                              separators=(",", ":")).encode()
+        cached = self._json
+        if cached is None or cached[1] is None:
+            obj_json = self.to_json()
+            cached = (obj_json,
+                      json.dumps(obj_json, separators=(",", ":")).encode())
+            object.__setattr__(self, '_json', cached)
+        return cached[1]
+
+    def _to_json(self, for_serialization: bool) -> dict:
+        """ JSON dictionary of the object, by the serializer compiled
+        for its class
+        """
+        serializer = SERIALIZERS.get((self.__class__, for_serialization))
+        if serializer is None:
+            serializer = SERIALIZERS.setdefault(
+                (self.__class__, for_serialization),
+                compile_serializer(self.__class__, for_serialization))
+        return serializer(self)
+
+    def _attributes_json(self, for_serialization: bool) -> dict:
+        """ JSON dictionary of the object, built from its attributes
         """
         result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
+        for key, value in self.attributes():
+            if not for_serialization and \
+                    (key[0] == '_' or key in STORED_ONLY):
                 continue
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
@@ -59,79 +455,256 @@ class Base():
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from the storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        cls.storage.load(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to the storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        cls.storage.flush(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
-
-    def save(self):
-        """ Save current object
+    def save(self, expected_version: int = None):
+        """ Save current object, incrementing its version. Raises
+        UniqueConstraintError if it duplicates the value of a `unique`
+        attribute. With `expected_version`, raise VersionConflictError
+        instead if the stored object isn't at that version (checked
+        when the transaction commits within one). If the save fails,
+        the object gets its version and updated_at back, or its stored
+        state if it is the stored object, changed in place
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        previous = touch([self])
+        if self.pending({(self.__class__, self.id):
+                         ('put', self, expected_version)}):
+            return
+        expected = None
+        if expected_version is not None:
+            expected = {self.id: expected_version}
+        errors = []
+        try:
+            self.storage.apply(self.__class__, [self], [], expected,
+                               notifier([self], [], errors))
+        except BaseException:
+            untouch(previous)
+            self.storage.rollback(self.__class__, [self])
+            raise
+        if self.query_cache is not None:
+            self.query_cache.invalidate(self)
+        if len(errors) > 0:
+            raise errors[0]
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        if self.pending({(self.__class__, self.id): ('delete', self.id)}):
+            return
+        errors = []
+        self.storage.apply(self.__class__, [], [self.id], None,
+                           notifier([], [self], errors))
+        if self.query_cache is not None:
+            self.query_cache.invalidate(self, removed=True)
+        if len(errors) > 0:
+            raise errors[0]
+
+    def _saved(self):
+        """ Publish the event of a persisted save, then track the
+        changes from the saved state
+        """
+        if self.events.active:
+            if self._changed is None:
+                self.events.publish('created', self,
+                                    [k for k, _ in self.attributes()])
+            else:
+                self.events.publish('updated', self,
+                                    self.changed_fields())
+        object.__setattr__(self, '_changed', 0)
+
+    def _removed(self):
+        """ Publish the event of a persisted removal
+        """
+        object.__setattr__(self, '_changed', None)
+        if self.events.active:
+            self.events.publish('removed', self)
+
+    @staticmethod
+    def pending(changes: dict) -> bool:
+        """ Add changes to the transaction of the current thread,
+        False if there is none
+        """
+        pending = getattr(TRANSACTION, 'changes', None)
+        if pending is None:
+            return False
+        for key, change in changes.items():
+            # The last change of an object wins
+            pending.pop(key, None)
+            pending[key] = change
+        return True
+
+    @classmethod
+    def bulk_save(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects at once: persisted in a single write, none of
+        them saved if one breaks a unique constraint. Then, the objects
+        get their state back as by `save`
+        """
+        previous = touch(objs)
+        changes = {(obj.__class__, obj.id): ('put', obj)
+                   for obj, _, _ in previous}
+        if not cls.pending(changes):
+            commit(changes, previous)
+
+    @classmethod
+    def bulk_remove(cls, ids: Iterable[str]) -> int:
+        """ Remove objects of the class by ID in a single write.
+        Returns the number removed, None within a transaction
+        """
+        changes = {(cls, obj_id): ('delete', obj_id) for obj_id in ids}
+        if cls.pending(changes):
+            return None
+        return commit(changes)
+
+    @staticmethod
+    @contextmanager
+    def transaction():
+        """ Defer the saves and removals of the current thread to the
+        end of the block, then persist them in one write per class.
+        If the block raises, nothing is persisted and the objects saved
+        in the block get their stored state back, if they have one:
+        other objects changed in place must be fetched again. Reads
+        within the block see the stored state. A nested block joins the
+        outer one
+        """
+        if getattr(TRANSACTION, 'changes', None) is not None:
+            yield
+            return
+        TRANSACTION.changes = changes = {}
+        try:
+            yield
+        except BaseException:
+            TRANSACTION.changes = None
+            saved = {}
+            for (cls, _), (op, obj, *_) in changes.items():
+                if op == 'put':
+                    saved.setdefault(cls, []).append(obj)
+            for cls, objs in saved.items():
+                cls.storage.rollback(cls, objs)
+            for (cls, obj_id), (op, obj, *_) in changes.items():
+                stored = cls.storage.get(cls, obj_id) if op == 'put' \
+                    else None
+                if stored is not None and stored is not obj:
+                    obj._restore(stored)
+            raise
+        TRANSACTION.changes = None
+        commit(changes)
 
     @classmethod
-    def count(cls) -> int:
-        """ Count all objects
+    def count(cls, attributes: dict = {}) -> int:
+        """ Count all objects with matching attributes
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        count = cls.storage.count(cls, attributes)
+        if count is not None:
+            return count
+        return sum(1 for _ in cls.iter_search(attributes))
 
     @classmethod
-    def all(cls) -> Iterable[TypeVar('Base')]:
-        """ Return all objects
+    def all(cls) -> Iterator[TypeVar('Base')]:
+        """ Iterate over all objects
         """
-        return cls.search()
+        return cls.iter_search()
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return cls.storage.get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return list(cls.iter_search(attributes))
+
+    @classmethod
+    def query(cls, where: dict = {}, order_by: str = None,
+              descending: bool = False, limit: int = None,
+              offset: int = 0) -> Query:
+        """ Query objects with predicates (see models.query), ordering
+        and pagination
+        """
+        return Query(cls, where, order_by, descending, limit, offset)
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {},
+                    limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Yield objects with matching attributes, stopping after
+        `limit` objects if given
+        """
+        if limit is not None and limit <= 0:
+            return
+        cache = cls.query_cache
+        if cache is None or len(attributes) == 0:
+            yield from islice(cls.matching(attributes), limit)
+            return
+        found = cache.get(cls, attributes)
+        if found is None:
+            generation = cache.generation(cls)
+            found = list(cls.matching(attributes))
+            cache.put(cls, attributes, found, generation)
+        yield from islice(found, limit)
+
+    @classmethod
+    def updated_since(cls, since: datetime,
+                      after_id: str = "") -> Iterator[TypeVar('Base')]:
+        """ Yield the objects updated after (since, after_id), in
+        (updated_at, ID) order, found by binary search on the sorted
+        updated_at index or through an index of the storage. Without
+        such an index, all objects are sorted
+        """
+        start = (since, after_id)
+        for index in cls.storage.indexes(cls, 'updated_at'):
+            if isinstance(index, SortedIndex):
+                entries = index.entries
+                for updated_at, obj_id in entries.slice(index.after(start),
+                                                        len(entries)):
+                    obj = cls.storage.get(cls, obj_id)
+                    # Skip the objects removed or updated since
+                    if obj is not None and obj.updated_at == updated_at:
+                        yield obj
+                return
+        found = cls.storage.updated_since(cls, format_timestamp(since),
+                                          after_id)
+        if found is not None:
+            yield from found
+            return
+        found = [(obj.updated_at, obj.id, obj) for obj in cls.all()
+                 if (obj.updated_at, obj.id) > start]
+        found.sort(key=lambda entry: entry[:2])
+        for entry in found:
+            yield entry[2]
+
+    @classmethod
+    def removed_since(cls, since: datetime,
+                      after_id: str = "") -> Iterator[Tuple[datetime, str]]:
+        """ Yield (removed_at, ID) of the objects removed after
+        (since, after_id), in that order, if `tombstones` are kept
+        """
+        if cls.tombstones is not None:
+            yield from cls.tombstones.since(cls, since, after_id)
+
+    @classmethod
+    def matching(cls, attributes: dict) -> Iterable[TypeVar('Base')]:
+        """ Objects with matching attributes, from an index of the
+        storage or a scan
+        """
+        found = cls.storage.lookup(cls, attributes)
+        if found is None:
+            found = cls.storage.scan(cls)
+            if len(attributes) > 0:
+                found = filter(predicate(attributes), found)
+        return found
+
+
+# Storage of the objects, unless another backend is selected at startup
+Base.storage = FileStorage()
+# Subscribers to the changes persisted (see models.events)
+Base.events = EventBus()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+""" Cache module
+
+Bounded LRU cache of Base.search results, keyed by class and by the
+frozen set of searched attributes.
+
+An entry is dropped when an object it holds, or an object now matching
+its attributes, is saved or removed. Changes the cache isn't told about
+(other processes, reloads) are caught by the `version` token of the
+storage, recorded with each entry. A result computed while a change
+of its class was invalidating the cache is not stored: each class has
+a generation number, bumped by every invalidation.
+"""
+from collections import OrderedDict
+from typing import TypeVar, List
+import threading
+from models.storage import matches
+
+
+class QueryCache():
+    """ LRU cache of search results
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """ Initialize an empty cache holding at most maxsize results
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, cls, attributes: dict) -> tuple:
+        """ Key of a search, None if its values aren't hashable
+        """
+        try:
+            key = (cls.__name__, frozenset(attributes.items()))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def generation(self, cls) -> tuple:
+        """ Generation of a class and version of its storage, to read
+        before computing a result
+        """
+        return (self.epoch, self.generations.get(cls.__name__, 0),
+                cls.storage.version(cls))
+
+    def get(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Cached result of a search, None on a miss
+        """
+        key = self.key(cls, attributes)
+        if key is None:
+            return None
+        version = cls.storage.version(cls)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, cls, attributes: dict, result: List[TypeVar('Base')],
+            generation: tuple):
+        """ Cache the result of a search computed at a generation
+        """
+        key = self.key(cls, attributes)
+        if key is None:
+            return
+        entry = (generation[2], dict(attributes), result,
+                 {obj.id for obj in result})
+        with self.lock:
+            if (self.epoch, self.generations.get(cls.__name__, 0)) != \
+                    generation[:2]:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, obj: TypeVar('Base'), removed: bool = False):
+        """ Drop the results holding an object, or that it now matches
+        """
+        s_class = obj.__class__.__name__
+        with self.lock:
+            self.generations[s_class] = self.generations.get(s_class, 0) + 1
+            for key in list(self.entries.keys()):
+                if key[0] != s_class:
+                    continue
+                _, attributes, _, ids = self.entries[key]
+                if obj.id in ids or \
+                        (not removed and matches(obj, attributes)):
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def clear(self, cls=None):
+        """ Drop every result, or the results of a class
+        """
+        with self.lock:
+            if cls is None:
+                self.epoch += 1
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                return
+            s_class = cls.__name__
+            self.generations[s_class] = self.generations.get(s_class, 0) + 1
+            for key in list(self.entries.keys()):
+                if key[0] == s_class:
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        """ Hit/miss statistics of the cache
+        """
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
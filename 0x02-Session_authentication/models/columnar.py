@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+""" Columnar module
+
+In-memory column store mirroring the objects of one Base subclass.
+Each field is kept in its own column of integer codes, so predicates
+become scans over integer arrays (vectorized through NumPy when it is
+installed). Values are dictionary-encoded, except timestamps, kept as
+microseconds since the epoch to answer ranges of dates.
+
+Columns are stored in chunks shared with the copies of the store
+(see FileStorage's Snapshot): a change copies the chunk of its row,
+not the whole column. Codes no row holds anymore are dropped from the
+dictionaries as soon as they are replaced or removed.
+"""
+from array import array
+from datetime import datetime
+from itertools import chain
+from typing import Iterable, List
+import calendar
+from models.layered import LayeredDict
+from models.query import Eq, In, Predicate, Range
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+CHUNK_SIZE = 1024
+DELETED = -1
+OPAQUE = -2
+# Codes of the timestamp columns out of the range of the datetimes
+MIN_TIME = -(1 << 63)
+NO_TIME = MIN_TIME + 1
+OPAQUE_TIME = MIN_TIME + 2
+DELETED_TIME = MIN_TIME + 3
+
+
+class Chunks():
+    """ Sequence of integers, or of objects without `typecode`, in
+    chunks shared with its copies until they change
+    """
+
+    __slots__ = ('typecode', 'chunks', 'owned', 'size')
+
+    def __init__(self, typecode: str = None):
+        """ Initialize an empty sequence
+        """
+        self.typecode = typecode
+        self.chunks = []
+        self.owned = []
+        self.size = 0
+
+    def new(self, items=()):
+        """ New chunk holding items
+        """
+        if self.typecode is None:
+            return list(items)
+        return array(self.typecode, items)
+
+    def copy(self):
+        """ Copy sharing the chunks
+        """
+        seq = Chunks.__new__(Chunks)
+        seq.typecode = self.typecode
+        seq.chunks = list(self.chunks)
+        self.owned = [False] * len(self.chunks)
+        seq.owned = list(self.owned)
+        seq.size = self.size
+        return seq
+
+    def own(self, k: int):
+        """ Chunk k, copied first if shared
+        """
+        if not self.owned[k]:
+            self.chunks[k] = self.new(self.chunks[k])
+            self.owned[k] = True
+        return self.chunks[k]
+
+    def __len__(self) -> int:
+        """ Number of items
+        """
+        return self.size
+
+    def __iter__(self):
+        """ Iterator over the items
+        """
+        return chain.from_iterable(self.chunks)
+
+    def __getitem__(self, i: int):
+        """ Item i
+        """
+        return self.chunks[i // CHUNK_SIZE][i % CHUNK_SIZE]
+
+    def __setitem__(self, i: int, value):
+        """ Set item i
+        """
+        self.own(i // CHUNK_SIZE)[i % CHUNK_SIZE] = value
+
+    def append(self, value):
+        """ Add an item at the end
+        """
+        if self.size % CHUNK_SIZE == 0:
+            self.chunks.append(self.new())
+            self.owned.append(True)
+        self.own(len(self.chunks) - 1).append(value)
+        self.size += 1
+
+    def array(self):
+        """ NumPy array of the integers
+        """
+        if self.size == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate([numpy.frombuffer(c, dtype=numpy.int64)
+                                  for c in self.chunks])
+
+
+class Column():
+    """ Dictionary-encoded column of values, counting the rows holding
+    each code
+    """
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        self.codes = Chunks('q')
+        self.values = LayeredDict()
+        self.counts = LayeredDict()
+        self.code_of = LayeredDict()
+        self.next_code = 0
+
+    def copy(self):
+        """ Copy of the column sharing its chunks and dictionaries
+        until they change
+        """
+        column = Column.__new__(Column)
+        column.codes = self.codes.copy()
+        column.values = self.values.copy()
+        column.counts = self.counts.copy()
+        column.code_of = self.code_of.copy()
+        column.next_code = self.next_code
+        return column
+
+    def encode(self, value) -> int:
+        """ Code of a value held by one more row, added to the
+        dictionary if needed. Unhashable values share the OPAQUE code
+        and never match.
+        """
+        try:
+            code = self.code_of.get(value)
+        except TypeError:
+            return OPAQUE
+        if code is None:
+            code = self.next_code
+            self.next_code += 1
+            self.values[code] = value
+            self.code_of[value] = code
+            self.counts[code] = 1
+        else:
+            self.counts[code] += 1
+        return code
+
+    def release(self, code: int):
+        """ Drop a code held by one less row once no row holds it
+        """
+        if code < 0:
+            return
+        count = self.counts[code] - 1
+        if count > 0:
+            self.counts[code] = count
+            return
+        del self.counts[code]
+        del self.code_of[self.values.pop(code)]
+
+    def append(self, value):
+        """ Add a row holding a value
+        """
+        self.codes.append(self.encode(value))
+
+    def set(self, row: int, value):
+        """ Change the value of a row
+        """
+        old = self.codes[row]
+        code = self.encode(value)
+        if code != old:
+            self.codes[row] = code
+        self.release(old)
+
+    def delete(self, row: int):
+        """ Mark a row removed
+        """
+        self.release(self.codes[row])
+        self.codes[row] = DELETED
+
+    def condition(self, pred) -> tuple:
+        """ ('in', codes) of the rows matching a predicate, None if the
+        column can't evaluate it. Raises TypeError for unhashable values
+        """
+        if isinstance(pred, Eq):
+            values = [pred.value]
+        elif isinstance(pred, In):
+            values = pred.values
+        else:
+            return None
+        codes = set()
+        for value in values:
+            code = self.code_of.get(value)
+            if code is not None:
+                codes.add(code)
+        return 'in', codes
+
+    def count(self, codes: set) -> int:
+        """ Number of rows holding one of the codes
+        """
+        return sum(self.counts.get(code, 0) for code in codes)
+
+
+class TimeColumn(Column):
+    """ Column of naive datetimes, kept as microseconds since the epoch
+    """
+
+    def __init__(self):
+        """ Initialize an empty column
+        """
+        self.codes = Chunks('q')
+        self.opaque = 0
+
+    def copy(self):
+        """ Copy of the column sharing its chunks until they change
+        """
+        column = TimeColumn.__new__(TimeColumn)
+        column.codes = self.codes.copy()
+        column.opaque = self.opaque
+        return column
+
+    @staticmethod
+    def micros(value) -> int:
+        """ Microseconds since the epoch of a naive datetime, None for
+        another value
+        """
+        if type(value) is not datetime or value.tzinfo is not None:
+            return None
+        return calendar.timegm(value.timetuple()) * 1000000 + \
+            value.microsecond
+
+    def encode(self, value) -> int:
+        """ Code of a value. Other values than naive datetimes and None
+        are counted: while there are any, nothing is evaluated here
+        """
+        if value is None:
+            return NO_TIME
+        code = self.micros(value)
+        if code is None:
+            self.opaque += 1
+            return OPAQUE_TIME
+        return code
+
+    def release(self, code: int):
+        """ Count a value other than a datetime replaced or removed
+        """
+        if code == OPAQUE_TIME:
+            self.opaque -= 1
+
+    def delete(self, row: int):
+        """ Mark a row removed
+        """
+        self.release(self.codes[row])
+        self.codes[row] = DELETED_TIME
+
+    def condition(self, pred) -> tuple:
+        """ ('in', codes) or ('range', start, end) of the rows matching
+        a predicate, None if the column can't evaluate it
+        """
+        if self.opaque > 0:
+            return None
+        if isinstance(pred, (Eq, In)):
+            values = [pred.value] if isinstance(pred, Eq) else pred.values
+            codes = set()
+            for value in values:
+                code = NO_TIME if value is None else self.micros(value)
+                if code is not None:
+                    codes.add(code)
+            return 'in', codes
+        if isinstance(pred, Range):
+            bounds = []
+            for bound, default in ((pred.start, DELETED_TIME + 1),
+                                   (pred.end, None)):
+                code = default if bound is None else self.micros(bound)
+                if code is None and bound is not None:
+                    return None
+                bounds.append(code)
+            return ('range',) + tuple(bounds)
+        return None
+
+    def count(self, codes: set) -> int:
+        """ Number of rows holding one of the codes
+        """
+        return sum(chunk.count(code)
+                   for chunk in self.codes.chunks for code in codes)
+
+
+class ColumnStore():
+    """ Parallel columns for the objects of one class
+
+    Rows keep the insertion order of the objects; removed rows are
+    marked DELETED and reclaimed by `compact`.
+    """
+
+    def __init__(self, fields: Iterable[str], timestamps: Iterable[str] = ()):
+        """ Initialize an empty store for the given fields, those of
+        `timestamps` holding datetimes
+        """
+        self.fields = tuple(f for f in fields if f != 'id')
+        self.columns = {f: TimeColumn() if f in timestamps else Column()
+                        for f in self.fields}
+        self.ids = Chunks()
+        self.row_of = LayeredDict()
+        self.deleted = 0
+
+    def copy(self):
+        """ Copy of the store sharing its chunks and dictionaries until
+        they change
+        """
+        store = ColumnStore(())
+        store.fields = self.fields
+        store.columns = {f: c.copy() for f, c in self.columns.items()}
+        store.ids = self.ids.copy()
+        store.row_of = self.row_of.copy()
+        store.deleted = self.deleted
+        return store
+
+    @classmethod
+    def from_objects(cls, fields: Iterable[str], objs: Iterable,
+                     timestamps: Iterable[str] = ()):
+        """ Build a store from objects
+        """
+        store = cls(fields, timestamps)
+        for obj in objs:
+            store.put(obj)
+        return store
+
+    def put(self, obj):
+        """ Insert or update the row of an object
+        """
+        row = self.row_of.get(obj.id)
+        if row is None:
+            self.row_of[obj.id] = len(self.ids)
+            self.ids.append(obj.id)
+            for f in self.fields:
+                self.columns[f].append(getattr(obj, f, None))
+        else:
+            for f in self.fields:
+                self.columns[f].set(row, getattr(obj, f, None))
+
+    def delete(self, obj_id: str):
+        """ Remove the row of an object
+        """
+        row = self.row_of.pop(obj_id, None)
+        if row is None:
+            return
+        self.ids[row] = None
+        for column in self.columns.values():
+            column.delete(row)
+        self.deleted += 1
+        if self.deleted > len(self.ids) // 2:
+            self.compact()
+
+    def compact(self):
+        """ Rebuild the columns without the deleted rows
+        """
+        rows = [r for r, obj_id in enumerate(self.ids) if obj_id is not None]
+        for column in self.columns.values():
+            codes = Chunks('q')
+            for r in rows:
+                codes.append(column.codes[r])
+            column.codes = codes
+        ids = Chunks()
+        self.row_of = LayeredDict()
+        for r in rows:
+            self.row_of[self.ids[r]] = len(ids)
+            ids.append(self.ids[r])
+        self.ids = ids
+        self.deleted = 0
+
+    def _conditions(self, where: dict) -> list:
+        """ (column, condition) pairs of predicates (see models.query),
+        values that aren't being compared for equality. None if the
+        store can't evaluate them
+        """
+        conditions = []
+        for k, pred in where.items():
+            column = self.columns.get(k)
+            if column is None:
+                return None
+            if not isinstance(pred, Predicate):
+                pred = Eq(pred)
+            try:
+                condition = column.condition(pred)
+            except TypeError:
+                return None
+            if condition is None:
+                return None
+            conditions.append((column, condition))
+        return conditions
+
+    def _mask(self, conditions: list):
+        """ NumPy boolean mask of the rows meeting every condition
+        """
+        mask = None
+        for column, condition in conditions:
+            codes = column.codes.array()
+            if condition[0] == 'in':
+                found = numpy.isin(codes, list(condition[1]))
+            else:
+                found = codes >= condition[1]
+                if condition[2] is not None:
+                    found &= codes < condition[2]
+            mask = found if mask is None else mask & found
+        return mask
+
+    def _rows(self, conditions: list) -> List[int]:
+        """ Rows meeting every condition, scanning the columns
+        """
+        rows = None
+        for column, condition in conditions:
+            codes = column.codes
+            if condition[0] == 'in':
+                found = condition[1]
+                test = found.__contains__
+            else:
+                start, end = condition[1:]
+                if end is None:
+                    def test(c, start=start):
+                        return c >= start
+                else:
+                    def test(c, start=start, end=end):
+                        return start <= c < end
+            if rows is None:
+                rows = [r for r, c in enumerate(codes) if test(c)]
+            else:
+                rows = [r for r in rows if test(codes[r])]
+        return rows
+
+    def rows(self, where: dict) -> List[int]:
+        """ Rows matching all predicates, None if not answerable here
+        """
+        if 'id' in where:
+            return None
+        conditions = self._conditions(where)
+        if conditions is None:
+            return None
+        if len(conditions) == 0:
+            return [r for r, i in enumerate(self.ids) if i is not None]
+        if numpy is not None:
+            return numpy.flatnonzero(self._mask(conditions)).tolist()
+        return self._rows(conditions)
+
+    def search(self, where: dict) -> List[str]:
+        """ Ids of the objects matching all predicates, or attributes
+        compared for equality, in insertion order. None if the store
+        can't evaluate them
+        """
+        rows = self.rows(where)
+        if rows is None:
+            return None
+        return [self.ids[r] for r in rows]
+
+    def count(self, where: dict) -> int:
+        """ Number of objects matching all predicates, or attributes
+        compared for equality. None if the store can't evaluate them
+        """
+        if len(where) == 0:
+            return len(self.row_of)
+        if 'id' in where:
+            return None
+        conditions = self._conditions(where)
+        if conditions is None:
+            return None
+        if len(conditions) == 1 and conditions[0][1][0] == 'in':
+            column, condition = conditions[0]
+            return column.count(condition[1])
+        if numpy is not None:
+            return int(numpy.count_nonzero(self._mask(conditions)))
+        return len(self._rows(conditions))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+""" Events module
+
+Change-data-capture of the Base models: every object created, updated
+or removed through `save`, `remove`, the bulk methods or a transaction
+is published as an event to the subscribers of `Base.events`.
+
+An event is a dictionary:
+    generation  number of the event, increasing by 1 from one event to
+                the next: of every process appending to the change
+                log, if there is one
+    event       "created", "updated" or "removed"
+    class       name of the class of the object
+    id          ID of the object
+    changed     names of the fields changed by the event ("updated":
+                the fields set since the object was loaded or saved)
+    data        serialized object, as stored ("created" and "updated")
+
+The storages publish a change before another can be stored (see
+Storage.apply), so the events are in the order of the changes. A
+ChangeLog set as `Base.events.log` numbers the events and appends them
+to an NDJSON file, under an exclusive lock of the file, which other
+processes can tail with `ChangeLog.read`.
+"""
+from typing import Callable, List, Tuple
+import json
+import os
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class EventBus():
+    """ Publisher of the change events to in-process subscribers
+    """
+
+    def __init__(self, generation: int = 0):
+        """ Initialize without subscribers nor change log, numbering
+        the next event generation + 1
+        """
+        self.generation = generation
+        self.subscribers = []
+        self.log = None
+        self.lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        """ Whether the events are logged or subscribed to
+        """
+        return self.log is not None or len(self.subscribers) > 0
+
+    def subscribe(self, callback: Callable[[dict], None]) -> Callable:
+        """ Call a function with every event
+        """
+        with self.lock:
+            self.subscribers = self.subscribers + [callback]
+        return callback
+
+    def unsubscribe(self, callback: Callable[[dict], None]):
+        """ Stop calling a function with the events
+        """
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers
+                                if s is not callback]
+
+    def publish(self, event: str, obj, changed: List[str] = None):
+        """ Number an event on an object, append it to the change log
+        and call the subscribers, in generation order. Every subscriber
+        is called even if the log or one of them raises; the first
+        exception is raised after
+        """
+        with self.lock:
+            record = {'generation': self.generation + 1, 'event': event,
+                      'class': obj.__class__.__name__, 'id': obj.id,
+                      'changed': changed}
+            if event != 'removed':
+                record['data'] = obj.to_json(True)
+            error = None
+            if self.log is not None:
+                try:
+                    self.log.append(record)
+                except Exception as e:
+                    error = e
+            self.generation = record['generation']
+            for callback in self.subscribers:
+                try:
+                    callback(record)
+                except Exception as e:
+                    if error is None:
+                        error = e
+        if error is not None:
+            raise error
+
+
+class ChangeLog():
+    """ NDJSON file of the events, shared by the processes appending to
+    it
+    """
+
+    def __init__(self, file_path: str = ".db_changes.ndjson"):
+        """ Initialize on a change log file, created if missing
+        """
+        self.file_path = file_path
+        self.file = open(file_path, 'a')
+        self.lock = threading.Lock()
+        # Last generation appended, and the size of the file after it
+        self.generation = 0
+        self.end = None
+
+    def append(self, event: dict) -> int:
+        """ Number an event following the last one of the file, which
+        another process may have appended, and append it, holding an
+        exclusive lock of the file. Returns its generation
+        """
+        with self.lock:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.file.fileno()).st_size != self.end:
+                    self.generation = self.last_generation()
+                self.generation += 1
+                event['generation'] = self.generation
+                self.file.write(json.dumps(event) + "\n")
+                self.file.flush()
+                self.end = os.fstat(self.file.fileno()).st_size
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            return self.generation
+
+    def close(self):
+        """ Close the file
+        """
+        self.file.close()
+
+    def last_generation(self) -> int:
+        """ Generation of the last event of the file, 0 if empty
+        """
+        with open(self.file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().splitlines()
+        for line in reversed(lines):
+            try:
+                return json.loads(line)['generation']
+            except (ValueError, KeyError):
+                continue
+        return 0
+
+    @staticmethod
+    def read(file_path: str, position: int = 0) -> Tuple[List[dict], int]:
+        """ Complete events written after a position in a change log,
+        with the position following them
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                f.seek(position)
+                tail = f.read()
+        except OSError:
+            return [], position
+        end = tail.rfind(b"\n") + 1
+        events = [json.loads(line) for line in tail[:end].splitlines()]
+        return events, position + end
@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+""" File storage module
+
+Default backend: every object of a class lives in memory and the class
+is persisted as a whole to `.db_<class name>.json`.
+
+The in-memory state of a class is a Snapshot, never modified once
+published. Writers are serialized by a lock, apply their change to a
+copy of the current snapshot and publish the copy by swapping one
+reference, so readers never lock and never see a partial change.
+
+A storage created with `shared=True` can be used by several processes
+on the same files. Each change is also appended to the journal
+`.db_<class name>.journal`, writers hold an exclusive file lock and
+`sync` applies the journal entries written by other processes since
+the last call, without reloading the whole file.
+
+A storage created with `shards=k` splits each class into k files,
+`.db_<class name>.<0..k-1>.json`, by a hash of the object IDs: a change
+rewrites only the files of the objects it changes, and the files are
+parsed in parallel by a process pool when loaded. The files of another
+number of shards, or of none, are converted when loaded, then removed.
+
+A storage created with `binary=True` writes record files (see
+models.record_file), `.db_<class name>.bin`, instead of JSON. The files
+of the other format are converted when loaded, if they are the newest
+files of the class, then removed.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+from typing import Callable, TypeVar, Iterable, List
+import glob
+import json
+import os
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from models.columnar import ColumnStore
+from models.index import HashIndex, SortedIndex, build
+from models.layered import LayeredDict
+from models.record_file import read_records, write_records
+from models.storage import Storage, atomic_write, check_versions, \
+    index_lookup, report_duplicates, set_versions
+
+
+DATA = {}
+SNAPSHOTS = {}
+JOURNAL_MAX_SIZE = 1 << 20
+# File formats: JSON and record files
+EXTENSIONS = ("json", "bin")
+
+
+def shard_of(obj_id: str, shards: int) -> int:
+    """ Shard of an object ID, identical in every process
+    """
+    return zlib.crc32(obj_id.encode()) % shards
+
+
+def read_file(cls, file_path: str) -> list:
+    """ Objects of a JSON or record (.bin) file. Runs in the workers of
+    the process pool for the shards: the objects are sent back pickled
+    """
+    if file_path.endswith(".bin"):
+        return list(read_records(file_path, cls))
+    with open(file_path, 'r') as f:
+        return [cls.from_json(obj_json) for obj_json in json.load(f).values()]
+
+
+class Snapshot():
+    """ Objects of a class with their indexes and column store
+    """
+
+    def __init__(self, cls, objects: dict, shards: int = 0):
+        """ Initialize a snapshot, building its indexes, and its
+        objects by shard if `shards`
+        """
+        self.objects = LayeredDict(objects)
+        self.shards = None
+        self.owned = set()
+        if shards > 0:
+            self.shards = [{} for _ in range(shards)]
+            for obj_id, obj in objects.items():
+                self.shards[shard_of(obj_id, shards)][obj_id] = obj
+        self.indexes = {}
+        for name in cls.hash_indexes():
+            self.indexes.setdefault(name, []).append(
+                build(HashIndex, name, objects.values(),
+                      unique=name in cls.unique,
+                      case_insensitive=name in cls.case_insensitive))
+        for name in cls.sorted_indexes:
+            self.indexes.setdefault(name, []).append(
+                build(SortedIndex, name, objects.values()))
+        self.columns = None
+        if cls.columnar:
+            self.columns = ColumnStore.from_objects(
+                cls.fields(), objects.values(), cls.timestamps)
+
+    def copy(self):
+        """ Copy of the snapshot to apply changes to, sharing what
+        they don't change
+        """
+        snapshot = Snapshot.__new__(Snapshot)
+        snapshot.objects = self.objects.copy()
+        snapshot.shards = None
+        snapshot.owned = set()
+        if self.shards is not None:
+            # Shards are copied when first changed
+            snapshot.shards = list(self.shards)
+        snapshot.indexes = {name: [index.copy() for index in indexes]
+                            for name, indexes in self.indexes.items()}
+        snapshot.columns = None
+        if self.columns is not None:
+            snapshot.columns = self.columns.copy()
+        return snapshot
+
+    def put(self, obj: TypeVar('Base'), check: bool = True):
+        """ Insert or update an object. Raises UniqueConstraintError
+        if `check` and it duplicates a unique value
+        """
+        self.objects[obj.id] = obj
+        if self.shards is not None:
+            self.shard(obj.id)[obj.id] = obj
+        for indexes in self.indexes.values():
+            for index in indexes:
+                index.add(obj, check)
+        if self.columns is not None:
+            self.columns.put(obj)
+
+    def put_all(self, objs: list, check: bool = True):
+        """ Insert or update objects, as `put`, in one pass over the
+        sorted indexes when they are many
+        """
+        for obj in objs:
+            self.objects[obj.id] = obj
+            if self.shards is not None:
+                self.shard(obj.id)[obj.id] = obj
+            if self.columns is not None:
+                self.columns.put(obj)
+        for indexes in self.indexes.values():
+            for index in indexes:
+                index.add_many(objs, check)
+
+    def shard(self, obj_id: str) -> dict:
+        """ Objects of the shard of an ID, copied to be changed
+        """
+        k = shard_of(obj_id, len(self.shards))
+        if k not in self.owned:
+            self.shards[k] = dict(self.shards[k])
+            self.owned.add(k)
+        return self.shards[k]
+
+    def delete(self, obj_id: str) -> bool:
+        """ Remove an object, False if it isn't there
+        """
+        if self.objects.get(obj_id) is None:
+            return False
+        del self.objects[obj_id]
+        if self.shards is not None:
+            del self.shard(obj_id)[obj_id]
+        for indexes in self.indexes.values():
+            for index in indexes:
+                index.discard(obj_id)
+        if self.columns is not None:
+            self.columns.delete(obj_id)
+        return True
+
+
+class FileLock():
+    """ Lock on a file shared between processes, exclusive for writers
+    and shared for readers. Does nothing where fcntl isn't available
+    """
+
+    def __init__(self, file_path: str, exclusive: bool = True):
+        """ Initialize the lock on a file
+        """
+        self.file_path = file_path
+        self.exclusive = exclusive
+        self.file = None
+
+    def __enter__(self):
+        """ Acquire the lock
+        """
+        if fcntl is not None:
+            self.file = open(self.file_path, 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX if self.exclusive
+                        else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *args):
+        """ Release the lock
+        """
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+class NoLock():
+    """ Lock doing nothing, for storages used by a single process
+    """
+
+    def __enter__(self):
+        """ Nothing to acquire
+        """
+        return self
+
+    def __exit__(self, *args):
+        """ Nothing to release
+        """
+        pass
+
+
+class FileStorage(Storage):
+    """ JSON file storage
+    """
+
+    def __init__(self, shared: bool = False, sync_interval: float = 0,
+                 shards: int = 0, binary: bool = False):
+        """ Initialize the storage and its writer lock. A shared storage
+        checks for changes of other processes at most every
+        `sync_interval` seconds
+        """
+        self.lock = threading.RLock()
+        self.shards = shards
+        self.extension = "bin" if binary else "json"
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.last_sync = 0
+        self.classes = {}
+        self.journals = {}
+        self.versions = {}
+
+    def file_lock(self, cls, exclusive: bool = True):
+        """ Inter-process lock of the files of a class
+        """
+        if not self.shared:
+            return NoLock()
+        return FileLock(".db_{}.lock".format(cls.__name__), exclusive)
+
+    def snapshot(self, cls) -> Snapshot:
+        """ Current snapshot of a class
+        """
+        snapshot = SNAPSHOTS.get(cls.__name__)
+        if snapshot is None:
+            with self.lock:
+                snapshot = SNAPSHOTS.get(cls.__name__)
+                if snapshot is None:
+                    snapshot = Snapshot(cls, {}, self.shards)
+                    self.publish(cls, snapshot)
+        return snapshot
+
+    def journal_state(self, cls) -> tuple:
+        """ (inode, size) of the journal of a class, None if missing
+        """
+        try:
+            st = os.stat(".db_{}.journal".format(cls.__name__))
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    def append(self, cls, changes: list):
+        """ Append (op, object) changes to the journal of a class, in
+        one write. Must be called with both locks held
+        """
+        s_class = cls.__name__
+        generation = self.journals.get(s_class, {'generation': 0})[
+            'generation']
+        lines = []
+        for op, obj in changes:
+            generation += 1
+            entry = {'generation': generation, 'op': op, 'id': obj.id}
+            if op == 'put':
+                entry['data'] = obj.to_json(True)
+            lines.append(json.dumps(entry) + "\n")
+        file_path = ".db_{}.journal".format(s_class)
+        with open(file_path, 'a') as f:
+            f.write("".join(lines))
+        self.journals[s_class] = {'generation': generation,
+                                  'position': self.journal_state(cls)}
+
+    def compact(self, cls):
+        """ Start a new journal once it grew past JOURNAL_MAX_SIZE.
+        The data file must hold every change: other processes see a
+        new inode and reload it. Must be called with both locks held
+        """
+        s_class = cls.__name__
+        position = self.journals[s_class]['position']
+        if position is None or position[1] <= JOURNAL_MAX_SIZE:
+            return
+        file_path = ".db_{}.journal".format(s_class)
+        generation = self.journals[s_class]['generation']
+        with atomic_write(file_path) as f:
+            f.write(json.dumps({'generation': generation,
+                                'op': 'compact'}) + "\n")
+        self.journals[s_class] = {'generation': generation,
+                                  'position': self.journal_state(cls)}
+
+    def sync(self, cls=None):
+        """ Apply the changes other processes made to a class, or to
+        every loaded class
+        """
+        if not self.shared:
+            return
+        if cls is None:
+            now = time.monotonic()
+            if now - self.last_sync < self.sync_interval:
+                return
+            self.last_sync = now
+            for klass in list(self.classes.values()):
+                self.sync(klass)
+            return
+        s_class = cls.__name__
+        position = self.journal_state(cls)
+        known = self.journals.get(s_class, {}).get('position')
+        if position == known:
+            return
+        with self.lock, self.file_lock(cls, exclusive=False):
+            self.catch_up(cls)
+
+    def catch_up(self, cls):
+        """ Apply the journal entries following the known position, or
+        reload the data file if the journal was replaced.
+        Must be called with both locks held
+        """
+        s_class = cls.__name__
+        state = self.journals.get(s_class, {})
+        known = state.get('position')
+        position = self.journal_state(cls)
+        if position == known:
+            return
+        if known is None or position is None or position[0] != known[0] \
+                or position[1] < known[1]:
+            self.read(cls, convert=False)
+            return
+        with open(".db_{}.journal".format(s_class), 'rb') as f:
+            f.seek(known[1])
+            tail = f.read()
+        end = tail.rfind(b"\n") + 1
+        try:
+            entries = [json.loads(line) for line in tail[:end].splitlines()]
+        except ValueError:
+            entries = None
+        if entries is None or (len(entries) > 0 and
+                               entries[0].get('generation') !=
+                               state['generation'] + 1):
+            # A new journal reusing the inode of the previous one
+            self.read(cls, convert=False)
+            return
+        self.changed(cls)
+        snapshot = self.snapshot(cls).copy()
+        generation = state['generation']
+        for entry in entries:
+            generation = entry['generation']
+            if entry['op'] == 'put':
+                snapshot.put(cls.from_json(entry['data']), check=False)
+            elif entry['op'] == 'delete':
+                snapshot.delete(entry['id'])
+        self.publish(cls, snapshot)
+        self.journals[s_class] = {
+            'generation': generation,
+            'position': (position[0], known[1] + end)}
+
+    def changed(self, cls):
+        """ Record that a class was reloaded or changed by another
+        process
+        """
+        s_class = cls.__name__
+        self.versions[s_class] = self.versions.get(s_class, 0) + 1
+
+    def version(self, cls):
+        """ Number of reloads and catch-ups of a class
+        """
+        return self.versions.get(cls.__name__, 0)
+
+    def publish(self, cls, snapshot: Snapshot):
+        """ Make a snapshot the current state of a class.
+        Must be called with the lock held
+        """
+        s_class = cls.__name__
+        SNAPSHOTS[s_class] = snapshot
+        DATA[s_class] = snapshot.objects
+        self.classes[s_class] = cls
+
+    def objects(self, cls) -> dict:
+        """ In-memory objects of a class, by ID
+        """
+        return self.snapshot(cls).objects
+
+    def columns(self, cls) -> ColumnStore:
+        """ Column store of a class, None if the class isn't columnar
+        """
+        return self.snapshot(cls).columns
+
+    def indexes(self, cls, name: str) -> list:
+        """ Indexes on an attribute of a class
+        """
+        return self.snapshot(cls).indexes.get(name, [])
+
+    def load(self, cls):
+        """ Load all objects from file, holding the file lock exclusively
+        if files of another layout are to be converted
+        """
+        with self.lock:
+            with self.file_lock(cls, exclusive=False):
+                if not self.converts(cls):
+                    self.read(cls)
+                    return
+            with self.file_lock(cls):
+                self.read(cls)
+
+    def converts(self, cls) -> bool:
+        """ Whether files of a class are in another layout than the one
+        of the storage, to be converted when loaded
+        """
+        own = self.own_files(cls)
+        return any(files != own for files in self.layouts(cls))
+
+    def read(self, cls, convert: bool = True):
+        """ Replace the objects of a class by the content of its files:
+        the newest of its single file and shard files, in either format.
+        Read from other files than the ones of the storage (another
+        number of shards, or none, or the other format), they are
+        written again as those and removed, if `convert`.
+        Must be called with both locks held, the file lock exclusively
+        to convert
+        """
+        s_class = cls.__name__
+        layouts = self.layouts(cls)
+        own = self.own_files(cls)
+        files = max(layouts, default=[], key=lambda files: (
+            max(os.stat(f).st_mtime_ns for f in files), files == own))
+        objs = {}
+        for obj in self.read_files(cls, files):
+            objs[obj.id] = obj
+        self.changed(cls)
+        snapshot = Snapshot(cls, objs, self.shards)
+        self.publish(cls, snapshot)
+        for indexes in snapshot.indexes.values():
+            for index in indexes:
+                if isinstance(index, HashIndex) and index.unique:
+                    report_duplicates(cls, index.name, index.duplicates())
+        if convert:
+            if len(files) > 0 and files != own:
+                self.write(cls)
+            self.remove_files([f for layout in self.layouts(cls)
+                               for f in layout if f not in own])
+        if self.shared:
+            self.journals[s_class] = {'generation': self.generation(cls),
+                                      'position': self.journal_state(cls)}
+
+    def data_path(self, cls) -> str:
+        """ File of a class stored without shards
+        """
+        return ".db_{}.{}".format(cls.__name__, self.extension)
+
+    def shard_path(self, cls, k: int) -> str:
+        """ File of the k-th shard of a class
+        """
+        return ".db_{}.{}.{}".format(cls.__name__, k, self.extension)
+
+    def own_files(self, cls) -> list:
+        """ Files the storage writes for a class: its single file or
+        its shard files
+        """
+        if self.shards == 0:
+            return [self.data_path(cls)]
+        return [self.shard_path(cls, k) for k in range(self.shards)]
+
+    def shard_files(self, cls, extension: str = None) -> list:
+        """ Shard files of a class, in shard order, in the format of
+        the storage or another
+        """
+        files = glob.glob(".db_{}.[0-9]*.{}".format(
+            cls.__name__, extension or self.extension))
+        return sorted(files, key=lambda f: int(f.rsplit('.', 2)[-2]))
+
+    def layouts(self, cls) -> list:
+        """ Existing files of a class, by layout: its single file and
+        its shard files in each format
+        """
+        layouts = []
+        for extension in EXTENSIONS:
+            file_path = ".db_{}.{}".format(cls.__name__, extension)
+            if path.exists(file_path):
+                layouts.append([file_path])
+            shard_files = self.shard_files(cls, extension)
+            if len(shard_files) > 0:
+                layouts.append(shard_files)
+        return layouts
+
+    def remove_files(self, file_paths: list):
+        """ Remove files of a class replaced by the files of the storage,
+        unless already removed
+        """
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def read_files(self, cls, files: list) -> Iterable:
+        """ Objects of files, parsed in parallel if there are several
+        """
+        workers = min(len(files), os.cpu_count() or 1)
+        if workers <= 1:
+            for file_path in files:
+                yield from read_file(cls, file_path)
+            return
+        with ProcessPoolExecutor(workers) as pool:
+            for objs in pool.map(read_file, [cls] * len(files), files):
+                yield from objs
+
+    def generation(self, cls) -> int:
+        """ Generation of the last entry of the journal of a class
+        """
+        file_path = ".db_{}.journal".format(cls.__name__)
+        if not path.exists(file_path):
+            return 0
+        with open(file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 65536))
+            lines = f.read().split(b"\n")
+        for line in reversed(lines[1:-1] if len(lines) > 2 else lines):
+            try:
+                return json.loads(line)['generation']
+            except (ValueError, KeyError):
+                continue
+        return 0
+
+    def flush(self, cls):
+        """ Save all objects to file, replacing it atomically
+        """
+        self.write(cls)
+
+    def write(self, cls, shards: set = None):
+        """ Save all objects to file, or to the files of some shards.
+        Saving all removes the files of shards beyond the number of
+        shards
+        """
+        with self.lock:
+            snapshot = self.snapshot(cls)
+            if snapshot.shards is None:
+                self.write_file(cls, self.data_path(cls), snapshot.objects)
+                return
+            if shards is not None:
+                for k in shards:
+                    self.write_file(cls, self.shard_path(cls, k),
+                                    snapshot.shards[k])
+                return
+            expected = []
+            for k, objs in enumerate(snapshot.shards):
+                expected.append(self.shard_path(cls, k))
+                self.write_file(cls, expected[-1], objs)
+            for extra in set(self.shard_files(cls)) - set(expected):
+                # Left by a larger number of shards
+                self.remove_files([extra])
+
+    def write_file(self, cls, file_path: str, objs: dict):
+        """ Save objects to a file, replacing it atomically
+        """
+        if self.extension == "bin":
+            write_records(file_path, cls, objs.values())
+            return
+        objs_json = {}
+        for obj_id, obj in objs.items():
+            objs_json[obj_id] = obj.to_json(True)
+        with atomic_write(file_path) as f:
+            # One string: json.dump goes through the pure Python encoder
+            f.write(json.dumps(objs_json))
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID
+        """
+        return self.objects(cls).get(obj_id)
+
+    def put(self, obj: TypeVar('Base')):
+        """ Store an object and save its class to file
+        """
+        self.apply(obj.__class__, [obj], [])
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object and save its class to file
+        """
+        return self.apply(obj.__class__, [], [obj.id]) > 0
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Remove objects by ID and store others in one new snapshot,
+        saved to file once. Nothing is changed if an object breaks a
+        unique constraint or doesn't have its expected version.
+        `notify` is called once written, under the file lock (see
+        Storage.apply). Returns the number of objects removed
+        """
+        with self.lock, self.file_lock(cls):
+            if self.shared:
+                self.catch_up(cls)
+            stored = self.snapshot(cls).objects
+            versions = check_versions(
+                saved, expected,
+                lambda obj_id: getattr(stored.get(obj_id), 'version', None))
+            snapshot = self.snapshot(cls).copy()
+            changes = []
+            for obj_id in removed:
+                obj = snapshot.objects.get(obj_id)
+                if obj is not None and snapshot.delete(obj_id):
+                    changes.append(('delete', obj))
+            n_removed = len(changes)
+            snapshot.put_all(saved)
+            changes.extend(('put', obj) for obj in saved)
+            if len(changes) == 0:
+                return 0
+            previous = set_versions(saved, versions)
+            stored = self.snapshot(cls)
+            self.publish(cls, snapshot)
+            try:
+                if self.shared:
+                    self.append(cls, changes)
+                if snapshot.shards is None:
+                    self.flush(cls)
+                else:
+                    self.write(cls, snapshot.owned)
+            except BaseException:
+                # Not written: the stored state is still the previous one
+                self.publish(cls, stored)
+                set_versions(saved, previous)
+                raise
+            if notify is not None:
+                notify([obj.id for op, obj in changes if op == 'delete'])
+            if self.shared:
+                self.compact(cls)
+        return n_removed
+
+    def rollback(self, cls, objs: list):
+        """ Read back the stored objects among `objs` from the files
+        holding them: they may have been changed in place
+        """
+        with self.lock, self.file_lock(cls, exclusive=False):
+            stored = self.snapshot(cls).objects
+            changed = {obj.id: obj for obj in objs
+                       if stored.get(obj.id) is obj}
+            if len(changed) == 0:
+                return
+            files = self.own_files(cls)
+            if self.shards > 0:
+                files = [self.shard_path(cls, k) for k in sorted(
+                    {shard_of(obj_id, self.shards) for obj_id in changed})]
+            for obj in self.read_files(cls, [f for f in files
+                                             if path.exists(f)]):
+                if obj.id in changed:
+                    changed[obj.id]._restore(obj)
+
+    def scan(self, cls) -> Iterable[TypeVar('Base')]:
+        """ All objects of a class
+        """
+        return self.objects(cls).values()
+
+    def count(self, cls, attributes: dict = {}) -> int:
+        """ Count from memory or from the column store
+        """
+        if len(attributes) == 0:
+            return len(self.objects(cls))
+        store = self.columns(cls)
+        if store is None:
+            return None
+        return store.count(attributes)
+
+    def lookup(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Lookup by ID, through the smallest hash index bucket or
+        through the column store
+        """
+        snapshot = self.snapshot(cls)
+        objs = snapshot.objects
+        if len(attributes) == 1 and 'id' in attributes:
+            try:
+                obj = objs.get(attributes['id'])
+            except TypeError:
+                return None
+            return [obj] if obj is not None else []
+        found = index_lookup(snapshot.indexes, attributes, objs.get)
+        if found is not None:
+            return found
+        store = snapshot.columns
+        if store is None or len(attributes) == 0:
+            return None
+        ids = store.search(attributes)
+        if ids is None:
+            return None
+        return [objs[obj_id] for obj_id in ids]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+""" IDs module
+
+Generators of the IDs of the Base objects and of the session IDs, as
+UUID strings. RandomIds makes random (version 4) UUIDs; OrderedIds
+makes time-ordered (version 7) UUIDs: 48 bits of milliseconds since
+the epoch, a 12 bits counter keeping the IDs of a millisecond in
+order, then 62 random bits. IDs made in order sort in that order, so
+that new objects are appended at the end of the ordered indexes.
+
+The random bits are taken from one os.urandom call per batch of IDs.
+A forked process drops the batch it inherited: it would make the same
+IDs as its parent.
+"""
+import os
+import threading
+import time
+import weakref
+
+
+BATCH_SIZE = 256
+# Every generator, for the reset of their random bytes after a fork
+GENERATORS = weakref.WeakSet()
+
+
+class RandomIds():
+    """ Generator of random (version 4) UUIDs
+    """
+    random_size = 16
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        """ Initialize the generator, reading the random bytes of
+        `batch_size` IDs at a time
+        """
+        self.batch_size = batch_size
+        self.reset()
+        GENERATORS.add(self)
+
+    def reset(self):
+        """ Drop the random bytes read, with a new lock
+        """
+        self.lock = threading.Lock()
+        self.pool = b''
+        self.position = 0
+
+    def random(self) -> int:
+        """ Next `random_size` random bytes, as an integer. Must be
+        called with the lock held
+        """
+        if self.position >= len(self.pool):
+            self.pool = os.urandom(self.random_size * self.batch_size)
+            self.position = 0
+        start = self.position
+        self.position += self.random_size
+        return int.from_bytes(self.pool[start:self.position], 'big')
+
+    def __call__(self) -> str:
+        """ New ID
+        """
+        with self.lock:
+            value = self.random()
+        return format_uuid(value & ~(0xF << 76) & ~(0x3 << 62) |
+                           0x4 << 76 | 0x2 << 62)
+
+
+class OrderedIds(RandomIds):
+    """ Generator of time-ordered (version 7) UUIDs, increasing in the
+    order they are made by the generator
+    """
+    random_size = 8
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        """ Initialize the generator
+        """
+        super().__init__(batch_size)
+        self.millis = 0
+        self.counter = 0
+
+    def __call__(self) -> str:
+        """ New ID
+        """
+        millis = time.time_ns() // 1000000
+        with self.lock:
+            if millis > self.millis:
+                self.millis = millis
+                self.counter = 0
+            else:
+                # Same millisecond, or clock set back: next in order
+                self.counter += 1
+                if self.counter > 0xFFF:
+                    self.millis += 1
+                    self.counter = 0
+            millis = self.millis
+            counter = self.counter
+            rand = self.random() & ((1 << 62) - 1)
+        return format_uuid((millis & ((1 << 48) - 1)) << 80 | 0x7 << 76 |
+                           counter << 64 | 0x2 << 62 | rand)
+
+
+def reset_after_fork():
+    """ Reset every generator in a forked process
+    """
+    for generator in list(GENERATORS):
+        generator.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def format_uuid(value: int) -> str:
+    """ Canonical string of a 128 bits UUID
+    """
+    h = '%032x' % value
+    return '{}-{}-{}-{}-{}'.format(h[:8], h[8:12], h[12:16], h[16:20],
+                                   h[20:])
+
+
+def id_generator(name: str) -> RandomIds:
+    """ Generator of IDs by name: "uuid4" (random) or "uuid7"
+    (time-ordered). Raises ValueError for another name
+    """
+    if name == 'uuid4':
+        return RandomIds()
+    if name == 'uuid7':
+        return OrderedIds()
+    raise ValueError("Unknown ID generator: {}".format(name))
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+""" Index module
+
+In-memory secondary indexes on one attribute of a class, mapping
+attribute values to object IDs. Copies share their content with the
+index copied (see models.layered) until it changes.
+"""
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate, islice
+from typing import Iterable, Iterator, List
+from models.layered import LayeredDict
+from models.storage import UniqueConstraintError
+
+
+CHUNK_SIZE = 512
+# Objects indexed at once in a sorted index are merged in one pass over
+# its entries when more than 1/BULK_RATIO of them
+BULK_RATIO = 16
+
+
+def fold(value):
+    """ Case-insensitive key of a value: strings are lower-cased
+    """
+    if type(value) is str:
+        return value.lower()
+    return value
+
+
+class HashIndex():
+    """ Index answering equality lookups in O(1)
+
+    A unique index rejects a second object with the same (non-None)
+    value, unless the object already had it: duplicates stored before
+    the constraint are kept. A case-insensitive one compares strings
+    ignoring case.
+
+    A value held by one object maps to its ID, as in a unique index;
+    a value held by several maps to a dict of their IDs.
+    """
+
+    def __init__(self, name: str, unique: bool = False,
+                 case_insensitive: bool = False):
+        """ Initialize an empty index on an attribute
+        """
+        self.name = name
+        self.unique = unique
+        self.case_insensitive = case_insensitive
+        self.buckets = LayeredDict()
+        self.key_of = LayeredDict()
+        self.other = LayeredDict()
+        self.owned = None
+
+    def key(self, value):
+        """ Key of a value in the index
+        """
+        if self.case_insensitive:
+            return fold(value)
+        return value
+
+    def copy(self):
+        """ Copy of the index sharing its buckets until they change
+        """
+        index = HashIndex(self.name, self.unique, self.case_insensitive)
+        index.buckets = self.buckets.copy()
+        index.key_of = self.key_of.copy()
+        index.other = self.other.copy()
+        index.owned = set()
+        return index
+
+    def _bucket(self, key) -> dict:
+        """ Bucket of IDs of a key that can be modified
+        """
+        bucket = self.buckets[key]
+        if self.owned is not None and key not in self.owned:
+            self.owned.add(key)
+            bucket = self.buckets[key] = dict(bucket)
+        return bucket
+
+    def ids(self, key) -> List[str]:
+        """ IDs of the objects with a key. Raises TypeError if it is
+        unhashable
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return []
+        if type(bucket) is not dict:
+            return [bucket]
+        return list(bucket)
+
+    def add(self, obj, check: bool = True):
+        """ Index an object, replacing its previous entry. Raises
+        UniqueConstraintError, leaving the index unchanged, if another
+        object has the same value in a unique index
+        """
+        self.add_value(obj.id, getattr(obj, self.name, None), check)
+
+    def add_value(self, obj_id: str, value, check: bool = True):
+        """ Index the value of an object given by ID, as `add`
+        """
+        key = self.key(value)
+        if check and self.unique and key is not None and \
+                self.key_of.get(obj_id) != key:
+            try:
+                for other_id in self.ids(key):
+                    if other_id != obj_id:
+                        raise UniqueConstraintError(self.name, value)
+            except TypeError:
+                pass
+        self.discard(obj_id)
+        try:
+            bucket = self.buckets.get(key)
+        except TypeError:
+            self.other[obj_id] = None
+            return
+        if bucket is None:
+            self.buckets[key] = obj_id
+        elif type(bucket) is not dict:
+            self.buckets[key] = {bucket: None, obj_id: None}
+            if self.owned is not None:
+                self.owned.add(key)
+        else:
+            self._bucket(key)[obj_id] = None
+        self.key_of[obj_id] = key
+
+    def add_all(self, objs: Iterable):
+        """ Index stored objects, as they are: duplicates already
+        stored aren't rejected
+        """
+        for obj in objs:
+            self.add(obj, check=False)
+
+    def add_many(self, objs: list, check: bool = True):
+        """ Index objects, as `add`
+        """
+        for obj in objs:
+            self.add(obj, check)
+
+    def discard(self, obj_id: str):
+        """ Remove the entry of an object
+        """
+        if obj_id not in self.key_of:
+            self.other.pop(obj_id, None)
+            return
+        key = self.key_of.pop(obj_id)
+        if type(self.buckets[key]) is not dict:
+            del self.buckets[key]
+            return
+        bucket = self._bucket(key)
+        del bucket[obj_id]
+        if len(bucket) == 1:
+            self.buckets[key] = next(iter(bucket))
+
+    def duplicates(self) -> dict:
+        """ IDs of the objects sharing a value, by key
+        """
+        return {key: list(bucket) for key, bucket in self.buckets.items()
+                if key is not None and type(bucket) is dict}
+
+    def lookup(self, value) -> List[str]:
+        """ IDs of the objects whose value is equal to `value`, plus
+        the unindexed ones. Raises TypeError if value is unhashable
+        """
+        ids = self.ids(self.key(value))
+        ids.extend(self.other)
+        return ids
+
+    def estimate(self, value) -> int:
+        """ Number of IDs `lookup` would return
+        """
+        bucket = self.buckets.get(self.key(value))
+        if bucket is None:
+            n = 0
+        elif type(bucket) is not dict:
+            n = 1
+        else:
+            n = len(bucket)
+        return n + len(self.other)
+
+
+class SortedEntries():
+    """ Sorted list kept in chunks of about CHUNK_SIZE items: a copy
+    shares the chunks, copied when first changed
+    """
+
+    def __init__(self, items: list = ()):
+        """ Initialize with sorted items
+        """
+        items = list(items)
+        self.chunks = [items[i:i + CHUNK_SIZE]
+                       for i in range(0, len(items), CHUNK_SIZE)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.owned = [True] * len(self.chunks)
+        self.length = len(items)
+        self.starts = None
+
+    def copy(self):
+        """ Copy sharing the chunks
+        """
+        entries = SortedEntries.__new__(SortedEntries)
+        entries.chunks = list(self.chunks)
+        entries.maxes = list(self.maxes)
+        entries.owned = [False] * len(self.chunks)
+        entries.length = self.length
+        entries.starts = self.starts
+        return entries
+
+    def __len__(self) -> int:
+        """ Number of items
+        """
+        return self.length
+
+    def __iter__(self) -> Iterator:
+        """ Items in order
+        """
+        for chunk in self.chunks:
+            yield from chunk
+
+    def start(self, k: int) -> int:
+        """ Position of the first item of the k-th chunk
+        """
+        if self.starts is None:
+            self.starts = list(accumulate((len(chunk)
+                                           for chunk in self.chunks),
+                                          initial=0))
+        return self.starts[k]
+
+    def locate(self, i: int) -> tuple:
+        """ (chunk, position in the chunk) of the item at a position
+        """
+        self.start(0)
+        k = bisect_right(self.starts, i) - 1
+        return k, i - self.starts[k]
+
+    def __getitem__(self, i: int):
+        """ Item at a position
+        """
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("index out of range")
+        k, j = self.locate(i)
+        return self.chunks[k][j]
+
+    def slice(self, lo: int, hi: int, reverse: bool = False) -> Iterator:
+        """ Items between two positions, in reverse order if `reverse`
+        """
+        if lo >= hi:
+            return
+        if reverse:
+            k, j = self.locate(hi - 1)
+            n = hi - lo
+            while n > 0:
+                items = self.chunks[k][max(0, j + 1 - n):j + 1]
+                yield from reversed(items)
+                n -= len(items)
+                k -= 1
+                j = len(self.chunks[k]) - 1
+            return
+        k, j = self.locate(lo)
+        n = hi - lo
+        for chunk in islice(self.chunks, k, None):
+            items = chunk[j:j + n]
+            yield from items
+            n -= len(items)
+            if n <= 0:
+                return
+            j = 0
+
+    def bisect_left(self, item) -> int:
+        """ Position where an item would be inserted, before equal ones
+        """
+        k = bisect_left(self.maxes, item)
+        if k == len(self.maxes):
+            return self.length
+        return self.start(k) + bisect_left(self.chunks[k], item)
+
+    def bisect_right(self, item) -> int:
+        """ Position where an item would be inserted, after equal ones
+        """
+        k = bisect_right(self.maxes, item)
+        if k == len(self.maxes):
+            return self.length
+        return self.start(k) + bisect_right(self.chunks[k], item)
+
+    def chunk(self, k: int) -> list:
+        """ k-th chunk, copied to be changed
+        """
+        if not self.owned[k]:
+            self.chunks[k] = list(self.chunks[k])
+            self.owned[k] = True
+        self.starts = None
+        return self.chunks[k]
+
+    def insert(self, item):
+        """ Insert an item in order. Raises TypeError, unchanged, if it
+        can't be compared with the items
+        """
+        if len(self.chunks) == 0:
+            self.chunks.append([item])
+            self.maxes.append(item)
+            self.owned.append(True)
+            self.length = 1
+            self.starts = None
+            return
+        k = min(bisect_left(self.maxes, item), len(self.chunks) - 1)
+        j = bisect_right(self.chunks[k], item)
+        chunk = self.chunk(k)
+        chunk.insert(j, item)
+        self.maxes[k] = chunk[-1]
+        self.length += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self.chunks[k:k + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self.maxes[k:k + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+            self.owned[k:k + 1] = [True, True]
+
+    def remove(self, item):
+        """ Remove an item, which must be there
+        """
+        k = bisect_left(self.maxes, item)
+        chunk = self.chunk(k)
+        del chunk[bisect_left(chunk, item)]
+        self.length -= 1
+        if len(chunk) == 0:
+            del self.chunks[k]
+            del self.maxes[k]
+            del self.owned[k]
+        else:
+            self.maxes[k] = chunk[-1]
+
+
+class SortedIndex():
+    """ Index kept as a sorted list of (value, ID) pairs, answering
+    equality, range and prefix lookups by binary search
+    """
+
+    def __init__(self, name: str):
+        """ Initialize an empty index on an attribute
+        """
+        self.name = name
+        self.entries = SortedEntries()
+        self.key_of = LayeredDict()
+        self.other = LayeredDict()
+
+    def copy(self):
+        """ Copy of the index sharing its entries until they change
+        """
+        index = SortedIndex(self.name)
+        index.entries = self.entries.copy()
+        index.key_of = self.key_of.copy()
+        index.other = self.other.copy()
+        return index
+
+    def add(self, obj, check: bool = True):
+        """ Index an object, replacing its previous entry. None and
+        values not comparable with the indexed ones are kept aside
+        """
+        self.discard(obj.id)
+        key = getattr(obj, self.name, None)
+        if key is None:
+            self.other[obj.id] = None
+            return
+        try:
+            self.entries.insert((key, obj.id))
+        except TypeError:
+            self.other[obj.id] = None
+            return
+        self.key_of[obj.id] = key
+
+    def discard(self, obj_id: str):
+        """ Remove the entry of an object
+        """
+        if obj_id not in self.key_of:
+            self.other.pop(obj_id, None)
+            return
+        self.entries.remove((self.key_of.pop(obj_id), obj_id))
+
+    def bounds(self, start=None, end=None, inclusive: bool = False) -> tuple:
+        """ Positions of the entries with start <= value < end
+        (value <= end if inclusive). Raises TypeError if the bounds
+        can't be compared with the indexed values
+        """
+        lo = 0 if start is None else self.entries.bisect_left((start,))
+        if end is None:
+            hi = len(self.entries)
+        elif inclusive:
+            hi = self.entries.bisect_right((end, chr(0x10ffff)))
+        else:
+            hi = self.entries.bisect_left((end,))
+        return lo, max(lo, hi)
+
+    def after(self, entry: tuple) -> int:
+        """ Position of the first entry greater than a (value, ID) pair
+        """
+        return self.entries.bisect_right(entry)
+
+    def ids(self, lo: int, hi: int, reverse: bool = False) -> Iterator[str]:
+        """ IDs of the entries between two positions
+        """
+        for entry in self.entries.slice(lo, hi, reverse):
+            yield entry[1]
+
+    def lookup(self, lo: int, hi: int) -> List[str]:
+        """ IDs between two positions, plus the unindexed ones
+        """
+        ids = list(self.ids(lo, hi))
+        ids.extend(self.other)
+        return ids
+
+    def add_all(self, objs: Iterable):
+        """ Index many objects, sorting once at the end
+        """
+        self.add_values((obj.id, getattr(obj, self.name, None))
+                        for obj in objs)
+
+    def add_many(self, objs: list, check: bool = True):
+        """ Index objects, replacing their previous entries: one at a
+        time, or in one pass over the entries when they are many
+        """
+        if len(objs) * BULK_RATIO < len(self.entries):
+            for obj in objs:
+                self.add(obj)
+            return
+        self.add_all(objs)
+
+    def add_values(self, pairs: Iterable[tuple]):
+        """ Index many (ID, value) pairs, replacing the previous entries
+        of the IDs, sorting once at the end
+        """
+        pairs = dict(pairs)
+        entries = self.entries
+        if any(obj_id in self.key_of for obj_id in pairs):
+            entries = [entry for entry in entries if entry[1] not in pairs]
+            for obj_id in pairs:
+                self.key_of.pop(obj_id, None)
+        if len(self.other) > 0:
+            for obj_id in pairs:
+                self.other.pop(obj_id, None)
+        entries = list(entries)
+        keys = {}
+        for obj_id, key in pairs.items():
+            if key is None:
+                self.other[obj_id] = None
+                continue
+            entries.append((key, obj_id))
+            keys[obj_id] = key
+        self.key_of.update(keys)
+        try:
+            entries.sort()
+        except TypeError:
+            entries, pairs = [], entries
+            for key, obj_id in pairs:
+                try:
+                    insort(entries, (key, obj_id))
+                except TypeError:
+                    del self.key_of[obj_id]
+                    self.other[obj_id] = None
+        self.entries = SortedEntries(entries)
+
+
+def build(index_class, name: str, objs: Iterable, **kwargs):
+    """ Index of a given class on an attribute, filled with objects
+    """
+    index = index_class(name, **kwargs)
+    index.add_all(objs)
+    return index
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+""" Layered module
+
+Dictionary sharing its content with its copies, for the state copied
+on each write by the storages (see FileStorage's Snapshot). A copy
+keeps the base dictionary of the original, never modified once shared,
+and its own changes in a layer, merged into a new base once it holds
+more than the square root of the number of items: copying and changing
+N items costs O(sqrt(N)) instead of O(N).
+"""
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from math import isqrt
+
+
+MISSING = object()
+# Mark of a key of the base removed in the layer
+REMOVED = object()
+MIN_LAYER = 64
+
+
+class LayeredDict(MutableMapping):
+    """ Dictionary of a base and a layer of changes. Keeps the order
+    of a dict, changed keys where they were and new ones at the end,
+    except for keys removed and added back: they may keep their place
+    """
+
+    __slots__ = ('base', 'layer', 'size', 'shared')
+
+    def __init__(self, items=()):
+        """ Initialize a dictionary owning its base
+        """
+        self.base = dict(items)
+        self.layer = {}
+        self.size = len(self.base)
+        self.shared = False
+
+    def copy(self):
+        """ Copy sharing the base
+        """
+        self.shared = True
+        d = LayeredDict.__new__(LayeredDict)
+        d.base = self.base
+        d.layer = dict(self.layer)
+        d.size = self.size
+        d.shared = True
+        return d
+
+    def __getitem__(self, key):
+        """ Value of a key
+        """
+        value = self.layer.get(key, MISSING)
+        if value is MISSING:
+            return self.base[key]
+        if value is REMOVED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """ Value of a key, default if missing
+        """
+        value = self.layer.get(key, MISSING)
+        if value is MISSING:
+            return self.base.get(key, default)
+        if value is REMOVED:
+            return default
+        return value
+
+    def __contains__(self, key) -> bool:
+        """ True if the key is there
+        """
+        value = self.layer.get(key, MISSING)
+        if value is MISSING:
+            return key in self.base
+        return value is not REMOVED
+
+    def __setitem__(self, key, value):
+        """ Set the value of a key
+        """
+        if not self.shared:
+            self.base[key] = value
+            self.size = len(self.base)
+            return
+        if key not in self:
+            self.size += 1
+        self.layer[key] = value
+        self.grown()
+
+    def __delitem__(self, key):
+        """ Remove a key
+        """
+        if key not in self:
+            raise KeyError(key)
+        if not self.shared:
+            del self.base[key]
+        elif key in self.base:
+            self.layer[key] = REMOVED
+            self.grown()
+        else:
+            del self.layer[key]
+        self.size -= 1
+
+    def pop(self, key, default=MISSING):
+        """ Remove a key and return its value, or default if missing
+        """
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            if default is MISSING:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return value
+
+    def update(self, items=(), **kwargs):
+        """ Set the values of many keys, at once while the base is owned
+        """
+        if not self.shared and not kwargs:
+            self.base.update(items)
+            self.size = len(self.base)
+            return
+        super().update(items, **kwargs)
+
+    def grown(self):
+        """ Merge the layer into a new base, owned, once it's too large
+        """
+        if len(self.layer) <= max(MIN_LAYER, isqrt(len(self.base))):
+            return
+        base = dict(self.base)
+        for key, value in self.layer.items():
+            if value is REMOVED:
+                del base[key]
+            else:
+                base[key] = value
+        self.base = base
+        self.layer = {}
+        self.shared = False
+
+    def __len__(self) -> int:
+        """ Number of keys
+        """
+        return self.size
+
+    def __iter__(self):
+        """ Iterator over the keys
+        """
+        if len(self.layer) == 0:
+            return iter(self.base)
+        return self.keys_layered()
+
+    def keys_layered(self):
+        """ Yield the keys of the base, without those removed, then
+        the keys added
+        """
+        base = self.base
+        layer = self.layer
+        for key in base:
+            if layer.get(key) is not REMOVED:
+                yield key
+        for key, value in layer.items():
+            if value is not REMOVED and key not in base:
+                yield key
+
+    def values(self):
+        """ View of the values
+        """
+        return LayeredValues(self)
+
+    def items(self):
+        """ View of the (key, value) pairs
+        """
+        return LayeredItems(self)
+
+    def __repr__(self) -> str:
+        """ Representation, as a dict
+        """
+        return "LayeredDict({!r})".format(dict(self.items()))
+
+
+class LayeredValues(ValuesView):
+    """ Values of a LayeredDict, iterated from the base while the
+    layer is empty
+    """
+
+    def __iter__(self):
+        """ Iterator over the values
+        """
+        d = self._mapping
+        if len(d.layer) == 0:
+            return iter(d.base.values())
+        return (value for key, value in d.items())
+
+
+class LayeredItems(ItemsView):
+    """ (key, value) pairs of a LayeredDict, iterated from the base
+    while the layer is empty
+    """
+
+    def __iter__(self):
+        """ Iterator over the pairs
+        """
+        d = self._mapping
+        if len(d.layer) == 0:
+            return iter(d.base.items())
+        return self.items_layered()
+
+    def items_layered(self):
+        """ Yield the pairs of the base, changed by the layer, then the
+        pairs added
+        """
+        base = self._mapping.base
+        layer = self._mapping.layer
+        for key, value in base.items():
+            changed = layer.get(key, MISSING)
+            if changed is MISSING:
+                yield key, value
+            elif changed is not REMOVED:
+                yield key, changed
+        for key, value in layer.items():
+            if value is not REMOVED and key not in base:
+                yield key, value
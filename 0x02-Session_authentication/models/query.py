@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+""" Query module
+
+Queries over the objects of a Base subclass: predicates on attributes,
+ordering, offset and limit. The planner answers from the most selective
+index the storage offers, else from its column store (see
+models.columnar), and only scans when neither applies.
+
+    User.query({'email': Prefix('bob'),
+                'created_at': Range(start=last_week)},
+               order_by='created_at', limit=10).all()
+"""
+from itertools import islice
+from typing import TypeVar, Iterator, List
+from models.index import HashIndex, SortedIndex
+
+
+class Predicate():
+    """ Condition on the value of one attribute
+    """
+
+    def match(self, value) -> bool:
+        """ True if the value satisfies the condition
+        """
+        raise NotImplementedError()
+
+    def candidates(self, index) -> tuple:
+        """ (estimate, ids, exact) of the IDs an index gives for the
+        condition, None if the index can't be used. `exact` is True
+        when every candidate matches
+        """
+        return None
+
+
+class Eq(Predicate):
+    """ value == expected
+    """
+
+    def __init__(self, value):
+        """ Initialize with the expected value
+        """
+        self.value = value
+
+    def match(self, value) -> bool:
+        """ Same comparison as Base.search
+        """
+        return not (value != self.value)
+
+    def candidates(self, index) -> tuple:
+        """ Bucket of a hash index or equal range of a sorted index.
+        The bucket of a case-insensitive index also holds the values
+        differing only in case
+        """
+        if isinstance(index, HashIndex):
+            n = index.estimate(self.value)
+            return (n, lambda: index.lookup(self.value),
+                    not index.other and not index.case_insensitive)
+        if isinstance(index, SortedIndex) and self.value is not None:
+            lo, hi = index.bounds(self.value, self.value, inclusive=True)
+            return (hi - lo + len(index.other),
+                    lambda: index.lookup(lo, hi), not index.other)
+        return None
+
+
+class In(Predicate):
+    """ value in expected values
+    """
+
+    def __init__(self, values):
+        """ Initialize with the expected values
+        """
+        self.values = list(values)
+
+    def match(self, value) -> bool:
+        """ True if the value is one of the expected values
+        """
+        return value in self.values
+
+    def candidates(self, index) -> tuple:
+        """ Union of the equality candidates of every value
+        """
+        parts = [Eq(v).candidates(index) for v in self.values]
+        if len(parts) == 0:
+            return 0, lambda: [], True
+        if None in parts:
+            return None
+        return (sum(p[0] for p in parts),
+                lambda: [i for p in parts for i in p[1]()], False)
+
+
+class Prefix(Predicate):
+    """ String value starting with a prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize with the prefix
+        """
+        self.prefix = prefix
+
+    def match(self, value) -> bool:
+        """ True if the value is a string starting with the prefix
+        """
+        return type(value) is str and value.startswith(self.prefix)
+
+    def candidates(self, index) -> tuple:
+        """ Range of a sorted index between the prefix and the first
+        string following all the strings starting with it
+        """
+        if not isinstance(index, SortedIndex):
+            return None
+        end = None
+        if len(self.prefix) > 0:
+            end = self.prefix[:-1] + chr(ord(self.prefix[-1]) + 1)
+        lo, hi = index.bounds(self.prefix, end)
+        return (hi - lo + len(index.other),
+                lambda: index.lookup(lo, hi), not index.other)
+
+
+class Range(Predicate):
+    """ start <= value < end, missing bounds being unbounded
+    """
+
+    def __init__(self, start=None, end=None):
+        """ Initialize with the bounds
+        """
+        self.start = start
+        self.end = end
+
+    def match(self, value) -> bool:
+        """ True if the value is within the bounds
+        """
+        if value is None:
+            return False
+        try:
+            if self.start is not None and value < self.start:
+                return False
+            if self.end is not None and not value < self.end:
+                return False
+        except TypeError:
+            return False
+        return True
+
+    def candidates(self, index) -> tuple:
+        """ Range of a sorted index
+        """
+        if not isinstance(index, SortedIndex):
+            return None
+        lo, hi = index.bounds(self.start, self.end)
+        return (hi - lo + len(index.other),
+                lambda: index.lookup(lo, hi), not index.other)
+
+
+class Query():
+    """ Query over the objects of a class
+    """
+
+    def __init__(self, cls, where: dict = {}, order_by: str = None,
+                 descending: bool = False, limit: int = None,
+                 offset: int = 0):
+        """ Initialize a query. Values of `where` that aren't
+        predicates are compared for equality
+        """
+        self.cls = cls
+        self.where = {}
+        for name, pred in where.items():
+            if not isinstance(pred, Predicate):
+                pred = Eq(pred)
+            self.where[name] = pred
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+        self.offset = offset
+
+    def plan(self) -> tuple:
+        """ (attribute, estimate, ids, exact) of the most selective
+        index usable by the query, None if it needs a scan
+        """
+        storage = self.cls.storage
+        best = None
+        for name, pred in self.where.items():
+            for index in storage.indexes(self.cls, name):
+                try:
+                    found = pred.candidates(index)
+                except TypeError:
+                    continue
+                if found is None:
+                    continue
+                if best is None or found[0] < best[1]:
+                    best = (name,) + found
+        return best
+
+    def explain(self) -> dict:
+        """ Description of the plan chosen for the query
+        """
+        best = self.plan()
+        if best is None:
+            return {'index': None, 'estimate': None}
+        return {'index': best[0], 'estimate': best[1]}
+
+    def matches(self, obj) -> bool:
+        """ True if the object satisfies every predicate
+        """
+        for name, pred in self.where.items():
+            if not pred.match(getattr(obj, name, None)):
+                return False
+        return True
+
+    def _objects(self, ids) -> Iterator[TypeVar('Base')]:
+        """ Objects of a sequence of IDs, each one once
+        """
+        seen = set()
+        get = self.cls.storage.get
+        for obj_id in ids:
+            if obj_id in seen:
+                continue
+            seen.add(obj_id)
+            obj = get(self.cls, obj_id)
+            if obj is not None:
+                yield obj
+
+    def _ordered_index(self) -> SortedIndex:
+        """ Sorted index on the ordering attribute, if any
+        """
+        if self.order_by is None:
+            return None
+        for index in self.cls.storage.indexes(self.cls, self.order_by):
+            if isinstance(index, SortedIndex):
+                return index
+        return None
+
+    def _columns(self):
+        """ Column store of the storage, None if it has none or there
+        are no predicates to evaluate
+        """
+        if len(self.where) == 0:
+            return None
+        return self.cls.storage.columns(self.cls)
+
+    def _candidates(self) -> tuple:
+        """ (objects to filter, True if already in the query order)
+        """
+        best = self.plan()
+        if best is not None:
+            return self._objects(best[2]()), self.order_by is None
+        store = self._columns()
+        if store is not None:
+            ids = store.search(self.where)
+            if ids is not None:
+                return self._objects(ids), self.order_by is None
+        index = self._ordered_index()
+        if index is not None:
+            ids = list(index.ids(0, len(index.entries), self.descending))
+            ids.extend(index.other)
+            return self._objects(ids), True
+        return self.cls.storage.scan(self.cls), self.order_by is None
+
+    def _sorted(self, objs) -> List[TypeVar('Base')]:
+        """ Objects sorted on the ordering attribute, None values last
+        """
+        name = self.order_by
+        values = []
+        nones = []
+        for obj in objs:
+            if getattr(obj, name, None) is None:
+                nones.append(obj)
+            else:
+                values.append(obj)
+        values.sort(key=lambda obj: getattr(obj, name),
+                    reverse=self.descending)
+        return values + nones
+
+    def __iter__(self) -> Iterator[TypeVar('Base')]:
+        """ Iterate over the matching objects
+        """
+        objs, ordered = self._candidates()
+        objs = filter(self.matches, objs)
+        if not ordered:
+            objs = self._sorted(objs)
+        end = None if self.limit is None else self.offset + self.limit
+        return islice(objs, self.offset, end)
+
+    def all(self) -> List[TypeVar('Base')]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> TypeVar('Base'):
+        """ First matching object, None if there is none
+        """
+        return next(iter(self), None)
+
+    def count(self) -> int:
+        """ Number of matching objects, ignoring offset and limit
+        """
+        best = self.plan()
+        if len(self.where) == 1 and best is not None and best[3]:
+            return best[1]
+        store = self._columns()
+        if best is None and store is not None:
+            n = store.count(self.where)
+            if n is not None:
+                return n
+        objs, _ = self._candidates()
+        return sum(1 for obj in objs if self.matches(obj))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+""" Record file module
+
+Binary alternative to the JSON files of FileStorage, `.db_<class
+name>.bin`: a header holding the schema of the class, then one
+length-prefixed record per object, without the key names and with
+timestamps as fixed-width epoch seconds.
+
+File layout (little-endian):
+    header   magic, schema length, schema (JSON: class name and
+             [name, kind] of the fields, kind "t" for a timestamp and
+             "v" for any other value)
+    records  [payload length][payload]
+    payload  one int64 per timestamp, a bitmap of the values stored
+             as JSON, one uint32 length per value (NULL for None),
+             then the values: UTF-8 strings, or JSON for other types
+
+Usage: python3 -m models.record_file to-binary|to-json <module.Class>
+"""
+from datetime import datetime
+from typing import Iterable, Iterator
+import calendar
+import importlib
+import json
+import os
+import struct
+import sys
+from models.storage import atomic_write
+
+
+MAGIC = b'BASEREC1'
+HEADER = struct.Struct('<8sI')
+LENGTH = struct.Struct('<I')
+NULL = 0xFFFFFFFF
+NULL_TIME = -(1 << 63)
+TIMESTAMPS = ('created_at', 'updated_at')
+EXTRA = '__extra__'
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class RecordCodec():
+    """ Encoder and decoder of the records of a class
+    """
+
+    def __init__(self, cls, schema: list = None):
+        """ Initialize on the schema of a file, or on the fields of the
+        class. Attributes set outside the fields are kept in EXTRA
+        """
+        self.cls = cls
+        if schema is None:
+            schema = [[name, 't' if name in TIMESTAMPS else 'v']
+                      for name in cls.fields()] + [[EXTRA, 'v']]
+        self.schema = schema
+        self.times = [name for name, kind in schema if kind == 't']
+        self.values = [name for name, kind in schema if kind == 'v']
+        if len(self.values) > 32:
+            raise ValueError("More than 32 values in a record")
+        self.fixed = struct.Struct('<' + 'q' * len(self.times) + 'I' +
+                                   'I' * len(self.values))
+
+    def header(self) -> bytes:
+        """ Header of a file of the class
+        """
+        schema = json.dumps({'class': self.cls.__name__,
+                             'fields': self.schema}).encode()
+        return HEADER.pack(MAGIC, len(schema)) + schema
+
+    def encode(self, obj) -> bytes:
+        """ Payload of an object
+        """
+        fixed = []
+        for name in self.times:
+            value = getattr(obj, '_' + name, None)
+            if type(value) is datetime:
+                value = calendar.timegm(value.utctimetuple())
+            fixed.append(NULL_TIME if value is None else value)
+        json_bits = 0
+        lengths = []
+        data = []
+        for i, name in enumerate(self.values):
+            if name == EXTRA:
+                value = None
+                if len(getattr(obj, '__dict__', ())) > 0:
+                    value = {k: v.strftime(TIMESTAMP_FORMAT)
+                             if type(v) is datetime else v
+                             for k, v in obj.__dict__.items()}
+            else:
+                value = getattr(obj, name, None)
+            if value is None:
+                lengths.append(NULL)
+                continue
+            if type(value) is str:
+                value = value.encode()
+            else:
+                value = json.dumps(value).encode()
+                json_bits |= 1 << i
+            lengths.append(len(value))
+            data.append(value)
+        fixed.append(json_bits)
+        return self.fixed.pack(*fixed, *lengths) + b''.join(data)
+
+    def decode(self, payload: bytes) -> dict:
+        """ Attributes of an object from its payload, timestamps in
+        epoch seconds
+        """
+        fixed = self.fixed.unpack_from(payload)
+        n_times = len(self.times)
+        result = {}
+        for name, value in zip(self.times, fixed):
+            result[name] = None if value == NULL_TIME else value
+        json_bits = fixed[n_times]
+        offset = self.fixed.size
+        for i, (name, length) in enumerate(zip(self.values,
+                                               fixed[n_times + 1:])):
+            if length == NULL:
+                value = None
+            else:
+                value = payload[offset:offset + length]
+                offset += length
+                if json_bits >> i & 1:
+                    value = json.loads(value)
+                else:
+                    value = value.decode()
+            if name == EXTRA:
+                if value is not None:
+                    result.update(value)
+            else:
+                result[name] = value
+        return result
+
+
+def write_records(file_path: str, cls, objs: Iterable):
+    """ Write objects of a class to a record file, replacing it
+    atomically
+    """
+    codec = RecordCodec(cls)
+    chunks = [codec.header()]
+    for obj in objs:
+        payload = codec.encode(obj)
+        chunks.append(LENGTH.pack(len(payload)))
+        chunks.append(payload)
+    with atomic_write(file_path, 'wb') as f:
+        f.write(b''.join(chunks))
+
+
+def read_records(file_path: str, cls) -> Iterator:
+    """ Objects of a class from a record file
+    """
+    with open(file_path, 'rb') as f:
+        buf = f.read()
+    magic, schema_length = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("{} is not a record file".format(file_path))
+    offset = HEADER.size + schema_length
+    schema = json.loads(buf[HEADER.size:offset])
+    if schema['class'] != cls.__name__:
+        raise ValueError("{} holds {} objects".format(file_path,
+                                                      schema['class']))
+    codec = RecordCodec(cls, schema['fields'])
+    while offset < len(buf):
+        length = LENGTH.unpack_from(buf, offset)[0]
+        offset += LENGTH.size
+        yield cls.from_json(codec.decode(buf[offset:offset + length]))
+        offset += length
+
+
+def json_to_records(cls, json_path: str, records_path: str):
+    """ Convert the JSON file of a class to a record file
+    """
+    with open(json_path, 'r') as f:
+        objs_json = json.load(f)
+    write_records(records_path, cls,
+                  (cls.from_json(obj_json) for obj_json in objs_json.values()))
+
+
+def records_to_json(cls, records_path: str, json_path: str):
+    """ Convert the record file of a class to a JSON file
+    """
+    objs_json = {}
+    for obj in read_records(records_path, cls):
+        objs_json[obj.id] = obj.to_json(True)
+    with atomic_write(json_path) as f:
+        json.dump(objs_json, f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ('to-binary', 'to-json'):
+        print("Usage: python3 -m models.record_file to-binary|to-json "
+              "<module.Class>")
+        sys.exit(1)
+    module, name = sys.argv[2].rsplit('.', 1)
+    klass = getattr(importlib.import_module(module), name)
+    json_file = ".db_{}.json".format(name)
+    records_file = ".db_{}.bin".format(name)
+    if sys.argv[1] == 'to-binary':
+        json_to_records(klass, json_file, records_file)
+    else:
+        records_to_json(klass, records_file, json_file)
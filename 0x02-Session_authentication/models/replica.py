@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+""" Replica module
+
+Read-only storage following a primary on the same host. Each class is
+bootstrapped from the data file of the primary, `.db_<class
+name>.json`, and kept up to date by applying the events the primary
+appends to its change log (see models.events.ChangeLog).
+
+The change log position is recorded before a data file is read, so an
+event may be applied to a snapshot already holding its change: events
+carry the full object, applying them again is harmless.
+"""
+from typing import Callable
+import os
+import time
+from models.events import ChangeLog
+from models.file_storage import FileStorage
+from models.storage import ReadOnlyError
+
+
+class ReplicaStorage(FileStorage):
+    """ Read-only FileStorage tailing the change log of a primary
+    """
+
+    def __init__(self, change_log: str = ".db_changes.ndjson",
+                 sync_interval: float = 0, shards: int = 0,
+                 binary: bool = False):
+        """ Initialize on the change log of the primary, read at most
+        every `sync_interval` seconds, and on its files (split in
+        `shards` shards, record files if `binary`)
+        """
+        super().__init__(sync_interval=sync_interval, shards=shards,
+                         binary=binary)
+        self.change_log = change_log
+        self.position = None
+
+    def log_size(self) -> int:
+        """ Size of the change log, 0 if missing
+        """
+        try:
+            return os.stat(self.change_log).st_size
+        except OSError:
+            return 0
+
+    def load(self, cls):
+        """ Read the data file of a class, then apply the changes
+        logged since
+        """
+        with self.lock:
+            if self.position is None:
+                self.position = self.log_size()
+            self.read(cls)
+        self.sync(cls)
+
+    def sync(self, cls=None):
+        """ Apply the events appended to the change log. The classes
+        are read again if the log was truncated or replaced
+        """
+        if cls is None:
+            now = time.monotonic()
+            if now - self.last_sync < self.sync_interval:
+                return
+            self.last_sync = now
+        if self.position is None or self.log_size() == self.position:
+            return
+        with self.lock:
+            if self.log_size() < self.position:
+                self.position = self.log_size()
+                for klass in list(self.classes.values()):
+                    self.read(klass)
+                return
+            events, self.position = ChangeLog.read(self.change_log,
+                                                   self.position)
+            by_class = {}
+            for event in events:
+                by_class.setdefault(event['class'], []).append(event)
+            for s_class, class_events in by_class.items():
+                klass = self.classes.get(s_class)
+                if klass is None:
+                    # Not loaded: its data file holds these changes
+                    continue
+                snapshot = self.snapshot(klass).copy()
+                for event in class_events:
+                    if event['event'] == 'removed':
+                        snapshot.delete(event['id'])
+                    else:
+                        snapshot.put(klass.from_json(event['data']),
+                                     check=False)
+                self.changed(klass)
+                self.publish(klass, snapshot)
+
+    def write(self, cls, shards: set = None):
+        """ Never write: the files belong to the primary
+        """
+        pass
+
+    def remove_files(self, file_paths: list):
+        """ Never remove files of the primary
+        """
+        pass
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Refuse every change
+        """
+        raise ReadOnlyError()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+""" Shared table module
+
+Storage keeping each class in a memory-mapped file, `.db_<class
+name>.table`, so that forked workers share a single copy of the
+records and of their indexes through the page cache instead of each
+holding its own objects.
+
+File layout (little-endian):
+    header   magic, generation, record count, index slots
+    indexes  one open-addressing hash table per indexed attribute
+             (id first, then the `indexes` of the class), each slot
+             holding (hash of the value, offset of the record)
+    records  [json length][one hash per indexed attribute][json]
+
+Readers never write to the file. A write takes an exclusive file
+lock, builds the next generation of the table in a new file and
+replaces the old one; readers map the new file on their next `sync`.
+"""
+from os import path
+from typing import Callable, TypeVar, Iterable, Iterator, List
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from models.file_storage import FileLock
+from models.index import fold
+from models.storage import Storage, UniqueConstraintError, atomic_write, \
+    check_versions, matches, report_duplicates, set_versions
+
+
+MAGIC = b'BASETBL1'
+HEADER = struct.Struct('<8sQQQ')
+SLOT = struct.Struct('<QQ')
+LENGTH = struct.Struct('<I')
+
+
+def key_hash(value) -> int:
+    """ Hash of an attribute value, identical in every process.
+    Raises TypeError if the value isn't JSON serializable
+    """
+    data = json.dumps(value, sort_keys=True).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(),
+                          'little')
+
+
+class Table():
+    """ Read-only view of one generation of a table file
+    """
+
+    def __init__(self, file_path: str, n_keys: int):
+        """ Map a table file
+        """
+        self.n_keys = n_keys
+        self.record_header = struct.Struct('<I' + 'Q' * n_keys)
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.version = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.count, self.slots = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a table file".format(file_path))
+        self.records_offset = HEADER.size + \
+            n_keys * self.slots * SLOT.size
+
+    def records(self) -> Iterator[tuple]:
+        """ (offset, hashes, json bytes) of every record
+        """
+        buf = self.buffer
+        offset = self.records_offset
+        for _ in range(self.count):
+            header = self.record_header.unpack_from(buf, offset)
+            start = offset + self.record_header.size
+            yield offset, header[1:], buf[start:start + header[0]]
+            offset = start + header[0]
+
+    def record(self, offset: int) -> bytes:
+        """ JSON bytes of the record at an offset
+        """
+        length = LENGTH.unpack_from(self.buffer, offset)[0]
+        start = offset + self.record_header.size
+        return self.buffer[start:start + length]
+
+    def probe(self, key: int, h: int) -> Iterator[int]:
+        """ Offsets of the records whose `key`-th hash is h
+        """
+        if self.slots == 0:
+            return
+        base = HEADER.size + key * self.slots * SLOT.size
+        i = h & (self.slots - 1)
+        while True:
+            slot_h, offset = SLOT.unpack_from(self.buffer,
+                                              base + i * SLOT.size)
+            if offset == 0:
+                return
+            if slot_h == h:
+                yield offset
+            i = (i + 1) & (self.slots - 1)
+
+    def close(self):
+        """ Unmap the file
+        """
+        self.buffer.close()
+
+
+def write_table(file_path: str, generation: int, records: list,
+                n_keys: int):
+    """ Write a table file from (hashes, json bytes) records
+    """
+    slots = 8
+    while slots < 2 * len(records):
+        slots *= 2
+    record_header = struct.Struct('<I' + 'Q' * n_keys)
+    records_offset = HEADER.size + n_keys * slots * SLOT.size
+    tables = [[(0, 0)] * slots for _ in range(n_keys)]
+    body = bytearray()
+    for hashes, data in records:
+        offset = records_offset + len(body)
+        for key, h in enumerate(hashes):
+            table = tables[key]
+            i = h & (slots - 1)
+            while table[i][1] != 0:
+                i = (i + 1) & (slots - 1)
+            table[i] = (h, offset)
+        body += record_header.pack(len(data), *hashes)
+        body += data
+    with atomic_write(file_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, generation, len(records), slots))
+        for table in tables:
+            f.write(b''.join(SLOT.pack(h, offset) for h, offset in table))
+        f.write(body)
+
+
+class SharedTableStorage(Storage):
+    """ Memory-mapped table storage shared by forked workers
+    """
+
+    def __init__(self):
+        """ Initialize the storage
+        """
+        self.tables = {}
+        self.classes = {}
+        self.versions = {}
+        self.lock = threading.RLock()
+
+    def keys(self, cls) -> tuple:
+        """ Indexed attributes of a class, id first
+        """
+        return ('id',) + tuple(k for k in cls.hash_indexes() if k != 'id')
+
+    def key_hash(self, cls, name: str, value) -> int:
+        """ Hash of the value of an attribute in its index
+        """
+        if name in cls.case_insensitive:
+            value = fold(value)
+        return key_hash(value)
+
+    def file_path(self, cls) -> str:
+        """ Table file of a class
+        """
+        return ".db_{}.table".format(cls.__name__)
+
+    def table(self, cls) -> Table:
+        """ Current mapped table of a class, None if there is none
+        """
+        table = self.tables.get(cls.__name__)
+        if table is None and path.exists(self.file_path(cls)):
+            with self.lock:
+                table = self.map(cls)
+        return table
+
+    def map(self, cls) -> Table:
+        """ Map the current table file of a class
+        """
+        table = Table(self.file_path(cls), len(self.keys(cls)))
+        self.tables[cls.__name__] = table
+        self.classes[cls.__name__] = cls
+        return table
+
+    def load(self, cls):
+        """ Map the table of a class, building it from the JSON file
+        of the class the first time
+        """
+        file_path = ".db_{}.json".format(cls.__name__)
+        with self.lock, FileLock(".db_{}.lock".format(cls.__name__)):
+            if not path.exists(self.file_path(cls)):
+                records = []
+                if path.exists(file_path):
+                    with open(file_path, 'r') as f:
+                        for obj_json in json.load(f).values():
+                            records.append(self.encode(cls(**obj_json)))
+                write_table(self.file_path(cls), 0, records,
+                            len(self.keys(cls)))
+            table = self.map(cls)
+            self.changed(cls)
+        for name in cls.unique:
+            report_duplicates(cls, name, self.duplicates(cls, table, name))
+
+    def sync(self, cls=None):
+        """ Map the tables replaced by another process
+        """
+        if cls is None:
+            for klass in list(self.classes.values()):
+                self.sync(klass)
+            return
+        table = self.tables.get(cls.__name__)
+        try:
+            st = os.stat(self.file_path(cls))
+        except OSError:
+            return
+        if table is None or \
+                table.version != (st.st_ino, st.st_mtime_ns, st.st_size):
+            with self.lock:
+                self.map(cls)
+                self.changed(cls)
+
+    def changed(self, cls):
+        """ Record that a class was mapped anew or changed by another
+        process
+        """
+        s_class = cls.__name__
+        self.versions[s_class] = self.versions.get(s_class, 0) + 1
+
+    def version(self, cls):
+        """ Number of tables of a class mapped by `load` and `sync`
+        """
+        return self.versions.get(cls.__name__, 0)
+
+    def flush(self, cls):
+        """ Nothing to do: every change is written when made
+        """
+        pass
+
+    def encode(self, obj: TypeVar('Base')) -> tuple:
+        """ (hashes, json bytes) record of an object
+        """
+        cls = obj.__class__
+        obj_json = obj.to_json(True)
+        hashes = []
+        for k in self.keys(cls):
+            try:
+                hashes.append(self.key_hash(cls, k, obj_json.get(k)))
+            except TypeError:
+                hashes.append(0)
+        return tuple(hashes), json.dumps(obj_json).encode()
+
+    def build(self, cls, data: bytes) -> TypeVar('Base'):
+        """ Object of a class from its record
+        """
+        return cls.from_json(json.loads(data))
+
+    def write(self, cls, changes: dict, expected: dict = None,
+              notify: Callable = None) -> set:
+        """ Next generation of the table with objects replaced, added
+        or removed (None), by ID. The objects get their next version,
+        checked against `expected`, and `notify` is called once the
+        table is written, under its lock (see Storage.apply). Returns
+        the IDs which had a record
+        """
+        with self.lock, FileLock(".db_{}.lock".format(cls.__name__)):
+            self.sync(cls)
+            table = self.table(cls)
+            saved = [obj for obj in changes.values() if obj is not None]
+            previous = set_versions(saved, check_versions(
+                saved, expected,
+                lambda obj_id: getattr(self.get(cls, obj_id), 'version',
+                                       None)))
+            try:
+                changes = {obj_id: None if obj is None else self.encode(obj)
+                           for obj_id, obj in changes.items()}
+                self.check_unique(cls, table, changes)
+            except BaseException:
+                set_versions(saved, previous)
+                raise
+            id_hashes = {key_hash(obj_id) for obj_id in changes}
+            records = []
+            found = set()
+            if table is not None:
+                for offset, hashes, data in table.records():
+                    if hashes[0] in id_hashes:
+                        obj_id = json.loads(data)['id']
+                        if obj_id in changes:
+                            found.add(obj_id)
+                            if changes[obj_id] is not None:
+                                records.append(changes[obj_id])
+                            continue
+                    records.append((hashes, data))
+            for obj_id, record in changes.items():
+                if record is not None and obj_id not in found:
+                    records.append(record)
+            if len(found) == 0 and \
+                    all(record is None for record in changes.values()):
+                return found
+            generation = table.generation + 1 if table is not None else 1
+            write_table(self.file_path(cls), generation, records,
+                        len(self.keys(cls)))
+            self.map(cls)
+            if notify is not None:
+                notify([obj_id for obj_id in found
+                        if changes[obj_id] is None])
+        return found
+
+    def check_unique(self, cls, table: Table, changes: dict):
+        """ Raise UniqueConstraintError if a record duplicates the value
+        of a unique attribute of another record, changed or not, unless
+        its object already had it: duplicates stored before are kept
+        """
+        keys = self.keys(cls)
+        for name in cls.unique:
+            key = keys.index(name)
+            seen = set()
+            for obj_id, record in changes.items():
+                if record is None:
+                    continue
+                value = json.loads(record[1]).get(name)
+                if value is None:
+                    continue
+                folded = fold(value) if name in cls.case_insensitive \
+                    else value
+                unchanged = taken = False
+                for offset in table.probe(key, record[0][key]) \
+                        if table is not None else ():
+                    other = json.loads(table.record(offset))
+                    other_value = other.get(name)
+                    if name in cls.case_insensitive:
+                        other_value = fold(other_value)
+                    if other_value != folded:
+                        continue
+                    if other['id'] == obj_id:
+                        unchanged = True
+                    elif other['id'] not in changes:
+                        taken = True
+                if unchanged:
+                    continue
+                if taken:
+                    raise UniqueConstraintError(name, value)
+                try:
+                    if folded in seen:
+                        raise UniqueConstraintError(name, value)
+                    seen.add(folded)
+                except TypeError:
+                    pass
+
+    def duplicates(self, cls, table: Table, name: str) -> dict:
+        """ IDs of the records sharing a value of an attribute, by value
+        """
+        key = self.keys(cls).index(name)
+        by_hash = {}
+        for offset, hashes, data in table.records():
+            by_hash.setdefault(hashes[key], []).append(offset)
+        duplicates = {}
+        for offsets in by_hash.values():
+            if len(offsets) < 2:
+                continue
+            for offset in offsets:
+                record = json.loads(table.record(offset))
+                value = record.get(name)
+                if name in cls.case_insensitive:
+                    value = fold(value)
+                try:
+                    if value is not None:
+                        duplicates.setdefault(value, []).append(record['id'])
+                except TypeError:
+                    pass
+        return {value: ids for value, ids in duplicates.items()
+                if len(ids) > 1}
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID
+        """
+        found = self.lookup(cls, {'id': obj_id})
+        if not found:
+            return None
+        return found[0]
+
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        self.write(obj.__class__, {obj.id: obj})
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object
+        """
+        return obj.id in self.write(obj.__class__, {obj.id: None})
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Remove and store objects in one new generation of the table
+        """
+        changes = {obj_id: None for obj_id in removed}
+        for obj in saved:
+            changes[obj.id] = obj
+        found = self.write(cls, changes, expected, notify)
+        return sum(1 for obj_id in set(removed) if obj_id in found and
+                   changes[obj_id] is None)
+
+    def scan(self, cls) -> Iterable[TypeVar('Base')]:
+        """ Objects of a class, decoded one at a time
+        """
+        table = self.table(cls)
+        if table is None:
+            return
+        for offset, hashes, data in table.records():
+            yield self.build(cls, data)
+
+    def count(self, cls, attributes: dict = {}) -> int:
+        """ Number of records, or of records with indexed attributes
+        """
+        if len(attributes) == 0:
+            table = self.table(cls)
+            return table.count if table is not None else 0
+        found = self.lookup(cls, attributes)
+        return len(found) if found is not None else None
+
+    def lookup(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects matching attributes, probing the index of the first
+        indexed one
+        """
+        keys = self.keys(cls)
+        for k, v in attributes.items():
+            if k in keys:
+                break
+        else:
+            return None
+        try:
+            h = self.key_hash(cls, k, v)
+        except TypeError:
+            return None
+        table = self.table(cls)
+        if table is None:
+            return []
+        found = []
+        for offset in table.probe(keys.index(k), h):
+            obj = self.build(cls, table.record(offset))
+            if matches(obj, attributes):
+                found.append(obj)
+        return found
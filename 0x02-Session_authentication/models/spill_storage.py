@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+""" Spill storage module
+
+Backend keeping a bounded number of objects in memory: every class is
+stored in an append-only record file, `.db_<class name>.spill`, and
+only the offsets of its live records and its indexes stay resident.
+The objects read or saved recently are kept in an LRU of at most
+`max_objects` objects shared by all the classes; the others are read
+back from the file, by offset, when needed.
+
+File layout (little-endian): the header of a record file (see
+models.record_file), then one entry per change:
+    [payload length][op][payload]
+with op PUT and the record of the object as payload, or op DELETE and
+the ID of the removed object.
+
+A change appends entries and never rewrites the file: the file is
+compacted, copying the live records to a new file, once it holds more
+dead entries than live ones. It must be written by one process only.
+
+Without a column store, counting objects by attribute scans the file.
+"""
+from collections import OrderedDict
+from os import path
+from typing import Callable, TypeVar, Iterable, Iterator, List
+import json
+import os
+import struct
+import threading
+from models.index import HashIndex, SortedIndex
+from models.layered import LayeredDict
+from models.record_file import HEADER, MAGIC, RecordCodec
+from models.storage import Storage, atomic_write, check_versions, \
+    index_lookup, report_duplicates, set_versions
+
+
+ENTRY = struct.Struct('<IB')
+DELETE = 0
+PUT = 1
+COMPACT_MIN_DEAD = 1000
+
+
+def entry(op: int, payload: bytes) -> bytes:
+    """ Entry of a change in a spill file
+    """
+    return ENTRY.pack(len(payload), op) + payload
+
+
+class Table():
+    """ Resident state of a class: file offsets of its live records and
+    indexes. Never modified once published, like the Snapshot of
+    FileStorage
+    """
+
+    def __init__(self, cls, file_path: str, codec: RecordCodec):
+        """ Initialize an empty table reading a spill file
+        """
+        self.cls = cls
+        self.file_path = file_path
+        self.codec = codec
+        # Closed with the last table using it: readers may still hold
+        # the table of a compacted file
+        self.file = open(file_path, 'rb')
+        self.offsets = LayeredDict()
+        self.indexes = {}
+        self.dead = 0
+
+    def copy(self):
+        """ Copy of the table to apply changes to, sharing what they
+        don't change
+        """
+        table = Table.__new__(Table)
+        table.cls = self.cls
+        table.file_path = self.file_path
+        table.codec = self.codec
+        table.file = self.file
+        table.offsets = self.offsets.copy()
+        table.indexes = {name: [index.copy() for index in indexes]
+                         for name, indexes in self.indexes.items()}
+        table.dead = self.dead
+        return table
+
+    def raw(self, offset: int) -> bytes:
+        """ Entry at an offset of the file
+        """
+        fd = self.file.fileno()
+        length = ENTRY.unpack(os.pread(fd, ENTRY.size, offset))[0]
+        return os.pread(fd, ENTRY.size + length, offset)
+
+    def read(self, offset: int) -> TypeVar('Base'):
+        """ Object of the record at an offset of the file
+        """
+        return self.cls.from_json(
+            self.codec.decode(self.raw(offset)[ENTRY.size:]))
+
+    def put_all(self, objs: list, offsets: list):
+        """ Index objects whose records are at offsets. Raises
+        UniqueConstraintError if one duplicates a unique value
+        """
+        for indexes in self.indexes.values():
+            for index in indexes:
+                index.add_many(objs)
+        for obj, offset in zip(objs, offsets):
+            if obj.id in self.offsets:
+                self.dead += 1
+            self.offsets[obj.id] = offset
+
+    def delete(self, obj_id: str) -> bool:
+        """ Remove an object, False if it isn't there
+        """
+        if self.offsets.pop(obj_id, None) is None:
+            return False
+        for indexes in self.indexes.values():
+            for index in indexes:
+                index.discard(obj_id)
+        # The record of the object and the DELETE entry
+        self.dead += 2
+        return True
+
+
+def read_header(f, file_path: str) -> list:
+    """ Schema of the spill file open in f, positioned after the header
+    """
+    magic, schema_length = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("{} is not a spill file".format(file_path))
+    return json.loads(f.read(schema_length))['fields']
+
+
+class SpillStorage(Storage):
+    """ Append-only record file storage with an LRU of hot objects
+    """
+
+    def __init__(self, max_objects: int = 10000):
+        """ Initialize the storage, holding at most `max_objects`
+        objects in memory
+        """
+        self.max_objects = max_objects
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.writers = {}
+        self.hot = OrderedDict()
+        self.hot_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def data_path(self, cls) -> str:
+        """ Spill file of a class
+        """
+        return ".db_{}.spill".format(cls.__name__)
+
+    def table(self, cls) -> Table:
+        """ Current table of a class, read from its file when first used
+        """
+        table = self.tables.get(cls.__name__)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(cls.__name__)
+                if table is None:
+                    table = self.read(cls)
+        return table
+
+    def publish(self, cls, table: Table):
+        """ Make a table the current state of a class.
+        Must be called with the lock held
+        """
+        self.tables[cls.__name__] = table
+
+    def load(self, cls):
+        """ Read the file of a class, forgetting its hot objects
+        """
+        with self.lock:
+            self.read(cls)
+            self.forget(cls)
+
+    def read(self, cls) -> Table:
+        """ Build and publish the table of a class from its file,
+        created from `.db_<class name>.json` if missing and rewritten
+        if the fields of the class changed. Must be called with the
+        lock held
+        """
+        file_path = self.data_path(cls)
+        codec = RecordCodec(cls)
+        if not path.exists(file_path):
+            objs = []
+            json_path = ".db_{}.json".format(cls.__name__)
+            if path.exists(json_path):
+                with open(json_path, 'r') as f:
+                    objs = [cls.from_json(obj_json)
+                            for obj_json in json.load(f).values()]
+            self.rewrite(cls, codec, objs)
+        with open(file_path, 'rb') as f:
+            schema = read_header(f, file_path)
+        if schema != codec.schema:
+            self.rewrite(cls, codec, self.scan(cls, self.build(
+                cls, RecordCodec(cls, schema))))
+        table = self.build(cls, codec)
+        self.open_writer(cls)
+        self.publish(cls, table)
+        return table
+
+    def build(self, cls, codec: RecordCodec) -> Table:
+        """ Table of the spill file of a class, its records decoded one
+        at a time: only the values of the indexed attributes are kept
+        """
+        table = Table(cls, self.data_path(cls), codec)
+        names = set(cls.hash_indexes()) | set(cls.sorted_indexes)
+        values = {name: {} for name in names}
+        n_entries = 0
+        with open(table.file_path, 'rb') as f:
+            read_header(f, table.file_path)
+            offset = f.tell()
+            while True:
+                head = f.read(ENTRY.size)
+                if len(head) < ENTRY.size:
+                    break
+                length, op = ENTRY.unpack(head)
+                payload = f.read(length)
+                if len(payload) < length:
+                    # Entry cut short by a crash while appending
+                    break
+                n_entries += 1
+                if op == PUT:
+                    obj = cls.from_json(codec.decode(payload))
+                    table.offsets[obj.id] = offset
+                    for name in names:
+                        values[name][obj.id] = getattr(obj, name, None)
+                else:
+                    obj_id = payload.decode()
+                    table.offsets.pop(obj_id, None)
+                    for name in names:
+                        values[name].pop(obj_id, None)
+                offset += ENTRY.size + length
+        if path.getsize(table.file_path) > offset:
+            os.truncate(table.file_path, offset)
+        table.dead = n_entries - len(table.offsets)
+        for name in cls.hash_indexes():
+            index = HashIndex(name, unique=name in cls.unique,
+                              case_insensitive=name in cls.case_insensitive)
+            for obj_id, value in values[name].items():
+                index.add_value(obj_id, value, check=False)
+            table.indexes.setdefault(name, []).append(index)
+            if index.unique:
+                report_duplicates(cls, name, index.duplicates())
+        for name in cls.sorted_indexes:
+            index = SortedIndex(name)
+            index.add_values(values[name].items())
+            table.indexes.setdefault(name, []).append(index)
+        return table
+
+    def rewrite(self, cls, codec: RecordCodec, objs: Iterable):
+        """ Replace the spill file of a class by the records of objects
+        """
+        file_path = self.data_path(cls)
+        with atomic_write(file_path, 'wb') as f:
+            f.write(codec.header())
+            for obj in objs:
+                f.write(entry(PUT, codec.encode(obj)))
+
+    def open_writer(self, cls):
+        """ Open the spill file of a class for appending.
+        Must be called with the lock held
+        """
+        writer = self.writers.pop(cls.__name__, None)
+        if writer is not None:
+            writer.close()
+        self.writers[cls.__name__] = open(self.data_path(cls), 'ab')
+
+    def compact(self, cls):
+        """ Copy the live records of a class to a new spill file,
+        keeping the offsets in the order of the file
+        """
+        with self.lock:
+            table = self.table(cls)
+            offsets = {}
+            with atomic_write(table.file_path, 'wb') as f:
+                f.write(table.codec.header())
+                for obj_id, offset in sorted(table.offsets.items(),
+                                             key=lambda item: item[1]):
+                    offsets[obj_id] = f.tell()
+                    f.write(table.raw(offset))
+            compacted = Table(cls, table.file_path, table.codec)
+            compacted.offsets = LayeredDict(offsets)
+            # Same objects: the indexes are unchanged
+            compacted.indexes = table.indexes
+            self.open_writer(cls)
+            self.publish(cls, compacted)
+
+    def flush(self, cls):
+        """ Compact the file of a class: every change is already in it
+        """
+        self.compact(cls)
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID, from the LRU or read from file
+        """
+        key = (cls.__name__, obj_id)
+        with self.hot_lock:
+            try:
+                obj = self.hot.get(key)
+            except TypeError:
+                return None
+            if obj is not None:
+                self.hot.move_to_end(key)
+                self.hits += 1
+                return obj
+            self.misses += 1
+        table = self.table(cls)
+        offset = table.offsets.get(obj_id)
+        if offset is None:
+            return None
+        obj = table.read(offset)
+        with self.hot_lock:
+            # Not cached if changed meanwhile: the LRU holds the new one
+            if self.tables.get(cls.__name__) is table:
+                self.cache(key, obj)
+        return obj
+
+    def cache(self, key: tuple, obj: TypeVar('Base')):
+        """ Add an object to the LRU, evicting the least recently used
+        ones past `max_objects`. Must be called with hot_lock held
+        """
+        self.hot[key] = obj
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.max_objects:
+            self.hot.popitem(last=False)
+            self.evictions += 1
+
+    def forget(self, cls):
+        """ Drop the hot objects of a class
+        """
+        s_class = cls.__name__
+        with self.hot_lock:
+            for key in [key for key in self.hot if key[0] == s_class]:
+                del self.hot[key]
+
+    def put(self, obj: TypeVar('Base')):
+        """ Store an object, appending its record
+        """
+        self.apply(obj.__class__, [obj], [])
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object, appending a DELETE entry
+        """
+        return self.apply(obj.__class__, [], [obj.id]) > 0
+
+    def stored(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID as stored, hot or read from file, without
+        adding it to the LRU
+        """
+        obj = self.hot.get((cls.__name__, obj_id))
+        if obj is None:
+            table = self.table(cls)
+            offset = table.offsets.get(obj_id)
+            if offset is not None:
+                obj = table.read(offset)
+        return obj
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Remove objects by ID and store others in one new table,
+        their entries appended in one write. Nothing is changed if an
+        object breaks a unique constraint or doesn't have its expected
+        version. `notify` is called once written, under the writer lock
+        (see Storage.apply). Returns the number of objects removed
+        """
+        s_class = cls.__name__
+        with self.lock:
+            versions = check_versions(
+                saved, expected,
+                lambda obj_id: getattr(self.stored(cls, obj_id), 'version',
+                                       None))
+            table = self.table(cls).copy()
+            writer = self.writers[s_class]
+            offset = writer.seek(0, os.SEEK_END)
+            chunks = []
+            removed_ids = []
+            for obj_id in removed:
+                if table.delete(obj_id):
+                    removed_ids.append(obj_id)
+                    chunks.append(entry(DELETE, obj_id.encode()))
+                    offset += len(chunks[-1])
+            previous = set_versions(saved, versions)
+            try:
+                offsets = []
+                for obj in saved:
+                    offsets.append(offset)
+                    chunks.append(entry(PUT, table.codec.encode(obj)))
+                    offset += len(chunks[-1])
+                table.put_all(saved, offsets)
+            except BaseException:
+                set_versions(saved, previous)
+                raise
+            if len(chunks) == 0:
+                return 0
+            writer.write(b''.join(chunks))
+            writer.flush()
+            self.publish(cls, table)
+            with self.hot_lock:
+                for obj_id in removed_ids:
+                    self.hot.pop((s_class, obj_id), None)
+                for obj in saved:
+                    self.cache((s_class, obj.id), obj)
+            if notify is not None:
+                notify(removed_ids)
+            if table.dead > max(COMPACT_MIN_DEAD, len(table.offsets)):
+                self.compact(cls)
+        return len(removed_ids)
+
+    def rollback(self, cls, objs: list):
+        """ Read back the records of the hot objects among `objs`: they
+        may have been changed in place
+        """
+        s_class = cls.__name__
+        table = self.table(cls)
+        for obj in objs:
+            offset = table.offsets.get(obj.id)
+            with self.hot_lock:
+                hot = self.hot.get((s_class, obj.id))
+            if offset is not None and hot is obj:
+                obj._restore(table.read(offset))
+
+    def scan(self, cls, table: Table = None) -> Iterator[TypeVar('Base')]:
+        """ All objects of a class, read from file unless hot. The
+        objects read aren't added to the LRU
+        """
+        if table is None:
+            table = self.table(cls)
+        s_class = cls.__name__
+        for obj_id, offset in table.offsets.items():
+            obj = self.hot.get((s_class, obj_id))
+            if obj is None:
+                obj = table.read(offset)
+            yield obj
+
+    def count(self, cls, attributes: dict = {}) -> int:
+        """ Number of live records, None if filtered by attributes
+        """
+        if len(attributes) == 0:
+            return len(self.table(cls).offsets)
+        return None
+
+    def indexes(self, cls, name: str) -> list:
+        """ Indexes on an attribute of a class
+        """
+        return self.table(cls).indexes.get(name, [])
+
+    def lookup(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Lookup by ID or through the smallest hash index bucket
+        """
+        table = self.table(cls)
+        if len(attributes) == 1 and 'id' in attributes:
+            obj = self.get(cls, attributes['id'])
+            return [obj] if obj is not None else []
+        return index_lookup(table.indexes, attributes,
+                            lambda obj_id: self.get(cls, obj_id))
+
+    def stats(self) -> dict:
+        """ Hit/miss statistics of the LRU of hot objects
+        """
+        with self.hot_lock:
+            return {'size': len(self.hot), 'maxsize': self.max_objects,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+
+Each class is stored in its own table: the serialized object in a
+`data` column, plus one indexed column per attribute listed in the
+`indexes` or `unique` of the class, the latter with a unique index.
+The database runs in WAL mode so readers don't block the writer.
+
+A unique index can't be created on duplicates stored before the
+constraint: they are reported when loaded, and the constraint is
+checked by each save instead, keeping the duplicates stored.
+"""
+from os import path
+from typing import Callable, TypeVar, Iterable, List
+import json
+import os
+import sqlite3
+import threading
+from models.index import fold
+from models.storage import Storage, UniqueConstraintError, check_versions, \
+    report_duplicates, set_versions
+
+
+SCALAR_TYPES = (str, int, float, type(None))
+UPDATED_AT = "json_extract(data, '$.updated_at')"
+
+
+def collate(cls, name: str) -> str:
+    """ Collation of the column of an attribute in its unique index
+    """
+    return " COLLATE NOCASE" if name in cls.case_insensitive else ""
+
+
+class SQLiteStorage(Storage):
+    """ SQLite storage
+    """
+
+    def __init__(self, db_path: str = ".db.sqlite3"):
+        """ Initialize the storage on a database file
+        """
+        self.db_path = db_path
+        self.local = threading.local()
+        self.statements = {}
+        self.unenforced = {}
+        self.lock = threading.Lock()
+        self.monitor = None
+        self.data_version = None
+        self.generation = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = conn
+        return conn
+
+    def sql(self, cls) -> dict:
+        """ Statements of a class, built once and reused so that
+        sqlite3 serves them from its prepared statement cache
+        """
+        s_class = cls.__name__
+        statements = self.statements.get(s_class)
+        if statements is not None:
+            return statements
+        table = '"{}"'.format(s_class)
+        names = cls.hash_indexes()
+        columns = ['"{}"'.format(k) for k in names]
+        statements = {
+            'create': "CREATE TABLE IF NOT EXISTS {} (id TEXT PRIMARY KEY, "
+                      "data TEXT NOT NULL{})".format(
+                          table, "".join(", " + c for c in columns)),
+            'indexes': ['CREATE INDEX IF NOT EXISTS "{}_{}" ON {} ({})'
+                        .format(s_class, k, table, c)
+                        for k, c in zip(names, columns)] + [
+                'CREATE INDEX IF NOT EXISTS "{}_updated_at_id" ON {} '
+                '({}, id)'.format(s_class, table, UPDATED_AT)],
+            'unique': {k: 'CREATE UNIQUE INDEX IF NOT EXISTS "{}_{}_unique" '
+                          'ON {} ("{}"{})'.format(s_class, k, table, k,
+                                                  collate(cls, k))
+                       for k in cls.unique},
+            'duplicates': {k: 'SELECT "{0}", json_group_array(id) FROM {1} '
+                              'WHERE "{0}" IS NOT NULL GROUP BY "{0}"{2} '
+                              'HAVING COUNT(*) > 1'.format(k, table,
+                                                           collate(cls, k))
+                           for k in cls.unique},
+            'taken': {k: 'SELECT id FROM {} WHERE "{}" = ?{}'.format(
+                table, k, collate(cls, k)) for k in cls.unique},
+            'get': "SELECT data FROM {} WHERE id = ?".format(table),
+            'version': "SELECT json_extract(data, '$.version') FROM {} "
+                       "WHERE id = ?".format(table),
+            'put': "INSERT INTO {} (id, data{}) VALUES (?, ?{}) "
+                   "ON CONFLICT(id) DO UPDATE SET data = excluded.data{}"
+                   .format(table, "".join(", " + c for c in columns),
+                           ", ?" * len(columns),
+                           "".join(", {0} = excluded.{0}".format(c)
+                                   for c in columns)),
+            'delete': "DELETE FROM {} WHERE id = ?".format(table),
+            'scan': "SELECT data FROM {} ORDER BY rowid".format(table),
+            # The first condition lets SQLite seek in the index
+            'updated_since': "SELECT data FROM {0} WHERE {1} >= ?1 AND "
+                             "({1}, id) > (?1, ?2) ORDER BY {1}, id".format(
+                                 table, UPDATED_AT),
+            'count': "SELECT COUNT(*) FROM {}".format(table),
+        }
+        with self.lock:
+            self.statements[s_class] = statements
+        return statements
+
+    def where(self, cls, attributes: dict) -> tuple:
+        """ WHERE clause and parameters of an equality predicate,
+        None if an attribute isn't indexed
+        """
+        clauses = []
+        params = []
+        for k, v in attributes.items():
+            if k != 'id' and k not in cls.hash_indexes():
+                return None
+            if type(v) not in SCALAR_TYPES:
+                return None
+            clauses.append('"{}" IS ?'.format(k))
+            params.append(v)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def load(self, cls):
+        """ Create the table of a class and its indexes. An empty table
+        is filled from the JSON file of the class if there is one
+        """
+        statements = self.sql(cls)
+        conn = self.connection
+        conn.execute(statements['create'])
+        file_path = ".db_{}.json".format(cls.__name__)
+        if self.count(cls) == 0 and path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+            with conn:
+                conn.execute("BEGIN")
+                for obj_json in objs_json.values():
+                    conn.execute(statements['put'],
+                                 self.row(cls(**obj_json)))
+        for create_index in statements['indexes']:
+            conn.execute(create_index)
+        unenforced = set()
+        for name, create_index in statements['unique'].items():
+            try:
+                conn.execute(create_index)
+            except sqlite3.IntegrityError:
+                unenforced.add(name)
+                report_duplicates(cls, name, self.duplicates(cls, name))
+        with self.lock:
+            self.unenforced[cls.__name__] = unenforced
+
+    def duplicates(self, cls, name: str) -> dict:
+        """ IDs of the rows sharing a value of an attribute, by value
+        """
+        rows = self.connection.execute(self.sql(cls)['duplicates'][name])
+        return {fold(value) if name in cls.case_insensitive else value:
+                json.loads(ids) for value, ids in rows}
+
+    def check_unique(self, cls, obj: TypeVar('Base')):
+        """ Raise UniqueConstraintError if an object takes the value of
+        another for a unique attribute whose index couldn't be created,
+        unless it already had it
+        """
+        for name in self.unenforced.get(cls.__name__, ()):
+            value = getattr(obj, name, None)
+            if value is None or type(value) not in SCALAR_TYPES:
+                continue
+            ids = [row[0] for row in self.connection.execute(
+                self.sql(cls)['taken'][name], (value,))]
+            if len(ids) > 0 and obj.id not in ids:
+                raise UniqueConstraintError(name, value)
+
+    def flush(self, cls):
+        """ Nothing to do: every change is committed when made
+        """
+        pass
+
+    def version(self, cls):
+        """ Number of commits seen by a connection of the process that
+        never writes, shared by the threads: it changes with the
+        commits of every thread and process
+        """
+        with self.lock:
+            if self.monitor is None or self.monitor[0] != os.getpid():
+                self.monitor = (os.getpid(), sqlite3.connect(
+                    self.db_path, isolation_level=None,
+                    check_same_thread=False))
+                self.data_version = None
+            data_version = self.monitor[1].execute(
+                "PRAGMA data_version").fetchone()[0]
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.generation += 1
+            return self.generation
+
+    def row(self, obj: TypeVar('Base')) -> list:
+        """ Parameters of the `put` statement for an object
+        """
+        obj_json = obj.to_json(True)
+        row = [obj.id, json.dumps(obj_json)]
+        for k in obj.hash_indexes():
+            value = obj_json.get(k)
+            row.append(value if type(value) in SCALAR_TYPES else None)
+        return row
+
+    def build(self, cls, data: str) -> TypeVar('Base'):
+        """ Object of a class from its serialized data
+        """
+        return cls.from_json(json.loads(data))
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID
+        """
+        if type(obj_id) is not str:
+            return None
+        row = self.connection.execute(self.sql(cls)['get'],
+                                      (obj_id,)).fetchone()
+        if row is None:
+            return None
+        return self.build(cls, row[0])
+
+    def stored_version(self, cls, obj_id: str) -> int:
+        """ Version of the stored object of an ID, None if not stored
+        """
+        row = self.connection.execute(self.sql(cls)['version'],
+                                      (obj_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        self.check_unique(obj.__class__, obj)
+        try:
+            self.connection.execute(self.sql(obj.__class__)['put'],
+                                    self.row(obj))
+        except sqlite3.IntegrityError as e:
+            raise self.unique_error(e, obj)
+
+    def unique_error(self, e: sqlite3.IntegrityError,
+                     obj: TypeVar('Base')) -> UniqueConstraintError:
+        """ UniqueConstraintError of a failed insert or update
+        """
+        # "UNIQUE constraint failed: <table>.<column>"
+        name = str(e).rsplit('.', 1)[-1]
+        return UniqueConstraintError(name, getattr(obj, name, None))
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Remove and store objects in one database transaction,
+        holding the write lock from its start so that the versions
+        checked are the ones replaced. `notify` is called before the
+        transaction commits, the lock still held (see Storage.apply)
+        """
+        statements = self.sql(cls)
+        conn = self.connection
+        removed_ids = []
+        previous = None
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                previous = set_versions(saved, check_versions(
+                    saved, expected,
+                    lambda obj_id: self.stored_version(cls, obj_id)))
+                for obj_id in removed:
+                    if conn.execute(statements['delete'],
+                                    (obj_id,)).rowcount > 0:
+                        removed_ids.append(obj_id)
+                for obj in saved:
+                    self.check_unique(cls, obj)
+                    try:
+                        conn.execute(statements['put'], self.row(obj))
+                    except sqlite3.IntegrityError as e:
+                        raise self.unique_error(e, obj)
+                if notify is not None:
+                    notify(removed_ids)
+        except BaseException:
+            if previous is not None:
+                set_versions(saved, previous)
+            raise
+        return len(removed_ids)
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object
+        """
+        cursor = self.connection.execute(self.sql(obj.__class__)['delete'],
+                                         (obj.id,))
+        return cursor.rowcount > 0
+
+    def scan(self, cls) -> Iterable[TypeVar('Base')]:
+        """ Stream all objects of a class
+        """
+        for row in self.connection.execute(self.sql(cls)['scan']):
+            yield self.build(cls, row[0])
+
+    def updated_since(self, cls, since: str,
+                      after_id: str) -> Iterable[TypeVar('Base')]:
+        """ Stream the objects updated after (since, after_id), through
+        the index on (updated_at, id)
+        """
+        for row in self.connection.execute(self.sql(cls)['updated_since'],
+                                           (since, after_id)):
+            yield self.build(cls, row[0])
+
+    def count(self, cls, attributes: dict = {}) -> int:
+        """ Count all rows, or the rows matching indexed attributes
+        """
+        statement = self.sql(cls)['count']
+        params = []
+        if len(attributes) > 0:
+            where = self.where(cls, attributes)
+            if where is None:
+                return None
+            statement += where[0]
+            params = where[1]
+        return self.connection.execute(statement, params).fetchone()[0]
+
+    def lookup(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects matching indexed attributes
+        """
+        if len(attributes) == 0:
+            return None
+        where = self.where(cls, attributes)
+        if where is None:
+            return None
+        statement = self.sql(cls)['scan'].replace(" ORDER BY",
+                                                  where[0] + " ORDER BY")
+        return [self.build(cls, row[0])
+                for row in self.connection.execute(statement, where[1])]
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+""" Storage module
+
+Interface shared by the storage backends of the Base models.
+"""
+from contextlib import contextmanager
+from typing import Callable, TypeVar, Iterable, List
+import os
+import threading
+import warnings
+
+
+@contextmanager
+def atomic_write(file_path: str, mode: str = 'w'):
+    """ File open for writing, replacing `file_path` once closed. It is
+    written under a temporary name of its own per process and thread,
+    so that concurrent writers never write to the same file
+    """
+    tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class UniqueConstraintError(ValueError):
+    """ Raised when saving an object would duplicate the value of an
+    attribute declared unique by its class
+    """
+
+    def __init__(self, name: str, value):
+        """ Initialize with the attribute and its duplicated value
+        """
+        super().__init__("{} already exists".format(name))
+        self.name = name
+        self.value = value
+
+
+class DuplicateValuesWarning(UserWarning):
+    """ Issued when the objects loaded already share the value of an
+    attribute declared unique by their class. They can still be saved
+    with it, but no other object can take it
+    """
+
+    def __init__(self, cls_name: str, name: str, duplicates: dict):
+        """ Initialize with the IDs of the objects sharing each value
+        """
+        super().__init__("{} {} values stored by more than one {}".format(
+            len(duplicates), name, cls_name))
+        self.name = name
+        self.duplicates = duplicates
+
+
+def matches(obj: TypeVar('Base'), attributes: dict) -> bool:
+    """ True if an object has all the attributes of a search
+    """
+    for k, v in attributes.items():
+        if (getattr(obj, k, None) != v):
+            return False
+    return True
+
+
+def index_lookup(indexes: dict, attributes: dict,
+                 get) -> List[TypeVar('Base')]:
+    """ Objects with matching attributes found through the smallest
+    bucket of the hash indexes, {name: [index, ...]}, `get(ID)` giving
+    the object of an ID, None if not stored. None if no index applies
+    """
+    from models.index import HashIndex
+    best = None
+    for k, v in attributes.items():
+        for index in indexes.get(k, []):
+            if not isinstance(index, HashIndex):
+                continue
+            try:
+                n = index.estimate(v)
+            except TypeError:
+                continue
+            if best is None or n < best[0]:
+                best = (n, index, v)
+    if best is None:
+        return None
+    found = []
+    for obj_id in best[1].lookup(best[2]):
+        obj = get(obj_id)
+        if obj is not None and matches(obj, attributes):
+            found.append(obj)
+    return found
+
+
+def report_duplicates(cls, name: str, duplicates: dict):
+    """ Warn of the values of a unique attribute stored more than once,
+    with the IDs of the objects storing them: {value: [ID, ...]}
+    """
+    if len(duplicates) > 0:
+        warnings.warn(DuplicateValuesWarning(cls.__name__, name, duplicates),
+                      stacklevel=2)
+
+
+class VersionConflictError(ValueError):
+    """ Raised when saving an object whose stored version isn't the
+    expected one: it was changed since it was read
+    """
+
+    def __init__(self, obj_id: str, expected: int, stored: int):
+        """ Initialize with the object ID and both versions
+        """
+        super().__init__("version {} expected, {} stored".format(
+            expected, stored))
+        self.obj_id = obj_id
+        self.expected = expected
+        self.stored = stored
+
+
+def check_versions(saved: list, expected: dict, stored_version):
+    """ Check that the objects about to be saved with an expected
+    version have it stored, `stored_version(ID)` giving the stored
+    version, None if not stored. Raises VersionConflictError.
+    Returns the next version of each object
+    """
+    versions = []
+    for obj in saved:
+        stored = stored_version(obj.id)
+        if expected and expected.get(obj.id) is not None and \
+                expected[obj.id] != (stored or 0):
+            raise VersionConflictError(obj.id, expected[obj.id], stored)
+        versions.append((stored or 0) + 1)
+    return versions
+
+
+def set_versions(saved: list, versions: list) -> list:
+    """ Give objects their new versions. Returns the previous ones
+    """
+    previous = []
+    for obj, version in zip(saved, versions):
+        previous.append(obj.version)
+        obj.version = version
+    return previous
+
+
+class ReadOnlyError(RuntimeError):
+    """ Raised when writing to a read-only storage
+    """
+
+    def __init__(self, message: str = "Read-only replica: "
+                 "send writes to the primary"):
+        """ Initialize with the reason of the refusal
+        """
+        super().__init__(message)
+
+
+class Storage():
+    """ Storage backend interface
+
+    Every method receives the Base subclass (or an instance of it) it
+    works on, so one backend serves all the models.
+    """
+
+    def load(self, cls):
+        """ Load or open the storage of a class
+        """
+        raise NotImplementedError()
+
+    def flush(self, cls):
+        """ Persist pending changes of a class
+        """
+        raise NotImplementedError()
+
+    def sync(self, cls=None):
+        """ Pick up the changes made by other processes to a class, or
+        to every class
+        """
+        pass
+
+    def version(self, cls):
+        """ Token changing whenever a class changes other than through
+        `put` and `delete` of this storage object (reload, change made
+        by another process), None if it never does
+        """
+        return None
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object of a class by ID, None if not found
+        """
+        raise NotImplementedError()
+
+    def put(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        raise NotImplementedError()
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove an object, False if it wasn't stored
+        """
+        raise NotImplementedError()
+
+    def apply(self, cls, saved: list, removed: list,
+              expected: dict = None, notify: Callable = None) -> int:
+        """ Remove objects of a class by ID and insert or update others
+        as one change: all or nothing where the backend supports it.
+        The saved objects get the version following the stored one;
+        `expected` maps the IDs of saved objects to the version they
+        must have stored, else VersionConflictError is raised and
+        nothing changes. Once the change is stored, and before another
+        can be, `notify` is called with the IDs removed, so that the
+        changes are published in the order they are stored: it must
+        not raise. Returns the number of objects removed
+        """
+        # Not atomic: backends check the versions under their writer lock
+        set_versions(saved, check_versions(
+            saved, expected,
+            lambda obj_id: getattr(self.get(cls, obj_id), 'version', None)))
+        removed_ids = []
+        for obj_id in removed:
+            obj = self.get(cls, obj_id)
+            if obj is not None and self.delete(obj):
+                removed_ids.append(obj_id)
+        for obj in saved:
+            self.put(obj)
+        if notify is not None:
+            notify(removed_ids)
+        return len(removed_ids)
+
+    def rollback(self, cls, objs: list):
+        """ Give their stored state back to the objects of a class held
+        by the storage among `objs`, changed in place by a save that
+        failed
+        """
+        pass
+
+    def scan(self, cls) -> Iterable[TypeVar('Base')]:
+        """ All objects of a class, in insertion order
+        """
+        raise NotImplementedError()
+
+    def count(self, cls, attributes: dict = {}) -> int:
+        """ Number of objects of a class with matching attributes,
+        None if the backend can't count them without a scan
+        """
+        raise NotImplementedError()
+
+    def indexes(self, cls, name: str) -> list:
+        """ In-memory indexes on an attribute of a class
+        """
+        return []
+
+    def lookup(self, cls, attributes: dict) -> List[TypeVar('Base')]:
+        """ Objects with matching attributes found through an index,
+        None if no index applies
+        """
+        return None
+
+    def columns(self, cls):
+        """ In-memory column store of a class (see models.columnar),
+        None if the backend keeps none
+        """
+        return None
+
+    def updated_since(self, cls, since: str,
+                      after_id: str) -> Iterable[TypeVar('Base')]:
+        """ Objects of a class updated after (since, after_id), `since`
+        as stored, in (updated_at, ID) order found through an index of
+        the backend, None if it has none
+        """
+        return None
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+""" Tombstones module
+
+Record of the removed objects, so that clients mirroring a class can
+drop them: an NDJSON file of {"class", "id", "removed_at"} lines,
+appended by the `removed` events of Base.events (see models.events)
+and read back, in (removed_at, ID) order, by every process sharing the
+file.
+"""
+from bisect import bisect_right, insort
+from datetime import datetime
+from typing import Iterator, Tuple
+import json
+import threading
+from models.events import ChangeLog
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class Tombstones():
+    """ Removed objects of every class, by removal date
+    """
+
+    def __init__(self, file_path: str = ".db_tombstones.ndjson"):
+        """ Initialize on a tombstone file, read when first queried
+        """
+        self.file_path = file_path
+        self.position = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        """ Append the tombstone of a removed object
+        """
+        if event['event'] != 'removed':
+            return
+        line = json.dumps({'class': event['class'], 'id': event['id'],
+                           'removed_at': datetime.utcnow().strftime(
+                               TIMESTAMP_FORMAT)})
+        with open(self.file_path, 'a') as f:
+            f.write(line + "\n")
+
+    def sync(self):
+        """ Read the tombstones appended since the last call, by this
+        process or another one
+        """
+        with self.lock:
+            lines, self.position = ChangeLog.read(self.file_path,
+                                                  self.position)
+            changed = {}
+            for line in lines:
+                s_class = line['class']
+                if s_class not in changed:
+                    # Copied: readers may be iterating over the list
+                    changed[s_class] = list(self.entries.get(s_class, []))
+                removed_at = datetime.strptime(line['removed_at'],
+                                               TIMESTAMP_FORMAT)
+                insort(changed[s_class], (removed_at, line['id']))
+            self.entries.update(changed)
+
+    def since(self, cls, since: datetime,
+              after_id: str = "") -> Iterator[Tuple[datetime, str]]:
+        """ (removed_at, ID) of the objects of a class removed after
+        (since, after_id), in that order
+        """
+        self.sync()
+        entries = self.entries.get(cls.__name__, [])
+        for i in range(bisect_right(entries, (since, after_id)),
+                       len(entries)):
+            yield entries[i]
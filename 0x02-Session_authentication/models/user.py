@@ -2,12 +2,18 @@
 """ User module
 """
 import hashlib
-from models.base import Base
+from models.base import Base, intern_value
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    compact_timestamps = True
+    indexes = ('email',)
+    unique = ('email',)
+    # None unless configured with SORTED_INDEXES (see api.v1.config)
+    sorted_indexes = ()
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -15,8 +21,8 @@ class User(Base):
         super().__init__(*args, **kwargs)
         self.email = kwargs.get('email')
         self._password = kwargs.get('_password')
-        self.first_name = kwargs.get('first_name')
-        self.last_name = kwargs.get('last_name')
+        self.first_name = intern_value(kwargs.get('first_name'))
+        self.last_name = intern_value(kwargs.get('last_name'))
 
     @property
     def password(self) -> str:
@@ -28,10 +34,15 @@ class User(Base):
     def password(self, pwd: str):
         """ Setter of a new password: encrypt in SHA256
         """
+        self._password = self.hash_password(pwd)
+
+    @staticmethod
+    def hash_password(pwd: str) -> str:
+        """ Stored form of a password, None if it isn't a string
+        """
         if pwd is None or type(pwd) is not str:
-            self._password = None
-        else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            return None
+        return hashlib.sha256(pwd.encode()).hexdigest().lower()
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+""" Tests of the models
+
+Run from the project directory: python3 -m pytest tests
+"""
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+""" Fixtures shared by the tests
+"""
+import pytest
+from models.base import Base
+from models.events import EventBus
+from models.file_storage import FileStorage, SNAPSHOTS, DATA
+from models.shared_table import SharedTableStorage
+from models.spill_storage import SpillStorage
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+
+
+BACKENDS = {
+    'file': FileStorage,
+    'binary': lambda: FileStorage(binary=True),
+    'shards': lambda: FileStorage(shards=4),
+    'shared': lambda: FileStorage(shared=True),
+    'sqlite': SQLiteStorage,
+    'shared_table': SharedTableStorage,
+    'spill': SpillStorage,
+}
+
+
+def forget():
+    """ Drop the in-memory state of FileStorage, shared by its
+    instances
+    """
+    SNAPSHOTS.clear()
+    DATA.clear()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """ Run each test in an empty directory, restoring the storage of
+    the models afterwards
+    """
+    monkeypatch.chdir(tmp_path)
+    storage = Base.storage
+    forget()
+    yield tmp_path
+    Base.storage = storage
+    forget()
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def backend(request):
+    """ Function giving a new storage object of each backend, forgetting
+    the objects loaded by the previous one
+    """
+    def new_storage():
+        forget()
+        Base.storage = BACKENDS[request.param]()
+        return Base.storage
+
+    new_storage.name = request.param
+    return new_storage
+
+
+@pytest.fixture
+def configure(monkeypatch):
+    """ Function configuring the models from environment variables, as
+    api.v1.config does. The configuration is undone after the test
+    """
+    for name in ('storage', 'tombstones', 'query_cache', 'id_generator',
+                 'cache_json'):
+        monkeypatch.setattr(Base, name, getattr(Base, name))
+    monkeypatch.setattr(Base, 'events', EventBus())
+    for name in ('sorted_indexes', 'columnar'):
+        monkeypatch.setattr(User, name, getattr(User, name))
+
+    def configure_models(**environ):
+        from api.v1.config import configure_models
+        for name, value in environ.items():
+            monkeypatch.setenv(name, value)
+        configure_models()
+
+    return configure_models
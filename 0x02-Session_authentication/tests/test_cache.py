@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+""" Tests of the cache of search results
+"""
+import threading
+from models.base import Base
+from models.cache import QueryCache
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+
+
+def test_sqlite_cache_shared_by_threads(monkeypatch):
+    """ A result cached by a thread is a hit in another one, until
+    another connection commits a change
+    """
+    Base.storage = SQLiteStorage()
+    monkeypatch.setattr(Base, 'query_cache', QueryCache())
+    User.load_from_file()
+    User(email="a@x.io").save()
+    assert len(User.search({'email': "a@x.io"})) == 1
+
+    thread = threading.Thread(
+        target=lambda: User.search({'email': "a@x.io"}))
+    thread.start()
+    thread.join()
+    assert Base.query_cache.stats()['hits'] == 1
+
+    # Another process adding a user with the same first name
+    other = SQLiteStorage()
+    other.load(User)
+    User(email="b@x.io", first_name="B").save()
+    assert len(User.search({'first_name': "B"})) == 1
+    other.put(User(email="c@x.io", first_name="B"))
+    assert len(User.search({'first_name': "B"})) == 2
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+""" Tests of the column store
+"""
+from datetime import datetime, timedelta
+import pytest
+from models import columnar
+from models.columnar import CHUNK_SIZE, ColumnStore
+from models.query import In, Prefix, Range
+from models.user import User
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def scans(request, monkeypatch):
+    """ Scans vectorized through NumPy, if installed, and in Python
+    """
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(columnar, 'numpy', None)
+    return request.param
+
+
+def users(n: int) -> list:
+    """ n users, created a day apart from 2024-01-01
+    """
+    return [User(email="{}@x.io".format(i), first_name="AB"[i % 2],
+                 created_at=datetime(2024, 1, 1) + timedelta(days=i))
+            for i in range(n)]
+
+
+def store_of(objs: list) -> ColumnStore:
+    """ Column store of users
+    """
+    return ColumnStore.from_objects(User.fields(), objs, User.timestamps)
+
+
+def test_values_reclaimed():
+    """ Values no user holds anymore are dropped as they are replaced
+    or removed
+    """
+    user = users(1)[0]
+    store = store_of([user])
+    for i in range(300):
+        user.first_name = "name{}".format(i)
+        user.version = i
+        store.put(user)
+    for name in ('first_name', 'version', 'email'):
+        assert len(store.columns[name].values) == 1
+    assert store.count({'first_name': "name299"}) == 1
+    assert store.count({'first_name': "name298"}) == 0
+    store.delete(user.id)
+    assert len(store.columns['email'].values) == 0
+    assert store.count({}) == 0
+
+
+def test_copies_share_chunks():
+    """ A change copies the chunks of its row, not the columns
+    """
+    objs = users(3 * CHUNK_SIZE)
+    store = store_of(objs)
+    copy = store.copy()
+    objs[5].first_name = "C"
+    copy.put(objs[5])
+    before = store.columns['first_name'].codes.chunks
+    after = copy.columns['first_name'].codes.chunks
+    assert [a is b for a, b in zip(before, after)] == [False, True, True]
+    assert copy.ids.chunks == store.ids.chunks
+    assert store.count({'first_name': "C"}) == 0
+    assert copy.count({'first_name': "C"}) == 1
+
+
+def test_predicates(scans):
+    """ Equality, membership and date ranges are answered by the
+    store, as a scan would, deleted rows left out
+    """
+    objs = users(100)
+    store = store_of(objs)
+    for obj in objs[:60:2]:
+        store.delete(obj.id)
+    kept = [obj for obj in objs if obj.id in store.row_of]
+    week = Range(datetime(2024, 2, 1), datetime(2024, 2, 8))
+    cases = [
+        ({'first_name': "A"}, lambda u: u.first_name == "A"),
+        ({'first_name': In(["A", "C"])}, lambda u: u.first_name == "A"),
+        ({'created_at': week},
+         lambda u: week.match(u.created_at)),
+        ({'created_at': week, 'first_name': "B"},
+         lambda u: week.match(u.created_at) and u.first_name == "B"),
+        ({'created_at': Range(start=datetime(2024, 3, 1))},
+         lambda u: u.created_at >= datetime(2024, 3, 1)),
+        ({'created_at': objs[70].created_at},
+         lambda u: u is objs[70]),
+    ]
+    for where, match in cases:
+        expected = [u.id for u in kept if match(u)]
+        assert store.search(where) == expected
+        assert store.count(where) == len(expected)
+    assert store.count({'email': Prefix("1")}) is None
+    assert store.count({'version': Range(1, 2)}) is None
+    assert store.count({'created_at': Range("2024")}) is None
+
+
+def test_query_counts(configure, scans):
+    """ With COLUMNAR, queries on a date range are counted and filtered
+    by the column store of the users
+    """
+    configure(COLUMNAR="1")
+    User.load_from_file()
+    User.bulk_save(users(50))
+    store = User.storage.columns(User)
+    assert store is not None and store.count({}) == 50
+    query = User.query({'created_at': Range(datetime(2024, 1, 11),
+                                            datetime(2024, 1, 21))},
+                       order_by='created_at')
+    assert query.count() == 10
+    assert [u.email for u in query] == ["{}@x.io".format(i)
+                                        for i in range(10, 20)]
+    assert User.count({'first_name': "A"}) == 25
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+""" Tests of the configuration of the models from the environment
+"""
+from datetime import datetime
+from models.base import Base
+from models.file_storage import FileStorage
+from models.index import SortedIndex
+from models.user import User
+
+
+def test_sorted_indexes(configure):
+    """ No attribute has a sorted index unless configured, and
+    updated_since finds the same users with or without one
+    """
+    assert User.sorted_indexes == ()
+    users = [User(email="{}@x.io".format(i), updated_at=datetime(2024, 1, i))
+             for i in range(1, 6)]
+    User.bulk_save(users)
+    # Saving set updated_at to now: stored back with the dates
+    for user, day in zip(users, range(1, 6)):
+        user.updated_at = datetime(2024, 1, day)
+    FileStorage().flush(User)
+    User.load_from_file()
+    assert FileStorage().indexes(User, 'updated_at') == []
+    unindexed = [u.id for u in User.updated_since(datetime(2024, 1, 2))]
+
+    configure(SORTED_INDEXES="email,created_at,updated_at")
+    assert User.sorted_indexes == ('email', 'created_at', 'updated_at')
+    User.load_from_file()
+    indexes = User.storage.indexes(User, 'updated_at')
+    assert isinstance(indexes[0], SortedIndex)
+    indexed = [u.id for u in User.updated_since(datetime(2024, 1, 2))]
+    assert indexed == unindexed == [u.id for u in users[1:]]
+
+
+def test_cache_json(configure):
+    """ The JSON of the users is only kept when configured
+    """
+    user = User(email="a@x.io")
+    assert user.to_json() is not user.to_json()
+
+    configure(CACHE_JSON="1")
+    assert user.to_json() is user.to_json()
+    cached = user.to_json()
+    user.first_name = "A"
+    assert user.to_json() is not cached
+    assert user.to_json()['first_name'] == "A"
+
+
+def test_tombstones(configure):
+    """ The removed users are only recorded when configured, the
+    updated users then listed through a sorted index
+    """
+    configure()
+    assert Base.tombstones is None
+    User(email="a@x.io").save()
+    User.search({'email': "a@x.io"})[0].remove()
+
+    configure(TOMBSTONES="tombstones.ndjson")
+    user = User(email="b@x.io")
+    user.save()
+    user.remove()
+    assert [user_id for _, user_id in
+            User.removed_since(datetime(2000, 1, 1))] == [user.id]
+    assert User.sorted_indexes == ('updated_at',)
+    User.load_from_file()
+    assert isinstance(User.storage.indexes(User, 'updated_at')[0],
+                      SortedIndex)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+""" Tests of the change events
+"""
+from models.events import ChangeLog, EventBus
+from models.user import User
+
+
+def test_generations_shared_by_processes():
+    """ Change logs appending to one file, as the workers of a primary
+    do, number their events following the last one of the file
+    """
+    buses = []
+    for _ in range(2):
+        bus = EventBus()
+        bus.log = ChangeLog("changes.ndjson")
+        buses.append(bus)
+    users = [User(email="{}@x.io".format(i)) for i in range(4)]
+    for i, user in enumerate(users):
+        buses[i % 2].publish('created', user)
+    events, _ = ChangeLog.read("changes.ndjson")
+    assert [(e['generation'], e['id']) for e in events] == \
+        [(i + 1, user.id) for i, user in enumerate(users)]
+    assert [bus.generation for bus in buses] == [3, 4]
+
+    restarted = EventBus()
+    restarted.log = ChangeLog("changes.ndjson")
+    restarted.publish('removed', users[0])
+    assert ChangeLog.read("changes.ndjson")[0][-1]['generation'] == 5
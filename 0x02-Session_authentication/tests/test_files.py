@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+""" Tests of the files written by the storages
+"""
+import os
+import pytest
+import threading
+from models.base import Base
+from models.file_storage import FileStorage
+from models.storage import atomic_write
+from models.user import User
+from tests.conftest import forget
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def test_atomic_write_concurrent_writers():
+    """ Writers of the same file at the same time each replace it
+    whole, through temporary files of their own
+    """
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def write(content: str):
+        """ Write a file while the other thread writes it too
+        """
+        try:
+            with atomic_write("data.json") as f:
+                f.write(content)
+                barrier.wait()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(c * 1000,))
+               for c in "ab"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    with open("data.json") as f:
+        assert f.read() in ("a" * 1000, "b" * 1000)
+    assert os.listdir(".") == ["data.json"]
+
+
+def test_atomic_write_failure():
+    """ A write failing leaves the file and no temporary file
+    """
+    with open("data.json", "w") as f:
+        f.write("old")
+    try:
+        with atomic_write("data.json") as f:
+            f.write("new")
+            raise ValueError()
+    except ValueError:
+        pass
+    with open("data.json") as f:
+        assert f.read() == "old"
+    assert os.listdir(".") == ["data.json"]
+
+
+def test_failed_write_not_stored(monkeypatch):
+    """ A save whose file can't be written isn't kept in memory, and
+    the user gets its version back
+    """
+    Base.storage = FileStorage()
+    User.load_from_file()
+    user = User(email="a@x.io")
+    user.save()
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(FileStorage, 'write_file', fail)
+    user = User.get(user.id)
+    user.first_name = "A"
+    with pytest.raises(OSError):
+        user.save()
+    assert user.version == 1
+    assert User.get(user.id).first_name is None
+    with pytest.raises(OSError):
+        User(email="b@x.io").save()
+    assert User.count() == 1
+
+
+@pytest.mark.skipif(fcntl is None, reason="no file locks")
+def test_conversion_locks_exclusively(monkeypatch):
+    """ Files of another layout are converted and removed holding the
+    file lock exclusively, tolerating files another process removed
+    """
+    Base.storage = FileStorage(shared=True)
+    User.load_from_file()
+    User(email="a@x.io").save()
+    forget()
+    Base.storage = FileStorage(shared=True, shards=2)
+    remove_files = FileStorage.remove_files
+    blocked = []
+
+    def remove_removed(self, file_paths: list):
+        with open(".db_User.lock") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                fcntl.flock(f, fcntl.LOCK_UN)
+                blocked.append(False)
+            except BlockingIOError:
+                blocked.append(True)
+        for file_path in file_paths:
+            os.remove(file_path)
+        remove_files(self, file_paths)
+
+    monkeypatch.setattr(FileStorage, 'remove_files', remove_removed)
+    User.load_from_file()
+    assert blocked == [True]
+    assert not os.path.exists(".db_User.json")
+    assert User.count() == 1
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+""" Tests of the ID generators
+"""
+import os
+import pytest
+import uuid
+from models.ids import OrderedIds, RandomIds
+
+
+def test_random_ids():
+    """ Random IDs are distinct version 4 UUIDs
+    """
+    ids = RandomIds(batch_size=4)
+    made = [ids() for _ in range(100)]
+    assert len(set(made)) == 100
+    for obj_id in made:
+        assert uuid.UUID(obj_id).version == 4
+        assert str(uuid.UUID(obj_id)) == obj_id
+
+
+def test_ordered_ids():
+    """ Ordered IDs are version 7 UUIDs increasing as they are made
+    """
+    ids = OrderedIds()
+    made = [ids() for _ in range(5000)]
+    assert made == sorted(made)
+    assert len(set(made)) == 5000
+    assert all(uuid.UUID(obj_id).version == 7 for obj_id in made)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
+def test_ids_after_fork():
+    """ A forked process doesn't make the IDs of its parent from the
+    random bytes it inherited
+    """
+    for ids in (RandomIds(), OrderedIds()):
+        ids()
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            os.write(write, "\n".join(ids() for _ in range(10)).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as f:
+            child = f.read().split("\n")
+        os.waitpid(pid, 0)
+        parent = [ids() for _ in range(10)]
+        assert len(child) == 10
+        assert set(child).isdisjoint(parent)
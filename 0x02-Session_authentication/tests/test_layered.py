@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Tests of the dictionaries and sorted lists shared between copies
+"""
+import random
+from types import SimpleNamespace
+from models.index import CHUNK_SIZE, HashIndex, SortedEntries, \
+    SortedIndex, build
+from models.layered import LayeredDict
+
+
+def test_layered_dict():
+    """ Copies changed at random stay equal to dicts changed the same
+    way, without changing the dictionaries they were copied from
+    """
+    rng = random.Random(0)
+    layered = LayeredDict((i, i) for i in range(1000))
+    expected = dict(layered.items())
+    for _ in range(300):
+        previous, before = layered, dict(expected)
+        layered = layered.copy()
+        for _ in range(rng.randrange(1, 20)):
+            key = rng.randrange(1200)
+            if rng.random() < 0.3 and key in expected:
+                del layered[key]
+                del expected[key]
+            else:
+                layered[key] = expected[key] = rng.random()
+        assert dict(previous.items()) == before
+        assert len(layered) == len(expected)
+        assert dict(layered.items()) == expected
+        assert sorted(layered) == sorted(expected)
+        assert sorted(layered.values()) == sorted(expected.values())
+        assert layered.get(1500) is None and 1500 not in layered
+    assert layered == expected
+    assert len(layered.layer) <= max(64, len(layered.base) ** 0.5)
+
+
+def test_sorted_entries():
+    """ Copies changed at random stay sorted and equal to lists
+    changed the same way, without changing the ones they were copied
+    from
+    """
+    rng = random.Random(0)
+    items = sorted(rng.sample(range(100000), 5 * CHUNK_SIZE))
+    entries = SortedEntries(items)
+    for _ in range(200):
+        previous, before = entries, list(items)
+        entries = entries.copy()
+        for _ in range(rng.randrange(1, 50)):
+            if rng.random() < 0.4:
+                item = items.pop(rng.randrange(len(items)))
+                entries.remove(item)
+            else:
+                item = rng.randrange(100000) + 0.5
+                entries.insert(item)
+                items.append(item)
+                items.sort()
+        assert list(previous) == before
+        assert list(entries) == items
+    assert len(entries) == len(items)
+    for i in rng.sample(range(len(items)), 100):
+        assert entries[i] == items[i]
+        assert entries.bisect_left(items[i]) == i
+        assert entries.bisect_right(items[i]) == i + 1
+        j = rng.randrange(i, len(items) + 1)
+        assert list(entries.slice(i, j)) == items[i:j]
+        assert list(entries.slice(i, j, True)) == items[i:j][::-1]
+    assert entries[-1] == items[-1]
+
+
+def test_sorted_index_add_many():
+    """ Objects indexed at once, in one pass or one at a time, replace
+    their previous entries
+    """
+    rng = random.Random(0)
+    objs = {i: SimpleNamespace(id="id{}".format(i), n=rng.randrange(100))
+            for i in range(2000)}
+    index = build(SortedIndex, 'n', objs.values())
+    for batch_size in (10, 1000):
+        changed = []
+        for i in rng.sample(range(3000), batch_size):
+            objs[i] = SimpleNamespace(id="id{}".format(i), n=rng.choice(
+                [None, rng.randrange(100)]))
+            changed.append(objs[i])
+        index = index.copy()
+        index.add_many(changed)
+        expected = build(SortedIndex, 'n', objs.values())
+        assert list(index.entries) == list(expected.entries)
+        assert dict(index.key_of.items()) == dict(expected.key_of.items())
+        assert sorted(index.other) == sorted(expected.other)
+
+
+def test_hash_index_buckets():
+    """ A value held by one object maps to its ID, by several to a dict
+    of IDs, changed in copies without changing the index copied
+    """
+    objs = [SimpleNamespace(id="id{}".format(i), n=i % 3) for i in range(4)]
+    index = build(HashIndex, 'n', objs[:3])
+    assert index.buckets[0] == "id0"
+    copy = index.copy()
+    copy.add(objs[3])
+    assert copy.lookup(0) == ["id0", "id3"]
+    assert index.lookup(0) == ["id0"]
+    copy.add(SimpleNamespace(id="id0", n=1))
+    assert copy.buckets[0] == "id3"
+    assert copy.lookup(1) == ["id1", "id0"]
+    assert copy.estimate(1) == 2 and copy.estimate(2) == 1
+    assert copy.duplicates() == {1: ["id1", "id0"]}
+    copy.discard("id1")
+    assert copy.duplicates() == {}
+    assert index.lookup(1) == ["id1"]
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+""" Tests of the conversions of the files of FileStorage between
+numbers of shards and formats
+"""
+import glob
+import os
+from models.base import Base
+from models.file_storage import FileStorage
+from models.replica import ReplicaStorage
+from models.user import User
+from tests.conftest import forget
+
+
+def use(storage: FileStorage):
+    """ Load the users with a new storage object
+    """
+    forget()
+    Base.storage = storage
+    User.load_from_file()
+
+
+def save_users(*emails: str) -> list:
+    """ Save new users, returning their IDs
+    """
+    users = [User(email=email) for email in emails]
+    User.bulk_save(users)
+    return [user.id for user in users]
+
+
+def test_shards_merged():
+    """ Shard files loaded without shards are merged into one file and
+    removed: the changes saved next aren't lost
+    """
+    use(FileStorage(shards=4))
+    ids = save_users("a@x.io", "b@x.io", "c@x.io")
+    use(FileStorage())
+    assert sorted(glob.glob(".db_User*")) == [".db_User.json"]
+    assert User.count() == 3
+    user = User.get(ids[0])
+    user.first_name = "A"
+    user.save()
+    use(FileStorage())
+    assert User.get(ids[0]).first_name == "A"
+    use(FileStorage(shards=2))
+    assert sorted(glob.glob(".db_User*")) == [".db_User.0.json",
+                                              ".db_User.1.json"]
+    assert User.get(ids[0]).first_name == "A"
+
+
+def test_newest_files_read():
+    """ Stale shard files older than the single file are ignored, then
+    removed
+    """
+    use(FileStorage(shards=4))
+    save_users("a@x.io")
+    stale = glob.glob(".db_User.*.json")
+    for file_path in stale:
+        os.rename(file_path, file_path + ".old")
+    use(FileStorage())
+    save_users("b@x.io")
+    for file_path in stale:
+        os.rename(file_path + ".old", file_path)
+        os.utime(file_path, (0, 0))
+    use(FileStorage())
+    assert sorted(user.email for user in User.all()) == ["b@x.io"]
+    assert glob.glob(".db_User.*.json") == []
+
+
+def test_formats_converted():
+    """ Files of the other format are converted and removed: JSON to
+    record files and back, without losing the changes saved between
+    """
+    use(FileStorage(shards=2))
+    ids = save_users("a@x.io", "b@x.io")
+    use(FileStorage(binary=True))
+    assert sorted(glob.glob(".db_User*")) == [".db_User.bin"]
+    user = User.get(ids[0])
+    user.first_name = "A"
+    user.save()
+    use(FileStorage(binary=True))
+    assert User.get(ids[0]).first_name == "A"
+    use(FileStorage())
+    assert sorted(glob.glob(".db_User*")) == [".db_User.json"]
+    assert User.count() == 2
+    assert User.get(ids[0]).first_name == "A"
+
+
+def test_newest_format_read():
+    """ Of files in both formats, the newest are read, whatever the
+    format of the storage
+    """
+    use(FileStorage())
+    save_users("a@x.io")
+    os.rename(".db_User.json", "old.json")
+    use(FileStorage(binary=True))
+    save_users("b@x.io")
+    os.rename("old.json", ".db_User.json")
+    os.utime(".db_User.json", (0, 0))
+    use(FileStorage())
+    assert sorted(user.email for user in User.all()) == ["b@x.io"]
+    assert sorted(glob.glob(".db_User*")) == [".db_User.json"]
+
+    use(FileStorage(binary=True))
+    os.rename(".db_User.bin", "old.bin")
+    use(FileStorage())
+    save_users("c@x.io")
+    os.rename("old.bin", ".db_User.bin")
+    os.utime(".db_User.bin", (0, 0))
+    use(FileStorage(binary=True))
+    assert sorted(user.email for user in User.all()) == ["c@x.io"]
+    assert sorted(glob.glob(".db_User*")) == [".db_User.bin"]
+
+
+def test_replica_keeps_files():
+    """ A replica reads the files of the primary, whatever their layout,
+    without converting or removing them
+    """
+    use(FileStorage(shards=4))
+    save_users("a@x.io", "b@x.io")
+    files = sorted(glob.glob(".db_User*"))
+    use(ReplicaStorage())
+    assert User.count() == 2
+    assert sorted(glob.glob(".db_User*")) == files
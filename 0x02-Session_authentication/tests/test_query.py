@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+""" Tests of the queries
+"""
+from models.query import Eq
+from models.user import User
+
+
+def test_case_insensitive_count(monkeypatch):
+    """ Emails differing only in case share a bucket of a
+    case-insensitive index: it doesn't count the matches of a query
+    """
+    monkeypatch.setattr(User, 'unique', ())
+    monkeypatch.setattr(User, 'case_insensitive', ('email',))
+    monkeypatch.setattr(User, 'sorted_indexes', ())
+    User.load_from_file()
+    User.bulk_save([User(email=email)
+                    for email in ("bob@x.io", "Bob@x.io", "BOB@X.IO")])
+    query = User.query({'email': "Bob@x.io"})
+    assert query.explain() == {'index': 'email', 'estimate': 3}
+    assert [user.email for user in query.all()] == ["Bob@x.io"]
+    assert query.count() == 1
+    assert User.query({'email': Eq("bob@x.io")}).count() == 1
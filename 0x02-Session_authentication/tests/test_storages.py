@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+""" Tests of the storage backends, through the User model
+"""
+import copy
+import json
+import threading
+import pytest
+from benchmarks.synthetic import write_users
+from models.base import Base
+from models.events import ChangeLog
+from models.storage import DuplicateValuesWarning, UniqueConstraintError, \
+    VersionConflictError
+from models.user import User
+
+
+def new_user(email: str, **kwargs) -> User:
+    """ Unsaved user with an email
+    """
+    return User(email=email, **kwargs)
+
+
+def test_round_trip(backend):
+    """ Saved, updated and removed users are found so after a reload
+    """
+    backend()
+    User.load_from_file()
+    kept = new_user("a@x.io", first_name="A")
+    kept.save()
+    changed = new_user("b@x.io")
+    changed.save()
+    removed = new_user("c@x.io")
+    removed.save()
+    changed = User.get(changed.id)
+    changed.last_name = "B"
+    changed.save()
+    User.get(removed.id).remove()
+
+    backend()
+    User.load_from_file()
+    assert User.count() == 2
+    assert User.get(kept.id).first_name == "A"
+    assert User.get(kept.id).email == "a@x.io"
+    assert User.get(changed.id).last_name == "B"
+    assert User.get(changed.id).version == 2
+    assert User.get(removed.id) is None
+    assert [u.id for u in User.search({'email': "b@x.io"})] == [changed.id]
+
+
+def test_unique_email(backend):
+    """ A second user with an email in use isn't saved
+    """
+    backend()
+    User.load_from_file()
+    new_user("a@x.io").save()
+    with pytest.raises(UniqueConstraintError):
+        new_user("a@x.io").save()
+    assert User.count() == 1
+
+
+def test_duplicates_stored_before(backend):
+    """ Users sharing an email when loaded are reported, and can still
+    be saved with it, but no other user can take it. Saved from copies,
+    as the API does: a user rejected isn't changed in the storage
+    """
+    users = [new_user("a@x.io"), new_user("a@x.io"), new_user("b@x.io")]
+    with open(".db_User.json", 'w') as f:
+        json.dump({user.id: user.to_json(True) for user in users}, f)
+    backend()
+    with pytest.warns(DuplicateValuesWarning) as warned:
+        User.load_from_file()
+    assert [sorted(ids) for ids in warned[0].message.duplicates.values()] \
+        == [sorted(user.id for user in users[:2])]
+
+    for user in users[:2]:
+        user = copy.copy(User.get(user.id))
+        user.first_name = "A"
+        user.save()
+    with pytest.raises(UniqueConstraintError):
+        new_user("a@x.io").save()
+    user = copy.copy(User.get(users[2].id))
+    user.email = "a@x.io"
+    with pytest.raises(UniqueConstraintError):
+        user.save()
+    user = copy.copy(User.get(users[0].id))
+    user.email = "c@x.io"
+    user.save()
+    user = copy.copy(user)
+    user.email = "a@x.io"
+    with pytest.raises(UniqueConstraintError):
+        user.save()
+
+    backend()
+    User.load_from_file()
+    assert sorted(user.email for user in User.all()) == \
+        ["a@x.io", "b@x.io", "c@x.io"]
+    assert User.get(users[1].id).first_name == "A"
+
+
+def test_updated_since(backend):
+    """ The users updated after a (date, ID) cursor are found in that
+    order
+    """
+    write_users(200)
+    backend()
+    User.load_from_file()
+    users = sorted(User.all(), key=lambda user: (user.updated_at, user.id))
+    cursors = [(users[0].updated_at, ""),
+               (users[50].updated_at, users[50].id)]
+    for cursor in cursors:
+        expected = [user.id for user in users
+                    if (user.updated_at, user.id) > cursor]
+        assert [user.id for user in User.updated_since(*cursor)] == expected
+    assert len(expected) == 149
+
+
+def test_bulk_save_all_or_nothing(backend):
+    """ No user of a bulk save is stored if one breaks a constraint
+    """
+    backend()
+    User.load_from_file()
+    new_user("a@x.io").save()
+    with pytest.raises(UniqueConstraintError):
+        User.bulk_save([new_user("b@x.io"), new_user("a@x.io")])
+    assert User.search({'email': "b@x.io"}) == []
+
+    backend()
+    User.load_from_file()
+    assert User.count() == 1
+
+
+def test_failed_bulk_save_restores(backend):
+    """ The users of a failed bulk save get their previous version and
+    updated_at back, or their stored state if changed in place. The
+    other users held aren't replaced
+    """
+    backend()
+    User.load_from_file()
+    users = [new_user("a@x.io", first_name="A"),
+             new_user("b@x.io", first_name="B")]
+    User.bulk_save(users)
+    held = User.get(users[0].id)
+    changed = User.get(users[1].id)
+    updated_at = changed.updated_at
+    changed.first_name = "X"
+    added = new_user("c@x.io")
+    created_at = added.updated_at
+    with pytest.raises(UniqueConstraintError):
+        User.bulk_save([changed, added, new_user("a@x.io")])
+    assert (changed.version, changed.updated_at) == (1, updated_at)
+    assert (added.version, added.updated_at) == (0, created_at)
+    assert User.get(changed.id).first_name == "B"
+    assert User.get(held.id).first_name == "A"
+    if User.get(held.id) is User.get(held.id):
+        # Storages keeping the objects in memory still hold the same
+        assert User.get(held.id) is held
+        assert changed.first_name == "B"
+    with pytest.raises(UniqueConstraintError):
+        changed.email = "a@x.io"
+        changed.save()
+    assert User.search({'email': "a@x.io"}) == [held]
+
+
+def test_transaction(backend):
+    """ The changes of a transaction are stored together, or not at
+    all if it raises
+    """
+    backend()
+    User.load_from_file()
+    user = new_user("a@x.io")
+    user.save()
+    with Base.transaction():
+        new_user("b@x.io").save()
+        User.get(user.id).remove()
+    assert User.get(user.id) is None
+    assert User.count() == 1
+
+    with pytest.raises(RuntimeError):
+        with Base.transaction():
+            new_user("c@x.io").save()
+            raise RuntimeError()
+    assert User.count() == 1
+    assert User.search({'email': "c@x.io"}) == []
+
+
+def test_transaction_restores(backend):
+    """ The users saved in a transaction that raises get their stored
+    state back, whether changed in place or copies
+    """
+    backend()
+    User.load_from_file()
+    users = [new_user("a@x.io", first_name="A"),
+             new_user("b@x.io", first_name="B")]
+    for user in users:
+        user.save()
+    held = User.get(users[0].id)
+    copied = copy.copy(User.get(users[1].id))
+    with pytest.raises(RuntimeError):
+        with Base.transaction():
+            held.first_name = "X"
+            held.save()
+            copied.email = "c@x.io"
+            copied.save()
+            raise RuntimeError()
+    assert (held.first_name, held.version) == ("A", 1)
+    assert (copied.email, copied.version) == ("b@x.io", 1)
+    assert held.updated_at == User.get(held.id).updated_at
+    assert User.get(held.id).first_name == "A"
+    assert User.search({'email': "c@x.io"}) == []
+
+
+def test_version_conflict(backend):
+    """ A save expecting another version than the stored one fails
+    """
+    backend()
+    User.load_from_file()
+    user = new_user("a@x.io")
+    user.save()
+    assert user.version == 1
+    User.get(user.id).save(expected_version=1)
+    stale = User.get(user.id)
+    with pytest.raises(VersionConflictError):
+        stale.save(expected_version=1)
+    assert User.get(user.id).version == 2
+
+
+def test_version_stored_only(backend):
+    """ The version is stored, but left out of the public JSON
+    """
+    backend()
+    User.load_from_file()
+    user = new_user("a@x.io")
+    user.save()
+    backend()
+    User.load_from_file()
+    user = User.get(user.id)
+    assert user.to_json(True)['version'] == 1
+    assert 'version' not in user.to_json()
+    assert 'version' not in json.loads(user.to_json_bytes())
+
+
+def test_events_logged_in_commit_order(backend, configure):
+    """ The events of a change are logged before another change can be
+    stored, so that the change log follows the stored versions
+    """
+    configure(CHANGE_LOG="changes.ndjson")
+    backend()
+    User.load_from_file()
+    first = new_user("a@x.io")
+    second = new_user("b@x.io")
+    other = threading.Thread(target=second.save)
+    stored_meanwhile = []
+
+    def concurrent_save(event):
+        if event['id'] == first.id:
+            other.start()
+            other.join(0.2)
+            stored_meanwhile.append(User.get(second.id) is not None)
+
+    Base.events.subscribe(concurrent_save)
+    first.save()
+    other.join()
+    assert stored_meanwhile == [False]
+    events, _ = ChangeLog.read("changes.ndjson")
+    assert [(e['generation'], e['id']) for e in events] == \
+        [(1, first.id), (2, second.id)]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+""" Tests of the NDJSON import and export of the users
+"""
+import io
+import json
+import pytest
+from api.v1.users_ndjson import export_users, import_users
+from models.user import User
+
+
+def test_import_keeps_stored_users(backend):
+    """ Importing a user with the ID of a stored user fails, saving
+    none of the users, instead of overwriting it
+    """
+    backend()
+    User.load_from_file()
+    stored = User(email="a@x.io")
+    stored.password = "secret"
+    stored.save()
+    stored.save()
+    exported = io.StringIO()
+    assert export_users(exported) == 1
+
+    record = json.loads(exported.getvalue())
+    record.update(email="b@x.io", password="other", version=7)
+    del record['_password']
+    lines = [json.dumps({'email': "c@x.io", 'password': "pw"}),
+             json.dumps(record)]
+    with pytest.raises(ValueError, match=stored.id):
+        import_users(io.StringIO("\n".join(lines)))
+    user = User.get(stored.id)
+    assert (user.email, user.version) == ("a@x.io", 2)
+    assert user.is_valid_password("secret")
+    assert User.count() == 1
+
+    assert import_users(io.StringIO(lines[0])) == 1
+    assert User.count() == 2